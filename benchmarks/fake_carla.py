@@ -0,0 +1,425 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+In-process stand-in for the carla module. It implements the part of the carla API that is used by this repository,
+so the client side of a test (texture upload, camera callbacks, writer threads, test loop, video tools) can be measured
+without a simulator or GPU. Cameras deliver synthetic images with realistic raw_data from their own sensor thread, like
+the real client library.
+
+Usage:
+    import benchmarks.fake_carla as fake_carla
+    fake_carla.install()  # before the first import of carla
+"""
+
+import math
+from queue import Queue
+import sys
+import threading
+from time import sleep
+
+import numpy as np
+
+# simulated duration of an RPC call like apply_color_texture_to_object in seconds
+RPC_LATENCY = 0.0
+# simulated rendering time of a world tick in seconds
+RENDER_TIME = 0.0
+# seed of the synthetic images, so every run encodes exactly the same data
+IMAGE_SEED = 7
+
+
+def install():
+    """registers the stand-in as carla module. Has to be called before carla is imported anywhere"""
+    sys.modules['carla'] = sys.modules[__name__]
+
+
+class Color:
+    def __init__(self, r=0, g=0, b=0, a=255):
+        self.r = r
+        self.g = g
+        self.b = b
+        self.a = a
+
+
+class TextureColor:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self._pixels = [None] * (width * height)
+
+    def set(self, x, y, color):
+        self._pixels[y * self.width + x] = color
+
+    def get(self, x, y):
+        return self._pixels[y * self.width + x]
+
+
+class MaterialParameter:
+    Normal = 0
+    AO_Roughness_Metallic_Emissive = 1
+    Diffuse = 2
+
+
+class Vector3D:
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def length(self):
+        return math.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
+
+
+class Location(Vector3D):
+    def distance(self, other):
+        return math.sqrt((self.x - other.x) ** 2 + (self.y - other.y) ** 2 + (self.z - other.z) ** 2)
+
+    def __str__(self):
+        return f'Location(x={self.x}, y={self.y}, z={self.z})'
+
+
+class Rotation:
+    def __init__(self, pitch=0.0, yaw=0.0, roll=0.0):
+        self.pitch = pitch
+        self.yaw = yaw
+        self.roll = roll
+
+
+class Transform:
+    def __init__(self, location=None, rotation=None):
+        self.location = location or Location()
+        self.rotation = rotation or Rotation()
+
+    def __str__(self):
+        return f'Transform({self.location})'
+
+
+class BoundingBox:
+    def __init__(self, location=None, extent=None, rotation=None):
+        self.location = location or Location()
+        self.extent = extent or Vector3D()
+        self.rotation = rotation or Rotation()
+
+
+class CityObjectLabel:
+    Any = 0
+    Poles = 5
+    TrafficSigns = 8
+    Vehicles = 10
+
+
+class EnvironmentObject:
+    """static object of the map with a bounding box in world coordinates"""
+
+    def __init__(self, name, bounding_box, label=CityObjectLabel.TrafficSigns):
+        self.name = name
+        self.bounding_box = bounding_box
+        self.transform = Transform(bounding_box.location, bounding_box.rotation)
+        self.type = label
+
+
+class WeatherParameters:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class VehicleControl:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+_scenes = {}
+_scenes_lock = threading.Lock()
+
+
+def synthetic_scene(width, height):
+    """returns a (height, width * 2, 4) BGRA scene with gradients, edges and sensor noise. Images are cut out of it
+    with an offset per frame, so consecutive frames differ like frames of a moving camera"""
+    key = (width, height)
+    with _scenes_lock:
+        if key not in _scenes:
+            rng = np.random.default_rng(IMAGE_SEED)
+            y, x = np.mgrid[0:height, 0:width * 2]
+            scene = np.empty((height, width * 2, 4), dtype=np.uint8)
+            scene[:, :, 0] = (x * 255 // (width * 2)).astype(np.uint8)
+            scene[:, :, 1] = (y * 255 // height).astype(np.uint8)
+            scene[:, :, 2] = np.where((x // 32 + y // 32) % 2 == 0, 180, 60).astype(np.uint8)
+            noise = rng.integers(-12, 13, size=(height, width * 2, 3))
+            scene[:, :, :3] = np.clip(scene[:, :, :3] + noise, 0, 255).astype(np.uint8)
+            scene[:, :, 3] = 255
+            _scenes[key] = scene
+        return _scenes[key]
+
+
+class Image:
+    """camera image with BGRA raw_data like carla.Image"""
+
+    def __init__(self, frame, width, height):
+        self.frame = frame
+        self.width = width
+        self.height = height
+        offset = (frame * 4) % width
+        self.raw_data = bytearray(np.ascontiguousarray(synthetic_scene(width, height)[:, offset:offset + width]))
+
+    def save_to_disk(self, path):
+        from cv2 import imwrite
+        imwrite(path, np.frombuffer(self.raw_data, dtype=np.uint8).reshape(self.height, self.width, 4))
+
+
+class ActorAttribute:
+    def __init__(self, value):
+        self.recommended_values = [value]
+
+
+class ActorBlueprint:
+    def __init__(self, blueprint_id):
+        self.id = blueprint_id
+        self.attributes = {}
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def has_attribute(self, key):
+        return key == 'color' or key in self.attributes
+
+    def get_attribute(self, key):
+        return ActorAttribute(self.attributes.get(key, '0,0,0'))
+
+
+class BlueprintLibrary:
+    def find(self, blueprint_id):
+        return ActorBlueprint(blueprint_id)
+
+
+class Actor:
+    _next_id = 0
+    _id_lock = threading.Lock()
+
+    def __init__(self, world, blueprint, transform, parent=None):
+        with Actor._id_lock:
+            Actor._next_id += 1
+            self.id = Actor._next_id
+        self.world = world
+        self.type_id = blueprint.id if blueprint else 'spectator'
+        self.attributes = dict(blueprint.attributes) if blueprint else {}
+        self.transform = transform
+        self.parent = parent
+        self.velocity = Vector3D()
+        self.autopilot = False
+        self._callback = None
+        self._queue = None
+
+    def listen(self, callback):
+        self._callback = callback
+        self._queue = Queue()
+        threading.Thread(target=self._sensor_thread, name=f'sensor_{self.id}', daemon=True).start()
+
+    def _sensor_thread(self):
+        while True:
+            image = self._queue.get()
+            if image is None:
+                break
+            self._callback(image)
+
+    def deliver(self, frame):
+        if self._queue is not None:
+            width = int(self.attributes.get('image_size_x', 800))
+            height = int(self.attributes.get('image_size_y', 600))
+            self._queue.put(Image(frame, width, height))
+
+    def destroy(self):
+        self.world.remove_actor(self)
+        if self._queue is not None:
+            self._queue.put(None)
+        return True
+
+    def set_autopilot(self, enabled=True, tm_port=8000):
+        self.autopilot = enabled
+
+    def get_velocity(self):
+        return self.velocity
+
+    def get_transform(self):
+        return self.transform
+
+    def set_transform(self, transform):
+        self.transform = transform
+
+    def apply_control(self, control):
+        pass
+
+    def set_target_velocity(self, velocity):
+        self.velocity = Vector3D(velocity.x, velocity.y, velocity.z)
+
+    def set_target_angular_velocity(self, velocity):
+        pass
+
+    def set_simulate_physics(self, enabled=True):
+        pass
+
+
+class Map:
+    def get_spawn_points(self):
+        return [Transform(Location(x=float(i), y=0.0, z=0.0)) for i in range(0, 200)]
+
+
+class WorldSnapshot:
+    def __init__(self, frame):
+        self.frame = frame
+
+
+class WorldSettings:
+    def __init__(self):
+        self.synchronous_mode = False
+        self.fixed_delta_seconds = None
+        self.no_rendering_mode = False
+
+
+class World:
+    """world with a frame counter. Vehicles with autopilot accelerate by 0.5 m/s per tick, cameras deliver one image
+    per tick"""
+
+    def __init__(self):
+        self.frame = 1000
+        self.settings = WorldSettings()
+        self._actors = {}
+        self._lock = threading.Lock()
+        # static objects returned by get_environment_objects. Empty by default, filled by the benchmarks
+        self.environment_objects = []
+
+    def get_settings(self):
+        return self.settings
+
+    def apply_settings(self, settings):
+        self.settings = settings
+        return self.frame
+
+    def get_map(self):
+        return Map()
+
+    def get_spectator(self):
+        return Actor(self, None, Transform())
+
+    def get_blueprint_library(self):
+        return BlueprintLibrary()
+
+    def spawn_actor(self, blueprint, transform, attach_to=None):
+        actor = Actor(self, blueprint, transform, attach_to)
+        with self._lock:
+            self._actors[actor.id] = actor
+        return actor
+
+    def get_actors(self, actor_ids=None):
+        with self._lock:
+            if actor_ids is None:
+                return list(self._actors.values())
+            return [self._actors[actor_id] for actor_id in actor_ids if actor_id in self._actors]
+
+    def remove_actor(self, actor):
+        with self._lock:
+            self._actors.pop(actor.id, None)
+
+    def get_environment_objects(self, label=CityObjectLabel.Any):
+        return [obj for obj in self.environment_objects if label in (CityObjectLabel.Any, obj.type)]
+
+    def cast_ray(self, initial_location, final_location):
+        return []
+
+    def get_snapshot(self):
+        return WorldSnapshot(self.frame)
+
+    def set_weather(self, weather):
+        pass
+
+    def apply_color_texture_to_object(self, object_name, material_parameter, texture):
+        if RPC_LATENCY:
+            sleep(RPC_LATENCY)
+
+    def tick(self, seconds=10.0):
+        if RENDER_TIME:
+            sleep(RENDER_TIME)
+        with self._lock:
+            self.frame += 1
+            actors = list(self._actors.values())
+        for actor in actors:
+            if actor.autopilot:
+                actor.velocity.x += 0.5
+            if not self.settings.no_rendering_mode:
+                actor.deliver(self.frame)
+        return self.frame
+
+
+class TrafficManager:
+    def __init__(self, port):
+        self.port = port
+
+    def set_synchronous_mode(self, enabled):
+        pass
+
+    def get_port(self):
+        return self.port
+
+    def set_desired_speed(self, actor, speed):
+        pass
+
+    def ignore_signs_percentage(self, actor, percentage):
+        pass
+
+
+class command:
+    """batch commands like carla.command"""
+
+    class SpawnActor:
+        def __init__(self, blueprint, transform, parent_id=None):
+            self.blueprint = blueprint
+            self.transform = transform
+            self.parent_id = parent_id
+
+    class DestroyActor:
+        def __init__(self, actor_id):
+            self.actor_id = actor_id
+
+
+class CommandResponse:
+    def __init__(self, actor_id=0, error=''):
+        self.actor_id = actor_id
+        self.error = error
+
+    def has_error(self):
+        return bool(self.error)
+
+
+_world = World()
+
+
+class Client:
+    def __init__(self, host='127.0.0.1', port=2000):
+        self.host = host
+        self.port = port
+
+    def set_timeout(self, seconds):
+        pass
+
+    def get_world(self):
+        return _world
+
+    def load_world_if_different(self, map_name, reset_settings=True):
+        return None
+
+    def get_trafficmanager(self, port=8000):
+        return TrafficManager(port)
+
+    def apply_batch_sync(self, commands, do_tick=False):
+        if RPC_LATENCY:
+            sleep(RPC_LATENCY)
+        responses = []
+        for cmd in commands:
+            if isinstance(cmd, command.SpawnActor):
+                parent = _world.get_actors([cmd.parent_id])[0] if cmd.parent_id else None
+                responses.append(CommandResponse(_world.spawn_actor(cmd.blueprint, cmd.transform, parent).id))
+            elif isinstance(cmd, command.DestroyActor):
+                actors = _world.get_actors([cmd.actor_id])
+                if actors:
+                    actors[0].destroy()
+                responses.append(CommandResponse(cmd.actor_id))
+        if do_tick:
+            _world.tick()
+        return responses
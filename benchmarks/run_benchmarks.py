@@ -0,0 +1,228 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Benchmarks of the hot paths of a test run against the in-process carla stand-in (see fake_carla.py), so performance
+regressions are found without a simulator or GPU. All inputs are synthetic and seeded, so the results of different
+commits can be compared.
+
+Usage (from the repository root):
+    python -m benchmarks.run_benchmarks -output benchmarks/results/new.json
+    python -m benchmarks.run_benchmarks -compare benchmarks/results/old.json
+"""
+
+from argparse import ArgumentParser
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from benchmarks import fake_carla
+
+fake_carla.install()
+
+from util.camera_utils import RGBCamera  # noqa: E402
+from util.frame_writer import FrameWriter  # noqa: E402
+from util.frame_sinks import make_sink, OUTPUT_PNG, OUTPUT_RAW  # noqa: E402
+from util.test_class import CarlaTestRun, cam_lambda  # noqa: E402
+from util.update_texture import (build_texture, clear_texture_cache, load_texture_array, update_textures,  # noqa: E402
+                                 ROUND_TRAFFIC_SIGNS_TOWN7)
+from tools.convert_img_video import gen_video  # noqa: E402
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# real texture of the campaign, so the texture benchmarks see realistic image sizes
+TEXTURE_FILE = os.path.join(REPO_FOLDER, 'images', 'textures_traffic_sign', 'Verbot_alle_512.png')
+# number of runs of every benchmark. The median is used for comparisons
+REPEATS = 5
+# relative slowdown of the median that counts as regression in comparisons
+REGRESSION_THRESHOLD = 0.10
+# camera resolution of the image benchmarks
+IMAGE_WIDTH = 640
+IMAGE_HEIGHT = 400
+
+
+def bench_texture_build(tmp):
+    """converts a 512x512 texture into a TextureColor"""
+    rgba = load_texture_array(TEXTURE_FILE)
+    build_texture(rgba)
+    return 1
+
+
+def bench_texture_update(tmp):
+    """applies a texture to all round traffic signs of Town07, including loading and converting the texture"""
+    clear_texture_cache()
+    world = fake_carla.Client().get_world()
+    update_textures(world, ROUND_TRAFFIC_SIGNS_TOWN7, TEXTURE_FILE, logging.getLogger('logger'))
+    return len(ROUND_TRAFFIC_SIGNS_TOWN7)
+
+
+def _camera_save(tmp, output, images=100):
+    folder = os.path.join(tmp, f'save_{output}')
+    os.makedirs(folder, exist_ok=True)
+    writer = FrameWriter()
+    sink = make_sink(output, folder, images, IMAGE_WIDTH, IMAGE_HEIGHT)
+    # images are created before the timing starts, like images waiting in the carla client
+    frames = [fake_carla.Image(1000 + i, IMAGE_WIDTH, IMAGE_HEIGHT) for i in range(0, images)]
+    start = perf_counter()
+    for image in frames:
+        cam_lambda(image, sink, writer, frame0=1000)
+    writer.close()
+    sink.close()
+    return images, perf_counter() - start
+
+
+def bench_camera_save_png(tmp):
+    """stores camera images as png files through the camera callback and the writer threads"""
+    return _camera_save(tmp, OUTPUT_PNG)
+
+
+def bench_camera_save_raw(tmp):
+    """stores camera images in the memory mapped raw array through the camera callback and the writer threads"""
+    return _camera_save(tmp, OUTPUT_RAW)
+
+
+def bench_test_cycle(tmp, ticks=50):
+    """runs a complete test cycle with 4 cameras: fast preparation, synchronised capture and png output"""
+    cameras = [RGBCamera('front', IMAGE_WIDTH, IMAGE_HEIGHT, test_list=['01_default_new', '02_auto_exposure']),
+               RGBCamera('side', IMAGE_WIDTH, IMAGE_HEIGHT, test_list=['01_default_new', '02_auto_exposure'])]
+    test = CarlaTestRun(cameras, name='benchmark', resume_folder=os.path.join(tmp, 'cycle'), ticks=ticks,
+                        ticks_prep=20, sync_capture=True, fast_prep=True)
+    try:
+        start = perf_counter()
+        test.single_test_cycle('benchmark_cycle')
+        seconds = perf_counter() - start
+    finally:
+        test.end()
+        _remove_handlers()
+    return ticks, seconds
+
+
+def bench_gen_video(tmp, images=60):
+    """encodes a folder of png images into a mp4 video"""
+    folder = os.path.join(tmp, 'video')
+    os.makedirs(folder, exist_ok=True)
+    for i in range(0, images):
+        fake_carla.Image(1000 + i, IMAGE_WIDTH, IMAGE_HEIGHT).save_to_disk(os.path.join(folder, f'{i:04d}.png'))
+    start = perf_counter()
+    gen_video(folder)
+    return images, perf_counter() - start
+
+
+BENCHMARKS = {
+    'texture_build': bench_texture_build,
+    'texture_update': bench_texture_update,
+    'camera_save_png': bench_camera_save_png,
+    'camera_save_raw': bench_camera_save_raw,
+    'test_cycle': bench_test_cycle,
+    'gen_video': bench_gen_video,
+}
+
+
+def _remove_handlers():
+    """closes the logfiles that CarlaTestRun adds to the logger"""
+    logger = logging.getLogger('logger')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def git_commit():
+    """returns the current commit of the repository or None"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_FOLDER, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(name, repeats=REPEATS):
+    """ runs a benchmark several times. Benchmarks return the number of processed items and optionally the measured
+    seconds, if only a part of the benchmark should be timed
+
+    Returns:
+        result (dict): seconds of every run, median, minimum and items per second of the median
+    """
+    function = BENCHMARKS[name]
+    seconds = []
+    items = 0
+    for _ in range(0, repeats):
+        tmp = tempfile.mkdtemp(prefix=f'bench_{name}_')
+        try:
+            start = perf_counter()
+            result = function(tmp)
+            elapsed = perf_counter() - start
+            if isinstance(result, tuple):
+                items, elapsed = result
+            else:
+                items = result
+            seconds.append(elapsed)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    median = statistics.median(seconds)
+    return {'items': items, 'seconds': seconds, 'median': median, 'min': min(seconds),
+            'items_per_second': items / median if median > 0 else None}
+
+
+def run_all(names=None, repeats=REPEATS):
+    """runs the selected or all benchmarks and returns the report"""
+    # log output on the console would dominate the measured times
+    logging.getLogger('logger').disabled = True
+    report = {'commit': git_commit(), 'python': platform.python_version(), 'machine': platform.machine(),
+              'cpus': os.cpu_count(), 'repeats': repeats, 'results': {}}
+    for name in names or BENCHMARKS:
+        result = run_benchmark(name, repeats)
+        report['results'][name] = result
+        print(f'{name:20} {result["median"] * 1000:10.2f} ms  {result["items_per_second"]:10.1f} items/s  '
+              f'(min {result["min"] * 1000:.2f} ms, {result["items"]} items)')
+    return report
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """ prints the change of every benchmark against an older report
+
+    Returns:
+        regressions ([str]): benchmarks whose median got slower by more than the threshold
+    """
+    print(f'Comparing {report["commit"]} with {baseline.get("commit")}')
+    regressions = []
+    for name, result in report['results'].items():
+        old = baseline['results'].get(name)
+        if not old:
+            continue
+        change = result['median'] / old['median'] - 1.0
+        flag = ''
+        if change > threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print(f'{name:20} {old["median"] * 1000:10.2f} ms -> {result["median"] * 1000:10.2f} ms {change:+8.1%} {flag}')
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('-bench', type=str, nargs='*', choices=list(BENCHMARKS), help='Benchmarks to run. Default all')
+    parser.add_argument('-repeats', type=int, help='Number of runs of every benchmark', default=REPEATS)
+    parser.add_argument('-output', type=str, help='JSON file for the results')
+    parser.add_argument('-compare', type=str, help='JSON file with results of an older commit')
+    parser.add_argument('-threshold', type=float, help='Relative slowdown that counts as regression',
+                        default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    report = run_all(args.bench, args.repeats)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
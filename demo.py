@@ -26,7 +26,6 @@ town = 'Town07_attacked'
 camera_tests = ['01_default_new',
                 '30_iso_400']
 # campos = carla.Location(x=0.6, z=1.45
-# save_time = 0.25
 cam = RGBCamera(test_list=camera_tests)
 
 test = CarlaTestRun([cam], name=test_name, spawn_point=spawn_point, ticks=ticks, folder=result_path, town=town)
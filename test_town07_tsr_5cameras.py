@@ -25,23 +25,23 @@ def main(folder):
     cameras = []
     campos = carla.Transform(carla.Location(x=0.6, z=1.45))
     cam_highres = RGBCamera(cam_name="Front_HR", x_cam=2400, y_cam=1600, test_list=camera_tests,
-                            campos=campos, save_time=2.0)
+                            campos=campos)
     cameras.append(cam_highres)
     campos = carla.Transform(carla.Location(x=2.35, z=0.4), carla.Rotation(pitch=-20.0))
     cam_front = RGBCamera(cam_name="Front", x_cam=1536, y_cam=1024, test_list=camera_tests,
-                          campos=campos, save_time=2.0)
+                          campos=campos)
     cameras.append(cam_front)
     campos = carla.Transform(carla.Location(x=-2.3, z=0.4), carla.Rotation(yaw=180.0, pitch=-20.0))
     cam_rear = RGBCamera(cam_name="Rear", x_cam=1536, y_cam=1024, test_list=camera_tests,
-                         campos=campos, save_time=2.0)
+                         campos=campos)
     cameras.append(cam_rear)
     campos = carla.Transform(carla.Location(x=0.55, y=1.1, z=1.1), carla.Rotation(yaw=90.0, pitch=-20.0))
     cam_right = RGBCamera(cam_name="Right", x_cam=1536, y_cam=1024, test_list=camera_tests,
-                          campos=campos, save_time=2.0)
+                          campos=campos)
     cameras.append(cam_right)
     campos = carla.Transform(carla.Location(x=0.55, y=-1.1, z=1.1), carla.Rotation(yaw=270.0, pitch=-20.0))
     cam_left = RGBCamera(cam_name="Left", x_cam=1536, y_cam=1024, test_list=camera_tests,
-                         campos=campos, save_time=2.0)
+                         campos=campos)
     cameras.append(cam_left)
 
     test = CarlaTestRun(cameras, name=testname, spawn_point=spawn_point, ticks=cycles, folder=folder, tick_length=0.05,
@@ -40,9 +40,10 @@ camera_tests = ['00_default_carla',
                 '40_high_gamma'
                 ]
 
-def main(folder):
+def main(folder, resume_folder=None):
     cam = RGBCamera(test_list=camera_tests, tick=0.1)
-    test = CarlaTestRun([cam], name=testname, spawn_point=spawn_point, ticks=cycles, folder=folder)
+    test = CarlaTestRun([cam], name=testname, spawn_point=spawn_point, ticks=cycles, folder=folder,
+                        resume_folder=resume_folder)
     test.run_texture(texture_list, ROUND_TRAFFIC_SIGNS_TOWN7)
     test.end()
 
@@ -50,5 +51,6 @@ def main(folder):
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument("r", type=str, help="Filepath and name of the results directory")
+    parser.add_argument("-resume", type=str, help="Result folder of an interrupted test that will be continued")
     args = parser.parse_args()
-    main(args.r)
+    main(args.r, args.resume)
@@ -0,0 +1,60 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Test of all round traffic signs in town07 in several weather conditions, spread over several carla servers.
+Every server needs the map Town07_attacked. Example with two servers on one host and one on another host:
+python test_town07_tsr_sharded.py D:/Results -servers 127.0.0.1:2000 127.0.0.1:3000 192.168.0.20:2000
+"""
+from argparse import ArgumentParser
+import logging
+
+from util.camera_utils import RGBCamera
+from util.scheduler import ShardScheduler, plan_shards, campaign_folder
+from util.update_texture import ROUND_TRAFFIC_SIGNS_TOWN7
+from util.update_texture import TS_TEXTURE_CIRCLE
+from util.weather import *
+
+testname = 'T7_all_round_sharded'
+town = 'Town07_attacked'
+spawn_point = 107
+cycles = 498
+
+texture_list = TS_TEXTURE_CIRCLE
+
+weathers = {'default': town7_default,
+            'foggy': foggy,
+            'heavy_rain': heavy_rain}
+
+camera_tests = ['00_default_carla',
+                '01_default_new',
+                '30_iso_400',
+                '40_high_gamma'
+                ]
+
+
+def cameras():
+    """cameras are created in the worker processes, as carla objects can't be sent to other processes"""
+    return [RGBCamera(test_list=camera_tests, tick=0.1)]
+
+
+def main(folder, servers, resume_folder=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    config = {'name': testname,
+              'result_folder': resume_folder or campaign_folder(folder, testname),
+              'objects': ROUND_TRAFFIC_SIGNS_TOWN7,
+              'camera_groups': [cameras],
+              'weathers': weathers,
+              'test_args': {'spawn_point': spawn_point, 'ticks': cycles, 'town': town}}
+    shards = plan_shards(texture_list, list(weathers))
+    results = ShardScheduler(servers).run(shards, config)
+    failed = [result['shard']['name'] for result in results if result['status'] != 'done']
+    print(f'{len(results) - len(failed)} of {len(results)} shards done. Failed: {failed}')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument("r", type=str, help="Filepath and name of the results directory")
+    parser.add_argument("-servers", type=str, nargs='+', help="carla servers as host:port[:tm_port]",
+                        default=['127.0.0.1:2000'])
+    parser.add_argument("-resume", type=str, help="Result folder of an interrupted test that will be continued")
+    args = parser.parse_args()
+    main(args.r, args.servers, args.resume)
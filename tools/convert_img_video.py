@@ -5,82 +5,198 @@ Convert all images in a folder into a video
 
 
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from time import perf_counter
 
 from cv2 import imread, IMREAD_COLOR, VideoWriter, VideoWriter_fourcc
 import os
 
 
 DEFAULT_FPS = 10
+# number of threads decoding images
+READ_WORKERS = 4
+# maximum number of decoded images waiting to be written into the video
+PREFETCH = 8
 
 
-def gen_video(image_folder, fps=DEFAULT_FPS, vformat='mp4'):
+def frame_key(file):
+    """sort key for image files named after their tick, so 0010.png comes after 0009.png and 10000.png after 9999.png"""
+    stem = os.path.splitext(os.path.basename(file))[0]
+    return (0, int(stem), '') if stem.isdigit() else (1, 0, stem)
+
+
+def list_frames(image_folder):
+    """returns all png files of a folder in tick order"""
+    files = [os.path.join(image_folder, path) for path in os.listdir(image_folder) if path[len(path) - 3:] == "png"]
+    return sorted((file for file in files if os.path.isfile(file)), key=frame_key)
+
+
+def iter_frames(files, workers=READ_WORKERS, prefetch=PREFETCH):
     """
-    generate video out of all images in a folder and stores it in a _video subfolder
+    decodes images in a small pool of threads and yields them in the order of the files. Only a limited number of
+    images is read ahead, so the memory use does not depend on the number of files.
+
+    Args:
+        files ([str]): image files
+        workers (int): number of decoding threads
+        prefetch (int): maximum number of images that are decoded ahead
+
+    Yields:
+        img (ndarray): decoded BGR image
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for file in files:
+            pending.append(pool.submit(imread, file, IMREAD_COLOR))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def video_path(image_folder, vformat='mp4'):
+    """returns the path of the video of an image folder"""
+    return os.path.join(image_folder, '_videos', 'video.mp4' if vformat == 'mp4' else 'video.avi')
+
+
+def is_up_to_date(image_folder, vformat='mp4', files=None):
+    """checks if the video of a folder exists and is newer than the newest image of the folder"""
+    export_video = video_path(image_folder, vformat)
+    if not os.path.exists(export_video):
+        return False
+    files = list_frames(image_folder) if files is None else files
+    newest_frame = max((os.path.getmtime(file) for file in files), default=0.0)
+    return os.path.getmtime(export_video) >= newest_frame
+
+
+def gen_video(image_folder, fps=DEFAULT_FPS, vformat='mp4', workers=READ_WORKERS, prefetch=PREFETCH):
+    """
+    generate video out of all images in a folder and stores it in a _video subfolder. The images are written in tick
+    order while they are decoded.
 
     Args:
         image_folder (str): folder with images
         fps (int): Frames per second
         vformat (str): video format. Can be mp4 or avi
+        workers (int): number of decoding threads
+        prefetch (int): maximum number of images that are decoded ahead
+
+    Returns:
+        frames (int): number of frames in the video
     """
 
+    files = list_frames(image_folder)
+    if not files:
+        print('No videos found in this folder')
+        return 0
+
     video_folder = os.path.join(image_folder, '_videos')
     if not os.path.exists(video_folder):
         os.makedirs(video_folder)
 
-    if vformat == 'mp4':
-        export_video = os.path.join(video_folder, "video.mp4")
-    else:
-        export_video = os.path.join(video_folder, "video.avi")
+    export_video = video_path(image_folder, vformat)
     print(f'creating video at {export_video}')
 
-    # load all images of folder into an
-    frames = []
-    for path in os.listdir(image_folder):
-        file = os.path.join(image_folder, path)
-        if os.path.isfile(file) and file[len(file) - 3:] == "png":
-            img = imread(file, IMREAD_COLOR)
-            frames.append(img)
-
-    if len(frames) > 0:
-        # get image resolution from first image
-        h, w, c = frames[0].shape
-        video_dim = (w, h)
-
-        if vformat == 'mp4':
-            vid_writer = VideoWriter(export_video, VideoWriter_fourcc(*'mp4v'), fps, video_dim)
-        else:
-            vid_writer = VideoWriter(export_video, VideoWriter_fourcc(*'XVID'), fps, video_dim)
-
-        for frame in frames:
-            vid_writer.write(frame)
+    vid_writer = None
+    frames = 0
+    for frame in iter_frames(files, workers, prefetch):
+        if frame is None:
+            continue
+        if vid_writer is None:
+            # get image resolution from first image
+            h, w, c = frame.shape
+            video_dim = (w, h)
+            if vformat == 'mp4':
+                vid_writer = VideoWriter(export_video, VideoWriter_fourcc(*'mp4v'), fps, video_dim)
+            else:
+                vid_writer = VideoWriter(export_video, VideoWriter_fourcc(*'XVID'), fps, video_dim)
+        vid_writer.write(frame)
+        frames += 1
+    if vid_writer is not None:
         vid_writer.release()
         print(f'Created video {export_video}')
-    else:
-        print('No videos found in this folder')
-
+    return frames
 
-def gen_all_videos(result_folder, fps, vformat='mp4'):
-    """ generate video out of all images in all folders of a test
 
-        Args:
-        image_folder (str): folder with images
-        fps (int): Frames per second
-        vformat (str): video format. Can be mp4 or avi
-    """
-    for sign in os.listdir(result_folder):
+def camera_folders(result_folder):
+    """returns all camera folders of a test in the layout result_folder/sign/camera"""
+    folders = []
+    for sign in sorted(os.listdir(result_folder)):
         sign_folder = os.path.join(result_folder, sign)
         if os.path.isfile(sign_folder):  # skip the statistics files stored in the main folder
             continue
-        for cam in os.listdir(sign_folder):
+        for cam in sorted(os.listdir(sign_folder)):
             # define the folders used for the results
             current_image_folder = os.path.join(sign_folder, cam)
-            gen_video(current_image_folder, fps, vformat)
+            if os.path.isdir(current_image_folder):
+                folders.append(current_image_folder)
+    return folders
+
+
+def render_folder(image_folder, fps=DEFAULT_FPS, vformat='mp4', force=False):
+    """ generates the video of a single folder unless it is already up to date. Used by the batch mode
+
+    Returns:
+        summary (tuple): folder, status, number of frames and duration in seconds
+    """
+    start = perf_counter()
+    files = list_frames(image_folder)
+    if not files:
+        return image_folder, 'empty', 0, 0.0
+    if not force and is_up_to_date(image_folder, vformat, files):
+        return image_folder, 'up to date', len(files), 0.0
+    try:
+        frames = gen_video(image_folder, fps, vformat)
+    except Exception as e:
+        return image_folder, f'failed: {e}', 0, perf_counter() - start
+    return image_folder, 'created', frames, perf_counter() - start
+
+
+def gen_all_videos(result_folder, fps, vformat='mp4', jobs=1, force=False):
+    """ generate video out of all images in all folders of a test. Several folders are encoded at once in a pool of
+    processes. Folders whose video is newer than their newest image are skipped.
+
+        Args:
+        result_folder (str): folder of a test with the subfolders sign/camera
+        fps (int): Frames per second
+        vformat (str): video format. Can be mp4 or avi
+        jobs (int): number of folders that are encoded at once
+        force (bool): also encode folders whose video is up to date
+
+    Returns:
+        summaries ([tuple]): folder, status, number of frames and duration in seconds for every camera folder
+    """
+    folders = camera_folders(result_folder)
+    start = perf_counter()
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(render_folder, folder, fps, vformat, force) for folder in folders]
+            summaries = [future.result() for future in as_completed(futures)]
+    else:
+        summaries = [render_folder(folder, fps, vformat, force) for folder in folders]
+
+    summaries.sort()
+    print(f'\n{"folder":60} {"status":12} {"frames":>7} {"seconds":>8}')
+    for folder, status, frames, seconds in summaries:
+        print(f'{os.path.relpath(folder, result_folder):60} {status:12} {frames:7d} {seconds:8.1f}')
+    created = sum(1 for summary in summaries if summary[1] == 'created')
+    print(f'{created} of {len(summaries)} videos created in {perf_counter() - start:.1f} s')
+    return summaries
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('source', type=str, help='Filepath and name of the results directory')
+    parser.add_argument('-all', action='store_true', help='Convert all camera folders of a test (source/sign/camera)')
+    parser.add_argument('-jobs', type=int, help='Number of folders encoded at once with -all', default=1)
+    parser.add_argument('-force', action='store_true', help='Also encode folders whose video is up to date')
     parser.add_argument('-fps', type=int, help='Frames per Second', default=DEFAULT_FPS)
     parser.add_argument('-format', type=str, help='Video Format (mp4 or avi)', default='mp4')
+    parser.add_argument('-workers', type=int, help='Number of threads decoding images', default=READ_WORKERS)
+    parser.add_argument('-prefetch', type=int, help='Number of images decoded ahead', default=PREFETCH)
     args = parser.parse_args()
-    gen_video(args.source, args.fps, args.format)
+    if args.all:
+        gen_all_videos(args.source, args.fps, args.format, args.jobs, args.force)
+    else:
+        gen_video(args.source, args.fps, args.format, args.workers, args.prefetch)
@@ -0,0 +1,89 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Convert the raw frames of a camera folder (recorded with output='raw') into png images or a video
+"""
+
+from argparse import ArgumentParser
+import os
+import sys
+
+from cv2 import imwrite, VideoWriter, VideoWriter_fourcc
+
+# the repository root, so the util package is found when the script is started directly from tools
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.frame_sinks import load_raw, RAW_FRAMES_FILE  # noqa: E402
+
+DEFAULT_FPS = 10
+
+
+def raw_to_png(camera_folder):
+    """
+    stores every recorded frame of a camera folder as png file named after its tick
+
+    Args:
+        camera_folder (str): folder with frames.npy and frames.json
+    """
+    frames, meta = load_raw(camera_folder)
+    for tick in meta['written']:
+        img_name = os.path.join(camera_folder, f'{tick:04d}.png')
+        # the alpha channel of carla images carries no information
+        imwrite(img_name, frames[tick, :, :, :3])
+    print(f'Converted {len(meta["written"])} frames of {camera_folder}')
+
+
+def raw_to_video(camera_folder, fps=DEFAULT_FPS, vformat='mp4'):
+    """
+    generates a video out of the recorded frames of a camera folder and stores it in a _videos subfolder
+
+    Args:
+        camera_folder (str): folder with frames.npy and frames.json
+        fps (int): Frames per second
+        vformat (str): video format. Can be mp4 or avi
+    """
+    frames, meta = load_raw(camera_folder)
+    if not meta['written']:
+        print('No frames found in this folder')
+        return
+
+    video_folder = os.path.join(camera_folder, '_videos')
+    if not os.path.exists(video_folder):
+        os.makedirs(video_folder)
+    if vformat == 'mp4':
+        export_video = os.path.join(video_folder, "video.mp4")
+        fourcc = VideoWriter_fourcc(*'mp4v')
+    else:
+        export_video = os.path.join(video_folder, "video.avi")
+        fourcc = VideoWriter_fourcc(*'XVID')
+    print(f'creating video at {export_video}')
+
+    vid_writer = VideoWriter(export_video, fourcc, fps, (meta['width'], meta['height']))
+    for tick in meta['written']:
+        vid_writer.write(frames[tick, :, :, :3].copy())
+    vid_writer.release()
+    print(f'Created video {export_video}')
+
+
+def convert_all(result_folder, target='png', fps=DEFAULT_FPS):
+    """
+    converts all camera folders with raw frames below a result folder
+
+    Args:
+        result_folder (str): folder of a test
+        target (str): png, mp4 or avi
+        fps (int): Frames per second of videos
+    """
+    for root, dirs, files in os.walk(result_folder):
+        if RAW_FRAMES_FILE in files:
+            if target == 'png':
+                raw_to_png(root)
+            else:
+                raw_to_video(root, fps, target)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('source', type=str, help='Camera folder or results directory with raw frames')
+    parser.add_argument('-format', type=str, help='Target format (png, mp4 or avi)', default='png')
+    parser.add_argument('-fps', type=int, help='Frames per Second', default=DEFAULT_FPS)
+    args = parser.parse_args()
+    convert_all(args.source, args.format, args.fps)
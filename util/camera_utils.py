@@ -2,34 +2,17 @@
 RGB Camera Class and standard setings used by all tests.
 """
 import logging
-from time import sleep
 
 import carla
 import os
+from util.effects import EffectsSink, BASE_TEST, EFFECT_SUFFIX
+from util.frame_sinks import make_sink, OUTPUT_PNG
 from util.test_class import cam_lambda
+from util.test_lists import camera_tests  # noqa: F401
 
 
-# list of all camera tests
-camera_tests = ['00_default_carla',
-                '01_default_new',
-                '02_auto_exposure',
-                '10_mblur_low',
-                '11_mblur_high',
-                '20_low_shutter_speed',
-                '21_high_shutter_speed',
-                '22_low_shutter_speed_iso',
-                '23_high_shutter_speed_iso',
-                '30_iso_400',
-                '31_iso_25',
-                '40_high_gamma',
-                '41_gamma_1.0',
-                '50_high_lensflare_intensity',
-                '60_small_f_stop',
-                '61_large_fstop',
-                '62_small_f_stop_iso',
-                '63_large_fstop_iso',
-                '70_npp'
-                ]
+# configured camera blueprints by test, resolution, fov and sensor tick, so every blueprint is only set up once
+_blueprint_cache = {}
 
 
 def set_camera_test(test, camera_bp):
@@ -112,7 +95,7 @@ class RGBCamera:
     """class for cameras. Needs to be defined before testing and then submitted to the CarlaTestRun Object"""
 
     def __init__(self, cam_name="", x_cam=1360, y_cam=800, fov=120, tick=0.0, test_list=None,
-                 campos=carla.Transform(carla.Location(x=0.6, z=1.45)), save_time=0.25):
+                 campos=carla.Transform(carla.Location(x=0.6, z=1.45)), output=OUTPUT_PNG, effects=None):
         """Init with camera configuration data. Standard resolution is the same as in the GTSRDB dataset
 
         Args:
@@ -122,7 +105,12 @@ class RGBCamera:
             tick (float): time between images (= 1/framerate) 0.0 means its synchronous with the world tick
             test_list ([str]): list of camera settings
             campos (Location): position of the camera in relation to the vehicle
-            save_time (float): sleep time used for saving images inbetween ticks
+            output (str): output format of the images. 'png' for single png files, 'raw' for one memory mapped
+                array per camera folder, that can be converted with tools/convert_raw.py, 'mp4' or 'avi' for a video
+                per camera folder without single images, or an encoder like 'png:1', 'jpg:85', 'webp:90' or 'npy'
+                that encodes in a pool of processes (see util/encoders.py)
+            effects ([str]): camera tests that are derived on the CPU from the images of the 01_default_new camera
+                instead of being rendered (see util/effects.py). Stored in folders with the suffix _fx
         """
         self.x_cam = x_cam
         self.y_cam = y_cam
@@ -133,12 +121,18 @@ class RGBCamera:
         else:
             self.test_list = test_list
         self.transform = campos
-        self.save_time = save_time
+        self.output = output
+        self.effects = effects or []
         if cam_name != "":
             cam_name = cam_name + "_"
         self.cam_name = cam_name
 
         self.cameras = []
+        self.sinks = []
+        self.writer = None
+        self.barrier = None
+        self.frame0 = None
+        self.ticks = None
         self.logger = logging.getLogger('logger')
 
     def log_basic_info(self, logger=None):
@@ -149,6 +143,25 @@ class RGBCamera:
         self.logger.info(f'FOV: {self.fov}°')
         self.logger.info(f'Sensor_Tick: {self.sensor_tick} seconds')
         self.logger.info(f'List of cameras: {self.test_list}')
+        self.logger.info(f'Output: {self.output}')
+        if self.effects:
+            self.logger.info(f'Derived camera tests: {self.effects}')
+
+    def folder_names(self):
+        """returns the names of the camera folders of this camera object"""
+        names = [self.cam_name + test for test in self.test_list]
+        if BASE_TEST in self.test_list:
+            names += [self.cam_name + test + EFFECT_SUFFIX for test in self.effects]
+        return names
+
+    def settings(self):
+        """returns the camera settings that influence the resulting images"""
+        settings = {'name': self.cam_name, 'resolution': [self.x_cam, self.y_cam], 'fov': self.fov,
+                    'sensor_tick': self.sensor_tick, 'test_list': self.test_list, 'transform': str(self.transform),
+                    'output': str(self.output)}
+        if self.effects:
+            settings['effects'] = self.effects
+        return settings
 
     def setup_rgb_camera(self, blueprint_library, i):
         """Creates and configures a single camera based on the carla Blueprint
@@ -165,6 +178,9 @@ class RGBCamera:
             i = 0
 
         self.logger.info('Camera:' + self.test_list[i])
+        key = (self.test_list[i], self.x_cam, self.y_cam, self.fov, self.sensor_tick)
+        if key in _blueprint_cache:
+            return _blueprint_cache[key]
         camera_bp = blueprint_library.find('sensor.camera.rgb')
         camera_bp.set_attribute('image_size_x', str(self.x_cam))
         camera_bp.set_attribute('image_size_y', str(self.y_cam))
@@ -173,16 +189,30 @@ class RGBCamera:
         camera_bp.set_attribute('exposure_mode', 'manual')
         camera_bp.set_attribute('gamma', '1.0')
         set_camera_test(self.test_list[i], camera_bp)
+        _blueprint_cache[key] = camera_bp
 
         return camera_bp
 
-    def attach_cameras(self, world, vehicle, test_folder):
+    def attach_cameras(self, world, vehicle, test_folder, writer, barrier=None, ticks=None):
         """Creates all cameras and attach them to the vehicle
 
         Args:
             world (World): The currently loaded map
             vehicle (Actor): The spawned vehicle where the camera needs to be attached
             test_folder (str): location for storing the resulting image
+            writer (FrameWriter): writer threads that store the images of the cameras
+            barrier (TickBarrier): optional barrier that waits for the images of every tick
+            ticks (int): number of recorded ticks. Needed for preallocating the raw output
+        """
+        self.spawn_cameras(world, vehicle)
+        self.set_output(test_folder, writer, barrier, ticks)
+
+    def spawn_cameras(self, world, vehicle):
+        """Creates all cameras and attach them to the vehicle. Images are only stored after set_output was called
+
+        Args:
+            world (World): The currently loaded map
+            vehicle (Actor): The spawned vehicle where the camera needs to be attached
         """
         blueprint_library = world.get_blueprint_library()
         for i in range(0, len(self.test_list)):
@@ -190,22 +220,89 @@ class RGBCamera:
             camera_bp = self.setup_rgb_camera(blueprint_library, i)
             # spawn and attach the camera
             camera = world.spawn_actor(camera_bp, self.transform, attach_to=vehicle)
+            self.add_cameras([camera])
+
+    def add_cameras(self, cameras):
+        """Takes over spawned cameras in the order of the test list and starts their listeners
+
+        Args:
+            cameras ([Actor]): cameras attached to the vehicle, e.g. spawned in a batch by CarlaTestRun.spawn_cameras
+        """
+        for camera in cameras:
+            i = len(self.cameras)
             self.cameras.append(camera)
+            # camera listener
+            target_file = lambda image, index=i: (self.on_image(image, index))
+            camera.listen(target_file)
+
+    def set_output(self, test_folder, writer, barrier=None, ticks=None):
+        """Creates the folders and sinks for the images of the next cycle. The cameras stay attached to the vehicle
+
+        Args:
+            test_folder (str): location for storing the resulting image
+            writer (FrameWriter): writer threads that store the images of the cameras
+            barrier (TickBarrier): optional barrier that waits for the images of every tick
+            ticks (int): number of recorded ticks. Needed for preallocating the raw output
+        """
+        sinks = []
+        for i in range(0, len(self.test_list)):
             # create folder for resulting images
             cam_folder = os.path.join(test_folder, self.cam_name + self.test_list[i])
             if not os.path.exists(cam_folder):
                 self.logger.info(f'Creating folder: {cam_folder}')
                 os.makedirs(cam_folder)
-            # camera listener
-            target_file = lambda image, img_path=cam_folder, t=(i * self.save_time): (cam_lambda(image, img_path, t, self.logger))
-            camera.listen(target_file)
+            sink = make_sink(self.output, cam_folder, ticks, self.x_cam, self.y_cam,
+                             {'camera': self.cam_name + self.test_list[i], 'fov': self.fov,
+                              'sensor_tick': self.sensor_tick}, writer.profiler)
+            if self.effects and self.test_list[i] == BASE_TEST:
+                sink = EffectsSink(sink, self.effects)
+            sinks.append(sink)
+            if barrier:
+                barrier.register(cam_folder, self.sensor_tick)
+        self.writer = writer
+        self.barrier = barrier
+        self.ticks = ticks
+        # images are only stored after start_recording
+        self.frame0 = None
+        self.sinks = sinks
+
+    def start_recording(self, frame0):
+        """sets the world frame of the first recorded tick. The tick of every image is its frame minus frame0
+
+        Args:
+            frame0 (int): world frame of the first recorded tick
+        """
+        self.frame0 = frame0
+
+    def on_image(self, image, i):
+        """listener of camera i. Images that arrive while no output is set (e.g. during the preparation) are dropped"""
+        sinks = self.sinks
+        if i < len(sinks):
+            cam_lambda(image, sinks[i], self.writer, self.barrier, self.frame0, self.ticks)
+
+    def close_output(self):
+        """finalizes the output of all camera folders. The cameras stay attached. All sinks are closed, even if one of
+        them fails. The first error is raised afterwards"""
+        sinks = self.sinks
+        self.sinks = []
+        error = None
+        for sink in sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                self.logger.error(f'Output of {sink.folder} could not be finalized: {e}')
+                error = error or e
+        if error is not None:
+            raise error
 
     def destroy_all(self):
-        """Destroys cameras after test to avoid memory leak"""
+        """Destroys cameras after test to avoid memory leak and finalizes the output of all camera folders"""
         self.logger.info(f'Destroying {len(self.cameras)} cameras')
         for camera in self.cameras:
-            camera.destroy()
+            try:
+                camera.destroy()
+            except RuntimeError as e:
+                # e.g. the connection to the server was lost
+                self.logger.warning(f'Camera could not be destroyed: {e}')
         self.cameras = []
-
-    def tick_sleep(self):
-        sleep(self.save_time * len(self.test_list))
+        self.close_output()
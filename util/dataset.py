@@ -0,0 +1,290 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Export of finished tests as training dataset in tar shards (WebDataset layout). Every sample is an image and a json
+file with the labels: true sign and attack target from the texture name (e.g. Speed_60#Speed_50), camera preset,
+weather and tick. A global index with the byte offsets of all samples allows reading any sample without unpacking the
+shards. The shards are written in parallel processes and an interrupted export continues with the missing shards.
+Attention! On Windows, scripts using the export need an if __name__ == '__main__': guard.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import io
+import json
+import os
+import tarfile
+
+from cv2 import imdecode, imencode, IMREAD_COLOR
+import numpy as np
+
+from util.effects import EFFECT_SUFFIX
+from util.encoders import ENCODER_WORKERS
+from util.frame_sinks import load_raw
+from util.manifest import settings_hash
+from util.replay import ORDER_CAMERA, ORDER_TICK, ReplaySource
+from util.test_lists import camera_tests, EXTRA_CAMERA_TESTS, TS_TEXTURE_CIRCLE
+
+# number of samples in one shard
+SHARD_SIZE = 1000
+DATASET_FILE = 'dataset.json'
+INDEX_FILE = 'index.npy'
+# separator of the true sign and the attack target in texture names
+TARGET_SEPARATOR = '#'
+# all known camera tests, longest first, so 41_gamma_1.0 is not read as a shorter test with a suffix
+CAMERA_PRESETS = sorted(camera_tests + EXTRA_CAMERA_TESTS, key=len, reverse=True)
+
+# byte offsets of a sample in its shard
+INDEX_DTYPE = np.dtype([('shard', np.int32), ('image_offset', np.int64), ('image_size', np.int64),
+                        ('label_offset', np.int64), ('label_size', np.int64)])
+
+
+def sign_classes(textures=TS_TEXTURE_CIRCLE):
+    """returns all sign names of the true signs and attack targets of a texture list in the order of appearance"""
+    classes = []
+    for name in [tex[0] for tex in textures]:
+        for sign in name.split(TARGET_SEPARATOR):
+            if sign not in classes:
+                classes.append(sign)
+    return classes
+
+
+def parse_cycle(cycle, texture_names):
+    """ splits a cycle name like fog_Speed_60#Speed_50 into weather and texture name
+
+    Args:
+        cycle (str): name of the cycle folder
+        texture_names ([str]): known texture names, e.g. of TS_TEXTURE_CIRCLE
+
+    Returns:
+        weather (str): name of the weather pass, None if the cycle has none
+        texture_name (str): name of the texture. The whole cycle name if no known texture matches
+    """
+    if cycle in texture_names:
+        return None, cycle
+    # longest name first, so Speed_80_End is not read as weather Speed_80 of texture End
+    for name in sorted(texture_names, key=len, reverse=True):
+        if cycle.endswith('_' + name):
+            return cycle[:-len(name) - 1], name
+    return None, cycle
+
+
+def parse_camera(camera):
+    """ splits a camera folder name like front_30_iso_400_fx into camera name, preset and suffix of derived images.
+    Known presets (see test_lists) are matched as whole name parts, so derived effects (_fx) and distortions (name of
+    the distortion behind the preset) of every preset are recognised. Unknown presets are read from the first name
+    part with a two digit test number, e.g. 91_new_test
+
+    Returns:
+        name (str): name of the camera object
+        preset (str): camera test, None if the folder has no preset
+        suffix (str): remainder behind the preset, e.g. _fx for derived effects or the name of a distortion
+    """
+    parts = camera.split('_')
+    # presets start at a name part with a two digit test number
+    starts = [i for i, part in enumerate(parts) if len(part) == 2 and part.isdigit()]
+    for start in starts:
+        rest = '_'.join(parts[start:])
+        for test in CAMERA_PRESETS:
+            if rest == test or rest.startswith(test + '_'):
+                return '_'.join(parts[:start]), test, rest[len(test):]
+    if not starts:
+        return camera, None, ''
+    name, rest = '_'.join(parts[:starts[0]]), '_'.join(parts[starts[0]:])
+    if rest.endswith(EFFECT_SUFFIX):
+        return name, rest[:-len(EFFECT_SUFFIX)], EFFECT_SUFFIX
+    return name, rest, ''
+
+
+def sample_label(folder, tick, classes, texture_names):
+    """returns the json label of a frame of a camera folder found by replay.find_cameras"""
+    weather_name, texture_name = parse_cycle(folder['cycle'], texture_names)
+    signs = texture_name.split(TARGET_SEPARATOR)
+    target = signs[1] if len(signs) > 1 else None
+    name, preset, suffix = parse_camera(folder['camera'])
+    weather = folder['weather'][tick] if tick < len(folder['weather']) else None
+    return {'cycle': folder['cycle'], 'texture': texture_name, 'texture_file': folder['texture'],
+            'true_label': signs[0], 'true_class': classes.index(signs[0]) if signs[0] in classes else -1,
+            'target_label': target, 'target_class': classes.index(target) if target in classes else -1,
+            'attacked': target is not None, 'camera': folder['camera'], 'camera_name': name, 'preset': preset,
+            'derived': suffix, 'tick': tick, 'weather_name': weather_name, 'weather': weather}
+
+
+def shard_name(shard):
+    return f'shard-{shard:06d}.tar'
+
+
+def read_sample(sample, raw_frames):
+    """returns the encoded image and its extension. Image files are copied without decoding, raw frames are encoded
+    as png"""
+    if sample['file'] is not None:
+        with open(sample['file'], 'rb') as f:
+            return f.read(), os.path.splitext(sample['file'])[1].lstrip('.').lower()
+    if sample['folder'] not in raw_frames:
+        raw_frames[sample['folder']] = load_raw(sample['folder'])[0]
+    success, data = imencode('.png', np.ascontiguousarray(raw_frames[sample['folder']][sample['tick'], :, :, :3]))
+    if not success:
+        raise ValueError(f'Frame {sample["tick"]} of {sample["folder"]} could not be encoded')
+    return data.tobytes(), 'png'
+
+
+def add_member(tar, name, data):
+    """adds a file to an open tar archive and returns the offset of its data"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 0  # same shards in every export
+    tar.addfile(info, io.BytesIO(data))
+    # the data ends at the current position, padded to full blocks
+    return tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+def write_shard(target_folder, shard, samples):
+    """ writes one shard and its part of the index. Runs in the pool processes
+
+    Args:
+        target_folder (str): folder of the dataset
+        shard (int): number of the shard
+        samples ([dict]): global sample number, source and label of every sample
+
+    Returns:
+        shard (int): number of the shard
+    """
+    path = os.path.join(target_folder, shard_name(shard))
+    index = np.zeros(len(samples), dtype=INDEX_DTYPE)
+    raw_frames = {}
+    with tarfile.open(path + '.tmp', 'w', format=tarfile.USTAR_FORMAT) as tar:
+        for i, sample in enumerate(samples):
+            key = f'{sample["sample"]:09d}'
+            image, extension = read_sample(sample, raw_frames)
+            label = json.dumps(dict(sample['label'], key=key), default=str).encode('utf-8')
+            index[i] = (shard, add_member(tar, f'{key}.{extension}', image), len(image),
+                        add_member(tar, f'{key}.json', label), len(label))
+    os.replace(path + '.tmp', path)
+    # the part of the index is written last and marks the shard as complete
+    np.save(path + '.idx.tmp.npy', index)
+    os.replace(path + '.idx.tmp.npy', path + '.idx.npy')
+    return shard
+
+
+def list_samples(result_folder, cycles=None, cameras=None, order=ORDER_TICK, textures=TS_TEXTURE_CIRCLE):
+    """ lists all frames of a finished test with their labels in a fixed order
+
+    Args:
+        result_folder (str): folder of the test
+        cycles ([str]): only these cycles. Default all
+        cameras ([str]): only these camera folder names. Default all
+        order (str): ORDER_TICK or ORDER_CAMERA (see replay.ReplaySource)
+        textures ([[str, str]]): texture list the labels are taken from
+
+    Returns:
+        samples ([dict]): global sample number, camera folder, tick, file and label of every frame
+    """
+    classes = sign_classes(textures)
+    texture_names = [tex[0] for tex in textures]
+    source = ReplaySource(result_folder, cycles, cameras, order)
+    return [{'sample': i, 'folder': folder['folder'], 'tick': tick, 'file': file,
+             'label': sample_label(folder, tick, classes, texture_names)}
+            for i, (folder, tick, file) in enumerate(source.items())]
+
+
+def export_dataset(result_folder, target_folder, cycles=None, cameras=None, shard_size=SHARD_SIZE,
+                   jobs=ENCODER_WORKERS, order=ORDER_TICK, textures=TS_TEXTURE_CIRCLE):
+    """ exports a finished test as tar shards with a global index. Shards that were completed by an earlier export
+    with the same settings are kept
+
+    Args:
+        result_folder (str): folder of the test
+        target_folder (str): folder of the dataset
+        cycles ([str]): only these cycles. Default all
+        cameras ([str]): only these camera folder names. Default all
+        shard_size (int): number of samples in one shard
+        jobs (int): number of processes
+        order (str): ORDER_TICK or ORDER_CAMERA (see replay.ReplaySource)
+        textures ([[str, str]]): texture list the labels are taken from
+
+    Returns:
+        samples (int): number of samples in the dataset
+    """
+    samples = list_samples(result_folder, cycles, cameras, order, textures)
+    shards = [samples[i:i + shard_size] for i in range(0, len(samples), shard_size)]
+    settings = {'source': os.path.abspath(result_folder), 'cycles': cycles, 'cameras': cameras,
+                'shard_size': shard_size, 'order': order, 'samples': len(samples),
+                'keys': settings_hash([(s['folder'], s['tick']) for s in samples])}
+    os.makedirs(target_folder, exist_ok=True)
+    dataset_path = os.path.join(target_folder, DATASET_FILE)
+    if os.path.exists(dataset_path):
+        with open(dataset_path) as f:
+            existing = json.load(f)
+        if existing['settings'] != settings:
+            raise ValueError(f'{target_folder} contains a dataset with other settings: {existing["settings"]}')
+    else:
+        with open(dataset_path, 'w') as f:
+            json.dump({'settings': settings, 'classes': sign_classes(textures), 'shards': []}, f, indent=1)
+
+    missing = [shard for shard in range(0, len(shards))
+               if not os.path.exists(os.path.join(target_folder, shard_name(shard) + '.idx.npy'))]
+    print(f'Exporting {len(missing)} of {len(shards)} shards with {len(samples)} samples')
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(write_shard, target_folder, shard, shards[shard]) for shard in missing]
+        for future in futures:
+            print(f'Shard {shard_name(future.result())} written')
+
+    # global index of all shards
+    parts = [np.load(os.path.join(target_folder, shard_name(shard) + '.idx.npy')) for shard in range(0, len(shards))]
+    index = np.concatenate(parts) if parts else np.zeros(0, dtype=INDEX_DTYPE)
+    np.save(os.path.join(target_folder, INDEX_FILE + '.tmp.npy'), index)
+    os.replace(os.path.join(target_folder, INDEX_FILE + '.tmp.npy'), os.path.join(target_folder, INDEX_FILE))
+    with open(dataset_path + '.tmp', 'w') as f:
+        json.dump({'settings': settings, 'classes': sign_classes(textures),
+                   'shards': [shard_name(shard) for shard in range(0, len(shards))]}, f, indent=1)
+    os.replace(dataset_path + '.tmp', dataset_path)
+    return len(samples)
+
+
+class ShardedDataset:
+    """random access to the samples of an exported dataset through the global index.
+
+    Example:
+        dataset = ShardedDataset('D:/Datasets/T7_all')
+        image, label = dataset[12345]
+    """
+
+    def __init__(self, dataset_folder):
+        self.folder = dataset_folder
+        with open(os.path.join(dataset_folder, DATASET_FILE)) as f:
+            meta = json.load(f)
+        self.classes = meta['classes']
+        self.shards = meta['shards']
+        self.index = np.load(os.path.join(dataset_folder, INDEX_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, sample):
+        """returns the encoded image and the label of a sample"""
+        entry = self.index[sample]
+        with open(os.path.join(self.folder, self.shards[entry['shard']]), 'rb') as f:
+            f.seek(int(entry['image_offset']))
+            image = f.read(int(entry['image_size']))
+            f.seek(int(entry['label_offset']))
+            label = json.loads(f.read(int(entry['label_size'])))
+        return image, label
+
+    def __getitem__(self, sample):
+        """returns the decoded BGR image and the label of a sample"""
+        image, label = self.read(sample)
+        if image[:6] == b'\x93NUMPY':
+            return np.load(io.BytesIO(image)), label
+        return imdecode(np.frombuffer(image, dtype=np.uint8), IMREAD_COLOR), label
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('source', type=str, help='Filepath and name of the results directory')
+    parser.add_argument('target', type=str, help='Folder of the dataset')
+    parser.add_argument('-cycles', type=str, nargs='+', help='Cycle names. Default all')
+    parser.add_argument('-cameras', type=str, nargs='+', help='Camera folder names. Default all')
+    parser.add_argument('-shard_size', type=int, help='Number of samples in one shard', default=SHARD_SIZE)
+    parser.add_argument('-order', type=str, choices=[ORDER_TICK, ORDER_CAMERA], default=ORDER_TICK)
+    parser.add_argument('-jobs', type=int, help='Number of processes', default=ENCODER_WORKERS)
+    args = parser.parse_args()
+    export_dataset(args.source, args.target, args.cycles, args.cameras, args.shard_size, args.jobs, args.order)
@@ -0,0 +1,249 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Lens distortion as post-processing of the rendered pinhole images: fisheye (equidistant projection), Brown-Conrady
+(radial and tangential distortion) and vignetting. The remap table of a distortion is computed once per resolution,
+field of view and parameters and kept as .npz file in a cache folder, so sweeping distortion parameters needs neither
+new simulation runs nor recomputed tables.
+Attention! On Windows, scripts using the distortion need an if __name__ == '__main__': guard.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+
+from cv2 import convertMaps, imwrite, remap, undistortPoints, BORDER_CONSTANT, CV_16SC2, INTER_LINEAR
+import numpy as np
+
+from util.encoders import ENCODER_WORKERS
+from util.replay import ReplaySource, ORDER_CAMERA
+from util.test_lists import camera_tests, EXTRA_CAMERA_TESTS
+
+# default folder for the remap tables. Can be changed with the environment variable CARLA_DISTORTION_CACHE
+CACHE_FOLDER = os.environ.get('CARLA_DISTORTION_CACHE', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images', '_compiled', 'distortion'))
+# number of frames processed together by one process
+BATCH_SIZE = 8
+
+MODEL_NONE = 'none'
+MODEL_FISHEYE = 'fisheye'
+MODEL_BROWN_CONRADY = 'brown_conrady'
+
+
+# remap tables loaded by this process, by path
+_tables = {}
+
+
+def camera_matrix(width, height, fov):
+    """returns the intrinsic matrix of a carla pinhole camera with a horizontal field of view in degrees"""
+    focal = width / (2.0 * np.tan(np.radians(fov) / 2.0))
+    return np.array([[focal, 0.0, width / 2.0], [0.0, focal, height / 2.0], [0.0, 0.0, 1.0]])
+
+
+def fisheye_maps(width, height, fov):
+    """ returns the source coordinates of every pixel of an equidistant fisheye image (r = f * theta) with the same
+    horizontal field of view as the pinhole image. Pixels beyond 90 degrees from the optical axis have no source
+
+    Returns:
+        map_x, map_y (ndarray): (height, width) float32 source coordinates in the pinhole image
+    """
+    k = camera_matrix(width, height, fov)
+    focal_fisheye = width / 2.0 / (np.radians(fov) / 2.0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+    dx = x - k[0, 2]
+    dy = y - k[1, 2]
+    radius = np.hypot(dx, dy)
+    theta = radius / focal_fisheye
+    scale = np.full_like(radius, -1.0)
+    valid = theta < np.pi / 2.0 - 1e-3
+    scale[valid] = k[0, 0] * np.tan(theta[valid]) / np.maximum(radius[valid], 1e-9)
+    map_x = np.where(valid, k[0, 2] + dx * scale, -1.0)
+    map_y = np.where(valid, k[1, 2] + dy * scale, -1.0)
+    return map_x.astype(np.float32), map_y.astype(np.float32)
+
+
+def brown_conrady_maps(width, height, fov, k1=0.0, k2=0.0, k3=0.0, p1=0.0, p2=0.0):
+    """ returns the source coordinates of every pixel of an image with Brown-Conrady distortion. The undistorted
+    position of each distorted pixel is found with the iterative inversion of OpenCV
+
+    Returns:
+        map_x, map_y (ndarray): (height, width) float32 source coordinates in the pinhole image
+    """
+    k = camera_matrix(width, height, fov)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    points = np.stack([x.ravel(), y.ravel()], axis=1).reshape(-1, 1, 2)
+    source = undistortPoints(points, k, np.array([k1, k2, p1, p2, k3]), P=k).reshape(height, width, 2)
+    return source[:, :, 0].astype(np.float32), source[:, :, 1].astype(np.float32)
+
+
+def vignetting_gain(width, height, strength):
+    """returns the (height, width, 1) brightness factor of a radial vignetting that darkens the corners by strength"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    radius = np.hypot(x - width / 2.0, y - height / 2.0) / np.hypot(width / 2.0, height / 2.0)
+    return (1.0 - strength * radius ** 2)[:, :, np.newaxis].astype(np.float32)
+
+
+class Distortion:
+    """lens model applied to the frames of a camera"""
+
+    def __init__(self, model=MODEL_FISHEYE, fov=120, vignetting=0.0, name=None, cache_folder=CACHE_FOLDER, **params):
+        """
+        Args:
+            model (str): MODEL_FISHEYE, MODEL_BROWN_CONRADY or MODEL_NONE (only vignetting)
+            fov (float): horizontal field of view of the rendered camera in degrees
+            vignetting (float): darkening of the image corners between 0.0 and 1.0
+            name (str): name of the distortion, used as suffix of the camera folders. Default the model
+            cache_folder (str): folder of the remap tables
+            params: parameters of the Brown-Conrady model: k1, k2, k3, p1, p2
+        """
+        self.model = model
+        self.fov = fov
+        self.vignetting = vignetting
+        self.params = params
+        self.name = name or model
+        self.cache_folder = cache_folder
+
+    def settings(self, width, height):
+        return {'model': self.model, 'fov': self.fov, 'vignetting': self.vignetting, 'params': self.params,
+                'resolution': [width, height]}
+
+    def table_path(self, width, height):
+        """returns the path of the remap table in the cache"""
+        key = hashlib.sha1(json.dumps(self.settings(width, height), sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_folder, f'{self.model}_{width}x{height}_{key}.npz')
+
+    def compute_table(self, width, height):
+        """computes the remap table in the fixed point format of OpenCV and the vignetting factors"""
+        if self.model == MODEL_FISHEYE:
+            map_x, map_y = fisheye_maps(width, height, self.fov)
+        elif self.model == MODEL_BROWN_CONRADY:
+            map_x, map_y = brown_conrady_maps(width, height, self.fov, **self.params)
+        elif self.model == MODEL_NONE:
+            map_y, map_x = np.mgrid[0:height, 0:width].astype(np.float32)
+        else:
+            raise ValueError(f'Unknown distortion model {self.model}')
+        map_xy, map_frac = convertMaps(map_x, map_y, CV_16SC2)
+        gain = vignetting_gain(width, height, self.vignetting) if self.vignetting else np.empty(0, np.float32)
+        return {'map_xy': map_xy, 'map_frac': map_frac, 'gain': gain}
+
+    def table(self, width, height):
+        """returns the remap table of a resolution. It is computed on first use and loaded from the cache afterwards"""
+        path = self.table_path(width, height)
+        if path in _tables:
+            return _tables[path]
+        table = None
+        if os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    table = {name: data[name] for name in data.files}
+            except (OSError, ValueError):
+                pass  # broken table, e.g. of an interrupted process
+        if table is None:
+            table = self.compute_table(width, height)
+            os.makedirs(self.cache_folder, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+            np.savez(tmp_path, **table)
+            os.replace(tmp_path, path)
+        _tables[path] = table
+        return table
+
+    def apply(self, frames):
+        """ distorts a batch of frames
+
+        Args:
+            frames (ndarray): (n, height, width, 3) BGR frames
+
+        Returns:
+            frames (ndarray): (n, height, width, 3) distorted BGR frames
+        """
+        height, width = frames.shape[1:3]
+        table = self.table(width, height)
+        result = np.stack([remap(frame, table['map_xy'], table['map_frac'], INTER_LINEAR,
+                                 borderMode=BORDER_CONSTANT) for frame in frames])
+        if table['gain'].size:
+            result = (result * table['gain'] + 0.5).astype(np.uint8)
+        return result
+
+    def folder(self, camera_folder):
+        """returns the camera folder of the distorted frames"""
+        return f'{camera_folder}_{self.name}'
+
+
+def process_batch(distortions, frames, ticks, camera_folder):
+    """ applies several distortions to a batch of frames and stores the results as png files. Runs in the pool
+    processes
+
+    Returns:
+        frames (int): number of stored frames
+    """
+    stored = 0
+    for distortion in distortions:
+        folder = distortion.folder(camera_folder)
+        os.makedirs(folder, exist_ok=True)
+        for tick, frame in zip(ticks, distortion.apply(frames)):
+            imwrite(os.path.join(folder, f'{tick:04d}.png'), frame)
+            stored += 1
+    return stored
+
+
+def distort_run(result_folder, distortions, cameras=None, jobs=ENCODER_WORKERS, batch_size=BATCH_SIZE):
+    """ applies distortions to the camera folders of a finished test
+
+    Args:
+        result_folder (str): folder of the test
+        distortions ([Distortion]): distortions that are applied to every camera folder
+        cameras ([str]): only these camera folder names. Default all rendered camera folders, i.e. the folders whose
+            name ends with a known camera test. Derived folders of effects or earlier distortions are skipped
+        jobs (int): number of processes
+        batch_size (int): number of frames processed together
+
+    Returns:
+        frames (int): number of stored frames
+    """
+    source = ReplaySource(result_folder, cameras=cameras, order=ORDER_CAMERA)
+    if cameras is None:
+        tests = camera_tests + EXTRA_CAMERA_TESTS
+        source.folders = [folder for folder in source.folders
+                          if any(folder['camera'] == test or folder['camera'].endswith('_' + test) for test in tests)]
+    # compute missing tables once before the processes start
+    sizes = {source.load((folder, *folder['ticks'][0])).image.shape[1::-1] for folder in source.folders}
+    for width, height in sizes:
+        for distortion in distortions:
+            distortion.table(width, height)
+    stored = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        batch = []
+        for frame in source:
+            if batch and (len(batch) == batch_size or batch[0].folder != frame.folder):
+                futures.append(pool.submit(process_batch, distortions, np.stack([f.image for f in batch]),
+                                           [f.tick for f in batch], batch[0].folder))
+                batch = []
+            batch.append(frame)
+        if batch:
+            futures.append(pool.submit(process_batch, distortions, np.stack([f.image for f in batch]),
+                                       [f.tick for f in batch], batch[0].folder))
+        for future in futures:
+            stored += future.result()
+    print(f'Distorted {stored} frames of {len(source.folders)} camera folders')
+    return stored
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('source', type=str, help='Filepath and name of the results directory')
+    parser.add_argument('-model', type=str, choices=[MODEL_FISHEYE, MODEL_BROWN_CONRADY, MODEL_NONE],
+                        default=MODEL_FISHEYE)
+    parser.add_argument('-fov', type=float, help='Horizontal field of view of the cameras', default=120.0)
+    parser.add_argument('-k', type=float, nargs='*', help='Radial coefficients k1 k2 k3', default=[])
+    parser.add_argument('-p', type=float, nargs='*', help='Tangential coefficients p1 p2', default=[])
+    parser.add_argument('-vignetting', type=float, help='Darkening of the corners (0.0 - 1.0)', default=0.0)
+    parser.add_argument('-name', type=str, help='Suffix of the new camera folders. Default the model')
+    parser.add_argument('-cameras', type=str, nargs='+', help='Camera folder names. Default all rendered cameras')
+    parser.add_argument('-jobs', type=int, help='Number of processes', default=ENCODER_WORKERS)
+    args = parser.parse_args()
+    params = dict(zip(['k1', 'k2', 'k3'], args.k))
+    params.update(zip(['p1', 'p2'], args.p))
+    distort_run(args.source, [Distortion(args.model, args.fov, args.vignetting, args.name, **params)], args.cameras,
+                args.jobs)
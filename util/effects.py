@@ -0,0 +1,221 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Camera effects computed on the CPU. Many camera tests only differ in the tone response (ISO, shutter speed, f-stop,
+gamma). Instead of rendering a separate camera for each of them, they are derived from the frames of the base camera
+01_default_new (manual exposure, gamma 1.0) with gain, gamma curve, sensor noise and blur. The effects run batched over
+several frames in a pool of processes.
+These are approximations of the rendered effects: exposure is modelled as gain, depth of field and lens flares are not
+reproduced.
+Attention! On Windows, scripts using the effects need an if __name__ == '__main__': guard.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+
+from cv2 import blur, imwrite
+import numpy as np
+
+from util.encoders import ENCODER_WORKERS, get_pool
+from util.replay import ReplaySource, ORDER_CAMERA
+
+# camera test whose frames are the base of all effects
+BASE_TEST = '01_default_new'
+# suffix of the camera folders with derived frames, so they are not mixed up with rendered cameras
+EFFECT_SUFFIX = '_fx'
+# number of frames processed together by one process
+BATCH_SIZE = 8
+# exposure settings of the base camera (carla defaults)
+BASE_ISO = 100.0
+BASE_SHUTTER_SPEED = 200.0
+BASE_FSTOP = 1.4
+# standard deviation of the sensor noise at the base exposure in 8 bit units. Grows with the square root of the gain
+BASE_NOISE = 1.0
+
+
+def exposure_gain(iso=BASE_ISO, shutter_speed=BASE_SHUTTER_SPEED, fstop=BASE_FSTOP):
+    """returns the brightness factor of an exposure compared to the base camera"""
+    return (iso / BASE_ISO) * (BASE_SHUTTER_SPEED / shutter_speed) * (BASE_FSTOP / fstop) ** 2
+
+
+class Effect:
+    """tone response and degradation of a camera test"""
+
+    def __init__(self, gain=1.0, gamma=1.0, noise=0.0, blur_length=0):
+        """
+        Args:
+            gain (float): brightness factor applied to the linear base image
+            gamma (float): target gamma. The output is input ** (1 / gamma)
+            noise (float): standard deviation of gaussian sensor noise in 8 bit units
+            blur_length (int): length in pixels of a horizontal motion blur. 0 disables the blur
+        """
+        self.gain = gain
+        self.gamma = gamma
+        self.noise = noise
+        self.blur_length = blur_length
+        # gain and gamma only depend on the pixel value, so they are combined in a lookup table
+        values = np.arange(256, dtype=np.float32) / 255.0
+        self.lut = (np.clip(values * gain, 0.0, 1.0) ** (1.0 / gamma) * 255.0 + 0.5).astype(np.uint8)
+
+    def apply(self, frames, seeds=None):
+        """ applies the effect to a batch of frames
+
+        Args:
+            frames (ndarray): (n, height, width, 3) BGR frames of the base camera
+            seeds ([int]): seed of the noise of every frame (see noise_seed), so the result is reproducible and
+                independent of the batch size. Default 0 for all frames
+
+        Returns:
+            frames (ndarray): (n, height, width, 3) BGR frames with the effect
+        """
+        if self.blur_length > 1:
+            frames = np.stack([blur(frame, (self.blur_length, 1)) for frame in frames])
+        if not self.noise:
+            return self.lut[frames]
+        seeds = seeds if seeds is not None else [0] * len(frames)
+        linear = frames.astype(np.float32) * self.gain
+        linear += np.stack([np.random.default_rng(seed).normal(0.0, self.noise, frame.shape)
+                            for seed, frame in zip(seeds, frames)]).astype(np.float32)
+        np.clip(linear, 0.0, 255.0, out=linear)
+        if self.gamma != 1.0:
+            linear = (linear / 255.0) ** (1.0 / self.gamma) * 255.0
+        return (linear + 0.5).astype(np.uint8)
+
+
+def sensor_effect(iso=BASE_ISO, shutter_speed=BASE_SHUTTER_SPEED, fstop=BASE_FSTOP, gamma=1.0, blur_length=0):
+    """creates the effect of a camera setting. High ISO values also amplify the sensor noise"""
+    noise = BASE_NOISE * np.sqrt(iso / BASE_ISO) if iso > BASE_ISO else 0.0
+    return Effect(exposure_gain(iso, shutter_speed, fstop), gamma, noise, blur_length)
+
+
+# camera tests that can be derived from the base camera (see camera_utils.set_camera_test)
+EFFECTS = {
+    '10_mblur_low': Effect(blur_length=3),
+    '11_mblur_high': Effect(blur_length=9),
+    '20_low_shutter_speed': sensor_effect(shutter_speed=50.0),
+    '21_high_shutter_speed': sensor_effect(shutter_speed=800.0),
+    '22_low_shutter_speed_iso': sensor_effect(shutter_speed=50.0, iso=25.0),
+    '23_high_shutter_speed_iso': sensor_effect(shutter_speed=800.0, iso=400.0),
+    '30_iso_400': sensor_effect(iso=400.0),
+    '31_iso_25': sensor_effect(iso=25.0),
+    '40_high_gamma': sensor_effect(gamma=5.0),
+    '41_gamma_1.0': sensor_effect(),
+    '60_small_f_stop': sensor_effect(fstop=0.7),
+    '61_large_fstop': sensor_effect(fstop=2.8),
+    '62_small_f_stop_iso': sensor_effect(fstop=0.7, iso=25.0),
+    '63_large_fstop_iso': sensor_effect(fstop=2.8, iso=400.0),
+}
+
+
+def noise_seed(base_folder, test, tick):
+    """returns the noise seed of a derived frame from cycle, camera, camera test and tick, so the noise of different
+    cycles, cameras and tests is not correlated"""
+    parent, camera = os.path.split(os.path.normpath(base_folder))
+    key = f'{os.path.basename(parent)}/{camera}/{test}/{tick}'.encode('utf-8')
+    return int.from_bytes(hashlib.sha1(key).digest()[:8], 'little')
+
+
+def derived_folder(base_folder, test):
+    """returns the folder of a derived camera, e.g. results/cycle/cam_30_iso_400_fx for results/cycle/cam_01_default_new"""
+    parent, name = os.path.split(base_folder)
+    prefix = name[:len(name) - len(BASE_TEST)] if name.endswith(BASE_TEST) else name + '_'
+    return os.path.join(parent, prefix + test + EFFECT_SUFFIX)
+
+
+def process_batch(tests, frames, ticks, base_folder):
+    """ applies several effects to a batch of frames and stores the results as png files. Runs in the pool processes,
+    so only the base frames are sent to the process
+
+    Args:
+        tests ([str]): camera tests in EFFECTS
+        frames (ndarray): (n, height, width, 3) BGR frames of the base camera
+        ticks ([int]): tick numbers of the frames
+        base_folder (str): camera folder of the base camera
+
+    Returns:
+        frames (int): number of stored frames
+    """
+    stored = 0
+    for test in tests:
+        folder = derived_folder(base_folder, test)
+        os.makedirs(folder, exist_ok=True)
+        seeds = [noise_seed(base_folder, test, tick) for tick in ticks]
+        for tick, frame in zip(ticks, EFFECTS[test].apply(frames, seeds)):
+            imwrite(os.path.join(folder, f'{tick:04d}.png'), frame)
+            stored += 1
+    return stored
+
+
+def derive_run(result_folder, tests=None, base_test=BASE_TEST, jobs=ENCODER_WORKERS, batch_size=BATCH_SIZE):
+    """ derives camera tests from the base cameras of a finished test
+
+    Args:
+        result_folder (str): folder of the test
+        tests ([str]): camera tests in EFFECTS. Default all
+        base_test (str): camera test of the base cameras
+        jobs (int): number of processes
+        batch_size (int): number of frames processed together
+
+    Returns:
+        frames (int): number of stored frames
+    """
+    tests = tests or list(EFFECTS)
+    source = ReplaySource(result_folder, order=ORDER_CAMERA)
+    source.folders = [folder for folder in source.folders if folder['camera'].endswith(base_test)]
+    stored = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        batch = []
+        for frame in source:
+            if batch and (len(batch) == batch_size or batch[0].folder != frame.folder):
+                futures.append(pool.submit(process_batch, tests, np.stack([f.image for f in batch]),
+                                           [f.tick for f in batch], batch[0].folder))
+                batch = []
+            batch.append(frame)
+        if batch:
+            futures.append(pool.submit(process_batch, tests, np.stack([f.image for f in batch]),
+                                       [f.tick for f in batch], batch[0].folder))
+        for future in futures:
+            stored += future.result()
+    print(f'Derived {stored} frames of {len(tests)} camera tests from {len(source.folders)} base cameras')
+    return stored
+
+
+class EffectsSink:
+    """sink of a base camera that also derives camera tests from every image during the test. The effects run in the
+    shared pool of encoding processes (see encoders.get_pool)"""
+
+    def __init__(self, sink, tests):
+        """
+        Args:
+            sink: sink of the base camera folder (see frame_sinks)
+            tests ([str]): camera tests in EFFECTS
+        """
+        self.sink = sink
+        self.folder = sink.folder
+        self.tests = tests
+        self.profiler = sink.profiler
+        for test in tests:
+            os.makedirs(derived_folder(self.folder, test), exist_ok=True)
+
+    def write(self, image, tick):
+        img_name = self.sink.write(image, tick)
+        bgr = np.frombuffer(image.raw_data, dtype=np.uint8).reshape(image.height, image.width, 4)[:, :, :3]
+        with self.profiler.timer(f'effects/{os.path.basename(self.folder)}'):
+            get_pool().submit(process_batch, self.tests, bgr[np.newaxis].copy(), [tick], self.folder).result()
+        return img_name
+
+    def close(self):
+        self.sink.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('source', type=str, help='Filepath and name of the results directory')
+    parser.add_argument('-tests', type=str, nargs='+', choices=list(EFFECTS), help='Derived camera tests. Default all')
+    parser.add_argument('-base', type=str, help='Camera test of the base cameras', default=BASE_TEST)
+    parser.add_argument('-jobs', type=int, help='Number of processes', default=ENCODER_WORKERS)
+    parser.add_argument('-batch', type=int, help='Number of frames processed together', default=BATCH_SIZE)
+    args = parser.parse_args()
+    derive_run(args.source, args.tests, args.base, args.jobs, args.batch)
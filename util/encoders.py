@@ -0,0 +1,222 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Image encoders for the camera output. The encoding runs in a pool of processes, so several high resolution cameras
+are not slowed down by the GIL.
+Attention! On Windows, scripts using these encoders need an if __name__ == '__main__': guard.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+import io
+import logging
+import os
+import threading
+from time import perf_counter
+
+import numpy as np
+from cv2 import imencode, IMWRITE_PNG_COMPRESSION, IMWRITE_JPEG_QUALITY, IMWRITE_WEBP_QUALITY
+
+from util.profiler import NULL_PROFILER
+
+# default number of encoding processes
+ENCODER_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+# maximum number of images of a camera folder that are encoded at the same time
+ENCODER_PENDING = 2 * ENCODER_WORKERS
+
+
+class PngEncoder:
+    """png with configurable compression level (0 = fastest, 9 = smallest)"""
+    name = 'png'
+    ext = 'png'
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def encode(self, bgr):
+        return imencode('.png', bgr, [IMWRITE_PNG_COMPRESSION, self.level])[1].tobytes()
+
+    def __str__(self):
+        return f'png:{self.level}'
+
+
+class JpegEncoder:
+    """jpeg with configurable quality (0-100)"""
+    name = 'jpg'
+    ext = 'jpg'
+
+    def __init__(self, quality=90):
+        self.quality = quality
+
+    def encode(self, bgr):
+        return imencode('.jpg', bgr, [IMWRITE_JPEG_QUALITY, self.quality])[1].tobytes()
+
+    def __str__(self):
+        return f'jpg:{self.quality}'
+
+
+class WebpEncoder:
+    """webp with configurable quality (1-100, above 100 is lossless)"""
+    name = 'webp'
+    ext = 'webp'
+
+    def __init__(self, quality=90):
+        self.quality = quality
+
+    def encode(self, bgr):
+        return imencode('.webp', bgr, [IMWRITE_WEBP_QUALITY, self.quality])[1].tobytes()
+
+    def __str__(self):
+        return f'webp:{self.quality}'
+
+
+class NpyEncoder:
+    """uncompressed numpy array of the BGR image"""
+    name = 'npy'
+    ext = 'npy'
+
+    def encode(self, bgr):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(bgr))
+        return buffer.getvalue()
+
+    def __str__(self):
+        return 'npy'
+
+
+ENCODERS = {
+    'png': PngEncoder,
+    'jpg': JpegEncoder,
+    'jpeg': JpegEncoder,
+    'webp': WebpEncoder,
+    'npy': NpyEncoder
+}
+
+
+def parse_encoder(spec):
+    """creates an encoder from a string like 'png:1', 'jpg:85', 'webp:90' or 'npy'
+
+    Args:
+        spec (str): name of the format, optionally followed by the compression level or quality
+
+    Returns:
+        encoder: encoder object
+    """
+    name, _, value = spec.partition(':')
+    if name not in ENCODERS:
+        raise ValueError(f'Unknown encoder: {spec}')
+    if value:
+        return ENCODERS[name](int(value))
+    return ENCODERS[name]()
+
+
+def encode_frame(encoder, data, height, width, img_name):
+    """encodes raw BGRA data and writes it to a file. Runs in the encoding processes
+
+    Returns:
+        size (int): number of bytes written
+        seconds (float): time needed for encoding and writing
+    """
+    start = perf_counter()
+    bgr = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)[:, :, :3]
+    payload = encoder.encode(bgr)
+    with open(img_name, 'wb') as f:
+        f.write(payload)
+    return len(payload), perf_counter() - start
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(workers=ENCODER_WORKERS):
+    """returns the shared pool of encoding processes. It is created with the first call"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def shutdown_pool():
+    """stops the encoding processes"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+
+class EncoderSink:
+    """stores the images of a camera folder with an encoder in the pool of encoding processes. The writer thread only
+    submits the image, so more images than writer threads are encoded at the same time. The writer thread waits when
+    max_pending images of the folder are still being encoded, close waits for all of them."""
+    profiler = NULL_PROFILER
+
+    def __init__(self, folder, encoder, width, height, logger=None, max_pending=ENCODER_PENDING):
+        """
+        Args:
+            folder (str): camera folder for the images
+            encoder: encoder object (see ENCODERS)
+            width (int): x resolution of the camera
+            height (int): y resolution of the camera
+            logger (Logger): Logger object for showing and recording the progress
+            max_pending (int): maximum number of images of the folder that are encoded at the same time
+        """
+        self.folder = folder
+        self.encoder = encoder
+        self.width = width
+        self.height = height
+        self.logger = logger or logging.getLogger('logger')
+        self.frames = 0
+        self.bytes = 0
+        self.encode_time = 0.0
+        self.failed = 0
+        self.max_pending = max(1, max_pending)
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def write(self, image, tick):
+        img_name = f'{self.folder}/{tick:04d}.{self.encoder.ext}'
+        future = get_pool().submit(encode_frame, self.encoder, bytes(image.raw_data), self.height, self.width,
+                                   img_name)
+        future.add_done_callback(lambda done: self._finished(done, img_name))
+        with self._lock:
+            while self._pending and self._pending[0].done():
+                self._pending.popleft()
+            self._pending.append(future)
+            oldest = self._pending[0] if len(self._pending) > self.max_pending else None
+        if oldest is not None:
+            wait([oldest])
+        return img_name
+
+    def _finished(self, future, img_name):
+        """counts an encoded image. Called by the pool when the encoding is finished"""
+        try:
+            size, seconds = future.result()
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            self.logger.error(f'Could not save {img_name}: {e}')
+            return
+        with self._lock:
+            self.frames += 1
+            self.bytes += size
+            self.encode_time += seconds
+        if self.profiler.enabled:
+            camera = os.path.basename(self.folder)
+            self.profiler.add(f'encode/{camera}', seconds)
+            self.profiler.add(f'bytes/{camera}', size)
+
+    def close(self):
+        """waits for the images that are still being encoded and logs throughput and size of the encoded images"""
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        wait(pending)
+        if self.failed:
+            self.logger.error(f'{self.encoder} {self.folder}: {self.failed} frames could not be saved')
+        if self.frames:
+            rates = (f', {self.frames / self.encode_time:.1f} frames/s per process, '
+                     f'{self.bytes / self.encode_time / 2 ** 20:.1f} MiB/s per process') if self.encode_time > 0 else ''
+            self.logger.info(f'{self.encoder} {self.folder}: {self.frames} frames, '
+                             f'{self.bytes / self.frames / 1024:.1f} KiB/frame{rates}')
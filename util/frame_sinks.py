@@ -0,0 +1,259 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Sinks that store the images of a single camera. Each camera folder gets its own sink.
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+from queue import Queue
+import threading
+
+from cv2 import VideoWriter, VideoWriter_fourcc
+import numpy as np
+
+from util.encoders import EncoderSink, parse_encoder
+from util.profiler import NULL_PROFILER
+
+# output formats of the cameras
+OUTPUT_PNG = 'png'
+OUTPUT_RAW = 'raw'
+OUTPUT_VIDEO = ('mp4', 'avi')
+
+RAW_FRAMES_FILE = 'frames.npy'
+RAW_META_FILE = 'frames.json'
+
+# frame rate of videos of cameras that create an image every tick
+VIDEO_FPS = 10
+# number of frames that are kept back to put frames stored by different writer threads back into tick order
+VIDEO_REORDER_WINDOW = 8
+# maximum number of frames waiting for the encoding thread
+VIDEO_QUEUE_SIZE = 16
+
+
+class PngSink:
+    """stores every image as png file named after its tick"""
+    profiler = NULL_PROFILER
+
+    def __init__(self, folder):
+        """
+        Args:
+            folder (str): camera folder for the images
+        """
+        self.folder = folder
+
+    def write(self, image, tick):
+        """stores an image
+
+        Args:
+            image (Image): image that was created by a camera
+            tick (int): tick number of the image
+
+        Returns:
+            img_name (str): name of the stored file
+        """
+        img_name = f'{self.folder}/{tick:04d}.png'
+        if self.profiler.enabled:
+            camera = os.path.basename(self.folder)
+            with self.profiler.timer(f'encode/{camera}'):
+                image.save_to_disk(img_name)
+            self.profiler.add(f'bytes/{camera}', os.path.getsize(img_name))
+        else:
+            image.save_to_disk(img_name)
+        return img_name
+
+    def close(self):
+        pass
+
+
+class RawSink:
+    """copies the raw BGRA data of every image into a preallocated, memory mapped (ticks, height, width, 4) array.
+    This avoids the png compression during the test. Use tools/convert_raw.py to create png files or videos later."""
+    profiler = NULL_PROFILER
+
+    def __init__(self, folder, ticks, width, height, meta=None):
+        """
+        Args:
+            folder (str): camera folder for the array
+            ticks (int): number of recorded ticks
+            width (int): x resolution of the camera
+            height (int): y resolution of the camera
+            meta (dict): additional information stored in the metadata file, e.g. camera settings
+        """
+        self.folder = folder
+        self.ticks = ticks
+        self.meta = {'ticks': ticks, 'width': width, 'height': height, 'channels': 'BGRA', 'dtype': 'uint8'}
+        self.meta.update(meta or {})
+        self.frames = np.lib.format.open_memmap(os.path.join(folder, RAW_FRAMES_FILE), mode='w+', dtype=np.uint8,
+                                                shape=(ticks, height, width, 4))
+        self.written = np.zeros(ticks, dtype=bool)
+        self.frame_ids = np.full(ticks, -1, dtype=np.int64)
+        self.write_meta()
+
+    def write(self, image, tick):
+        """copies an image into the array
+
+        Args:
+            image (Image): image that was created by a camera
+            tick (int): tick number of the image
+
+        Returns:
+            img_name (str): description of the written frame
+        """
+        if tick >= self.ticks:
+            raise IndexError(f'tick {tick} exceeds the {self.ticks} preallocated frames')
+        self.frames[tick] = np.frombuffer(image.raw_data, dtype=np.uint8).reshape(self.frames.shape[1:])
+        self.written[tick] = True
+        self.frame_ids[tick] = image.frame
+        if self.profiler.enabled:
+            self.profiler.add(f'bytes/{os.path.basename(self.folder)}', self.frames[tick].nbytes)
+        return f'{self.folder}/{RAW_FRAMES_FILE}[{tick}]'
+
+    def write_meta(self):
+        """writes the metadata file next to the array"""
+        meta = dict(self.meta)
+        meta['written'] = np.flatnonzero(self.written).tolist()
+        meta['frames'] = self.frame_ids[self.written].tolist()
+        with open(os.path.join(self.folder, RAW_META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+    def close(self):
+        self.frames.flush()
+        self.write_meta()
+
+
+class VideoSink:
+    """streams the images of a camera folder directly into a video in the subfolder _videos, so no png files are
+    needed. The video is encoded by a background thread. Frames are written in tick order."""
+    profiler = NULL_PROFILER
+
+    def __init__(self, folder, width, height, vformat='mp4', fps=VIDEO_FPS, logger=None):
+        """
+        Args:
+            folder (str): camera folder
+            width (int): x resolution of the camera
+            height (int): y resolution of the camera
+            vformat (str): video format. Can be mp4 or avi
+            fps (float): Frames per second
+            logger (Logger): Logger object for showing and recording the progress
+        """
+        self.folder = folder
+        self.width = width
+        self.height = height
+        self.logger = logger or logging.getLogger('logger')
+        video_folder = os.path.join(folder, '_videos')
+        if not os.path.exists(video_folder):
+            os.makedirs(video_folder)
+        if vformat == 'mp4':
+            self.video = os.path.join(video_folder, 'video.mp4')
+            fourcc = VideoWriter_fourcc(*'mp4v')
+        else:
+            self.video = os.path.join(video_folder, 'video.avi')
+            fourcc = VideoWriter_fourcc(*'XVID')
+        self.frames = 0
+        self.closed = False
+        # sequence number of the queued frames, so frames with the same tick are never compared
+        self._sequence = itertools.count()
+        # exception that stopped the encoding thread
+        self._error = None
+        self._vid_writer = VideoWriter(self.video, fourcc, fps, (width, height))
+        self._queue = Queue(VIDEO_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._encode, name=f'video_{os.path.basename(folder)}', daemon=True)
+        self._thread.start()
+
+    def write(self, image, tick):
+        if self.closed:
+            raise RuntimeError(f'video {self.video} is already finalized')
+        self._raise_error()
+        # copy the BGR channels, the carla image buffer is only valid as long as the image exists
+        bgr = np.frombuffer(image.raw_data, dtype=np.uint8).reshape(self.height, self.width, 4)[:, :, :3].copy()
+        self._queue.put((tick, next(self._sequence), bgr))
+        return f'{self.video}[{tick}]'
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError(f'encoding of video {self.video} failed: {self._error}') from self._error
+
+    def _encode(self):
+        reorder = []
+        metric = f'encode/{os.path.basename(self.folder)}'
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                heapq.heappush(reorder, item)
+                if len(reorder) > VIDEO_REORDER_WINDOW:
+                    with self.profiler.timer(metric):
+                        self._vid_writer.write(heapq.heappop(reorder)[2])
+                    self.frames += 1
+            while reorder:
+                with self.profiler.timer(metric):
+                    self._vid_writer.write(heapq.heappop(reorder)[2])
+                self.frames += 1
+        except Exception as e:
+            self._error = e
+            self.logger.error(f'Encoding of video {self.video} failed: {e}')
+            # keep draining the queue, so write() never blocks on a queue nobody reads
+            while item is not None:
+                item = self._queue.get()
+
+    def close(self):
+        """encodes the remaining frames and finalizes the video file"""
+        self.closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._vid_writer.release()
+        self._raise_error()
+        if self.profiler.enabled and os.path.exists(self.video):
+            self.profiler.add(f'bytes/{os.path.basename(self.folder)}', os.path.getsize(self.video))
+        self.logger.info(f'Created video {self.video} with {self.frames} frames')
+
+
+def make_sink(output, folder, ticks, width, height, meta=None, profiler=None):
+    """creates the sink for a camera folder
+
+    Args:
+        output: output format. OUTPUT_PNG (png written by carla), OUTPUT_RAW, 'mp4' or 'avi' for a video, an encoder
+            string like 'png:1', 'jpg:85', 'webp:90', 'npy' or an encoder object
+        folder (str): camera folder
+        ticks (int): number of recorded ticks
+        width (int): x resolution of the camera
+        height (int): y resolution of the camera
+        meta (dict): additional information about the camera
+        profiler (Profiler): records encoding times and written bytes of the sink
+
+    Returns:
+        sink: object with write(image, tick) and close()
+    """
+    if output == OUTPUT_PNG:
+        sink = PngSink(folder)
+    elif output == OUTPUT_RAW:
+        sink = RawSink(folder, ticks, width, height, meta)
+    elif output in OUTPUT_VIDEO:
+        sensor_tick = (meta or {}).get('sensor_tick', 0.0)
+        sink = VideoSink(folder, width, height, output, 1.0 / sensor_tick if sensor_tick > 0 else VIDEO_FPS)
+    else:
+        encoder = parse_encoder(output) if isinstance(output, str) else output
+        sink = EncoderSink(folder, encoder, width, height)
+    if profiler is not None:
+        sink.profiler = profiler
+    return sink
+
+
+def load_raw(folder):
+    """opens the raw frames of a camera folder without loading them into memory
+
+    Args:
+        folder (str): camera folder with frames.npy and frames.json
+
+    Returns:
+        frames (ndarray): read only (ticks, height, width, 4) BGRA array
+        meta (dict): metadata of the recording
+    """
+    with open(os.path.join(folder, RAW_META_FILE)) as f:
+        meta = json.load(f)
+    frames = np.load(os.path.join(folder, RAW_FRAMES_FILE), mmap_mode='r')
+    return frames, meta
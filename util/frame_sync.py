@@ -0,0 +1,138 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Barrier that synchronises the world ticks with the images of all cameras, so the test loop can run as fast as the
+server renders and every image is named after the tick it was rendered in.
+"""
+
+import logging
+import threading
+from time import monotonic
+
+# default time in seconds to wait for the images of a tick
+CAPTURE_TIMEOUT = 5.0
+
+
+class TickBarrier:
+    """Keeps track of the images delivered by all cameras. The tick of an image is derived from image.frame, so late
+    images are still stored under the right tick number. Images that don't arrive in time are counted as dropped."""
+
+    def __init__(self, tick_length, timeout=CAPTURE_TIMEOUT, logger=None):
+        """
+        Args:
+            tick_length (float): Length of a world tick in seconds
+            timeout (float): Maximum time in seconds to wait for the images of a tick
+            logger (Logger): Logger object for showing and recording the progress
+        """
+        self.tick_length = tick_length
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger('logger')
+        self.cameras = {}
+        self.frame0 = None
+        self.released = -1
+        self.delivered = 0
+        self.late = 0
+        self.missed = set()
+        self._arrived = {}
+        self._cond = threading.Condition()
+
+    @property
+    def dropped(self):
+        """number of images that never arrived"""
+        return len(self.missed)
+
+    def register(self, key, sensor_tick=0.0):
+        """adds a camera to the barrier
+
+        Args:
+            key (str): unique name of the camera, e.g. the image folder
+            sensor_tick (float): time between images of the camera. 0.0 means an image every world tick
+        """
+        period = max(1, round(sensor_tick / self.tick_length)) if sensor_tick > 0 else 1
+        with self._cond:
+            self.cameras[key] = {'period': period, 'first_tick': None}
+
+    def start(self, frame0):
+        """starts the recording
+
+        Args:
+            frame0 (int): world frame of the first recorded tick
+        """
+        with self._cond:
+            self.frame0 = frame0
+            self.released = -1
+            self._arrived = {}
+
+    def tick_of(self, frame):
+        """returns the tick number of a world frame or None if it was before the recording"""
+        if self.frame0 is None or frame < self.frame0:
+            return None
+        return frame - self.frame0
+
+    def expected(self, tick):
+        """returns the cameras that deliver an image in a tick. Cameras with a sensor_tick longer than the world tick
+        only deliver every few ticks, starting with their first image. Their phase is not known before the first
+        image, so they are only waited for in the last tick of their first period."""
+        keys = []
+        for key, cam in self.cameras.items():
+            if cam['first_tick'] is None:
+                if tick == cam['period'] - 1:
+                    keys.append(key)
+            elif tick >= cam['first_tick'] and (tick - cam['first_tick']) % cam['period'] == 0:
+                keys.append(key)
+        return keys
+
+    def arrive(self, key, frame):
+        """registers the image of a camera. Called by the camera callbacks
+
+        Args:
+            key (str): unique name of the camera
+            frame (int): image.frame of the delivered image
+
+        Returns:
+            tick (int): tick number of the image or None if it was taken before the recording started
+        """
+        tick = self.tick_of(frame)
+        if tick is None:
+            return None
+        with self._cond:
+            cam = self.cameras.get(key)
+            if cam is not None and cam['first_tick'] is None:
+                cam['first_tick'] = tick
+            self.delivered += 1
+            if tick <= self.released:
+                self.late += 1
+                self.missed.discard((tick, key))
+            else:
+                self._arrived.setdefault(tick, set()).add(key)
+            self._cond.notify_all()
+        return tick
+
+    def wait(self, tick):
+        """waits until all expected images of a tick have arrived or the timeout is reached
+
+        Args:
+            tick (int): tick number
+
+        Returns:
+            missing ([str]): cameras whose images didn't arrive in time
+        """
+        deadline = monotonic() + self.timeout
+        with self._cond:
+            while True:
+                arrived = self._arrived.get(tick, ())
+                missing = [key for key in self.expected(tick) if key not in arrived]
+                remaining = deadline - monotonic()
+                if not missing or remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            for key in missing:
+                self.missed.add((tick, key))
+            self._arrived.pop(tick, None)
+            self.released = tick
+        if missing:
+            self.logger.warning(f'Tick {tick}: no image after {self.timeout} s from {missing}')
+        return missing
+
+    def log_stats(self):
+        """logs the number of delivered, late and dropped images"""
+        self.logger.info(f'Images delivered: {self.delivered}, late: {self.late}, dropped: {self.dropped}')
@@ -0,0 +1,131 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Pool of writer threads that store the camera images on disk, so the sensor callbacks don't need to wait for the disk.
+"""
+
+from collections import deque
+import logging
+import os
+import threading
+from time import monotonic, perf_counter
+
+from util.profiler import NULL_PROFILER
+
+# default number of writer threads
+WRITER_WORKERS = 4
+# default maximum number of images waiting to be stored
+WRITER_QUEUE_SIZE = 64
+
+
+class FrameWriter:
+    """Bounded queue of images that is drained by several writer threads. When the queue is full, new images have to
+    wait until there is space again (backpressure) instead of sleeping for a fixed time."""
+
+    def __init__(self, workers=WRITER_WORKERS, queue_size=WRITER_QUEUE_SIZE, logger=None, profiler=None):
+        """
+        Args:
+            workers (int): number of writer threads
+            queue_size (int): maximum number of images waiting to be stored
+            logger (Logger): Logger object for showing and recording the progress
+            profiler (Profiler): records queue depths, waiting times and the latency from callback to stored image
+        """
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.logger = logger or logging.getLogger('logger')
+        self.profiler = profiler or NULL_PROFILER
+        self._jobs = deque()
+        self._pending = 0  # images in the queue or currently being stored
+        self._last_submit = monotonic()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._threads = []
+        for i in range(0, self.workers):
+            thread = threading.Thread(target=self._work, name=f'frame_writer_{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, sink, image, tick):
+        """puts an image into the queue. Blocks while the queue is full
+
+        Args:
+            sink: sink of the camera folder (see frame_sinks)
+            image (Image): image that was created by a camera
+            tick (int): tick number of the image
+        """
+        received = perf_counter()
+        with self._cond:
+            if self.profiler.enabled:
+                self.profiler.add('queue_depth', len(self._jobs))
+            while len(self._jobs) >= self.queue_size and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                self.logger.error(f'Frame writer closed. Dropping tick {tick} of {sink.folder}')
+                return
+            self._jobs.append((sink, image, tick, received))
+            self._pending += 1
+            self._last_submit = monotonic()
+            self._cond.notify_all()
+
+    def throttle(self, frames):
+        """waits until the queue has space for the images of the next tick
+
+        Args:
+            frames (int): number of images that are expected for the next tick. More images than the queue holds
+                only wait for an empty queue
+        """
+        frames = min(frames, self.queue_size)
+        with self.profiler.timer('throttle_wait'), self._cond:
+            while len(self._jobs) + frames > self.queue_size and not self._closed:
+                self._cond.wait()
+
+    def flush(self, settle_time=0.0):
+        """waits until all images have been stored
+
+        Args:
+            settle_time (float): time in seconds without new images before the writer counts as finished. Gives late
+                sensor callbacks the chance to deliver their last images.
+        """
+        with self.profiler.timer('flush_wait'), self._cond:
+            while True:
+                while self._pending:
+                    self._cond.wait()
+                remaining = self._last_submit + settle_time - monotonic()
+                if remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+    def close(self):
+        """stores all remaining images and stops the writer threads"""
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if not self._jobs:
+                    return
+                sink, image, tick, received = self._jobs.popleft()
+                self._cond.notify_all()
+            try:
+                start = perf_counter()
+                img_name = sink.write(image, tick)
+                if self.profiler.enabled:
+                    end = perf_counter()
+                    camera = os.path.basename(sink.folder)
+                    self.profiler.add(f'write/{camera}', end - start)
+                    self.profiler.add(f'latency/{camera}', end - received)
+                    self.profiler.add(f'pixels/{camera}', image.width * image.height)
+                self.logger.info(f'Saved {img_name}')
+            except Exception as e:
+                self.logger.error(f'Could not save tick {tick} of {sink.folder}: {e}')
+            finally:
+                with self._cond:
+                    self._pending -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,221 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+2D bounding boxes of the traffic signs in every camera. The corners of all signs are projected into all cameras of a
+tick with one batched numpy operation. Boxes that are cut by the image border get a truncation share, boxes behind
+other objects are detected with a ray from the camera to the sign. The boxes of a cycle are stored as columns in
+ground_truth.npz in the cycle folder.
+"""
+
+import logging
+import os
+
+import carla
+import numpy as np
+
+from util.update_texture import ROUND_TRAFFIC_SIGNS_TOWN7
+
+GROUND_TRUTH_FILE = 'ground_truth.npz'
+# signs farther away from the camera in meters are not labelled
+MAX_DISTANCE = 100.0
+# corners closer to the image plane in meters count as behind the camera
+NEAR_PLANE = 0.1
+# hits of the occlusion ray closer to the camera in meters belong to the own vehicle
+EGO_CLEARANCE = 2.0
+# hits of the occlusion ray closer than this to the sign in meters belong to the sign itself
+SIGN_TOLERANCE = 0.5
+
+# values of the occluded column
+OCCLUDED_NO = 0
+OCCLUDED_YES = 1
+OCCLUDED_UNKNOWN = -1
+
+# corners of the unit box, scaled by the extent of a bounding box
+_UNIT_CORNERS = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float64)
+
+
+def transform_matrices(poses):
+    """ returns the 4x4 matrices of carla transforms (unreal coordinates, rotation in degrees)
+
+    Args:
+        poses (ndarray): (n, 6) x, y, z, pitch, yaw, roll
+
+    Returns:
+        matrices (ndarray): (n, 4, 4) local to world matrices
+    """
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 6)
+    pitch, yaw, roll = np.radians(poses[:, 3:6]).T
+    cp, sp, cy, sy, cr, sr = np.cos(pitch), np.sin(pitch), np.cos(yaw), np.sin(yaw), np.cos(roll), np.sin(roll)
+    matrices = np.zeros((len(poses), 4, 4))
+    matrices[:, 0] = np.stack([cp * cy, cy * sp * sr - sy * cr, -cy * sp * cr - sy * sr, poses[:, 0]], axis=1)
+    matrices[:, 1] = np.stack([sy * cp, sy * sp * sr + cy * cr, -sy * sp * cr + cy * sr, poses[:, 1]], axis=1)
+    matrices[:, 2] = np.stack([sp, -cp * sr, cp * cr, poses[:, 2]], axis=1)
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+
+def pose(transform):
+    """returns x, y, z, pitch, yaw, roll of a carla transform"""
+    return [transform.location.x, transform.location.y, transform.location.z,
+            transform.rotation.pitch, transform.rotation.yaw, transform.rotation.roll]
+
+
+def find_signs(world, objects=ROUND_TRAFFIC_SIGNS_TOWN7):
+    """ looks up the bounding boxes of the sign objects in the world
+
+    Args:
+        world: carla world
+        objects ([str]): names of the sign objects
+
+    Returns:
+        names ([str]): names of the found signs
+        corners (ndarray): (signs, 8, 3) world coordinates of the bounding box corners
+    """
+    candidates = world.get_environment_objects(carla.CityObjectLabel.TrafficSigns)
+    names = []
+    corners = []
+    for name in objects:
+        found = next((obj for obj in candidates if obj.name == name), None) or \
+            next((obj for obj in candidates if name in obj.name), None)
+        if found is None:
+            logging.getLogger('logger').warning(f'Sign {name} not found, no ground truth for it')
+            continue
+        box = found.bounding_box
+        extent = np.array([box.extent.x, box.extent.y, box.extent.z])
+        matrix = transform_matrices(pose(carla.Transform(box.location, box.rotation)))[0]
+        corners.append((_UNIT_CORNERS * extent) @ matrix[:3, :3].T + matrix[:3, 3])
+        names.append(name)
+    return names, np.array(corners, dtype=np.float64).reshape(-1, 8, 3)
+
+
+def intrinsics(cameras):
+    """returns the (cameras, 4) focal length, principal point x and y and width, and the (cameras,) heights"""
+    width = np.array([cam.x_cam for cam in cameras], dtype=np.float64)
+    height = np.array([cam.y_cam for cam in cameras], dtype=np.float64)
+    focal = width / (2.0 * np.tan(np.radians([cam.fov for cam in cameras]) / 2.0))
+    return np.stack([focal, width / 2.0, height / 2.0, width], axis=1), height
+
+
+def project_boxes(corners, camera_matrices, camera_intrinsics, heights, max_distance=MAX_DISTANCE):
+    """ projects the corners of all signs into all cameras of one tick
+
+    Args:
+        corners (ndarray): (signs, 8, 3) world coordinates of the sign corners
+        camera_matrices (ndarray): (cameras, 4, 4) camera to world matrices
+        camera_intrinsics (ndarray): (cameras, 4) see intrinsics
+        heights (ndarray): (cameras,) image heights
+        max_distance (float): signs farther away in meters are dropped
+
+    Returns:
+        camera, sign (ndarray): indices of the labelled pairs
+        boxes (ndarray): (n, 4) x_min, y_min, x_max, y_max clipped to the image
+        distance (ndarray): (n,) distance between camera and sign center in meters
+        truncation (ndarray): (n,) share of the box outside of the image
+    """
+    signs = len(corners)
+    points = np.concatenate([corners.reshape(-1, 3), np.ones((signs * 8, 1))], axis=1)
+    # (cameras, signs * 8, 3) in camera coordinates: x forward, y right, z up
+    local = np.einsum('cij,pj->cpi', np.linalg.inv(camera_matrices), points)[:, :, :3].reshape(-1, signs, 8, 3)
+    focal, cx, cy, width = (camera_intrinsics[:, i, np.newaxis, np.newaxis] for i in range(0, 4))
+    depth = local[..., 0]
+    in_front = np.all(depth > NEAR_PLANE, axis=2)
+    safe_depth = np.where(depth > NEAR_PLANE, depth, 1.0)
+    u = cx + focal * local[..., 1] / safe_depth
+    v = cy - focal * local[..., 2] / safe_depth
+    raw = np.stack([u.min(axis=2), v.min(axis=2), u.max(axis=2), v.max(axis=2)], axis=2)
+    limits = np.stack([width[..., 0], heights[:, np.newaxis]], axis=2)
+    clipped = np.concatenate([np.clip(raw[..., :2], 0.0, limits), np.clip(raw[..., 2:], 0.0, limits)], axis=2)
+    area = (raw[..., 2] - raw[..., 0]) * (raw[..., 3] - raw[..., 1])
+    clipped_area = (clipped[..., 2] - clipped[..., 0]) * (clipped[..., 3] - clipped[..., 1])
+    distance = np.linalg.norm(local.mean(axis=2), axis=2)
+    camera, sign = np.nonzero(in_front & (clipped_area > 0.0) & (distance <= max_distance))
+    truncation = 1.0 - clipped_area[camera, sign] / np.maximum(area[camera, sign], 1e-9)
+    return camera, sign, clipped[camera, sign], distance[camera, sign], truncation
+
+
+def is_occluded(world, start, end, distance):
+    """checks with a ray from the camera to the sign center if another object is in between"""
+    for point in world.cast_ray(start, end):
+        hit = point.location.distance(start)
+        if EGO_CLEARANCE < hit < distance - SIGN_TOLERANCE and \
+                point.label not in (carla.CityObjectLabel.TrafficSigns, carla.CityObjectLabel.Poles):
+            return True
+    return False
+
+
+class BoxRecorder:
+    """collects the 2D boxes of the signs in all cameras tick by tick. Every RGBCamera object is one camera of the
+    ground truth, the boxes are valid for all of its camera folders"""
+
+    def __init__(self, world, objects, cameras, max_distance=MAX_DISTANCE, occlusion=True):
+        """
+        Args:
+            world: carla world
+            objects ([str]): names of the sign objects
+            cameras ([RGBCamera]): camera objects of the test
+            max_distance (float): signs farther away in meters are not labelled
+            occlusion (bool): check the occlusion with a ray cast for every labelled box
+        """
+        self.world = world
+        self.cameras = cameras
+        self.max_distance = max_distance
+        self.occlusion = occlusion and hasattr(world, 'cast_ray')
+        self.signs, self.corners = find_signs(world, objects)
+        self.centers = self.corners.mean(axis=1)
+        self.intrinsics, self.heights = intrinsics(cameras)
+        # camera to vehicle matrices
+        self.mounts = transform_matrices([pose(cam.transform) for cam in cameras])
+        self.columns = {'tick': [], 'camera': [], 'sign': [], 'box': [], 'distance': [], 'truncation': [],
+                        'occluded': []}
+
+    def record(self, tick, vehicle_transform):
+        """labels the signs of a tick from the transform of the vehicle after the world tick"""
+        if not len(self.signs):
+            return
+        matrices = transform_matrices(pose(vehicle_transform))[0] @ self.mounts
+        camera, sign, boxes, distance, truncation = project_boxes(self.corners, matrices, self.intrinsics,
+                                                                  self.heights, self.max_distance)
+        occluded = np.full(len(camera), OCCLUDED_UNKNOWN, dtype=np.int8)
+        if self.occlusion:
+            for i, (c, s) in enumerate(zip(camera, sign)):
+                start = carla.Location(*(float(value) for value in matrices[c, :3, 3]))
+                end = carla.Location(*(float(value) for value in self.centers[s]))
+                occluded[i] = OCCLUDED_YES if is_occluded(self.world, start, end, distance[i]) else OCCLUDED_NO
+        self.columns['tick'].append(np.full(len(camera), tick, dtype=np.int32))
+        self.columns['camera'].append(camera.astype(np.int16))
+        self.columns['sign'].append(sign.astype(np.int16))
+        self.columns['box'].append(boxes.astype(np.float32))
+        self.columns['distance'].append(distance.astype(np.float32))
+        self.columns['truncation'].append(truncation.astype(np.float32))
+        self.columns['occluded'].append(occluded)
+
+    def save(self, folder):
+        """stores the boxes as ground_truth.npz in the cycle folder"""
+        empty = {'tick': np.int32, 'camera': np.int16, 'sign': np.int16, 'box': np.float32, 'distance': np.float32,
+                 'truncation': np.float32, 'occluded': np.int8}
+        columns = {name: np.concatenate(values) if values else np.zeros((0, 4) if name == 'box' else 0, empty[name])
+                   for name, values in self.columns.items()}
+        path = os.path.join(folder, GROUND_TRUTH_FILE)
+        np.savez_compressed(path + '.tmp.npz', signs=np.array(self.signs, dtype=str),
+                            cameras=np.array([cam.cam_name.rstrip('_') for cam in self.cameras], dtype=str),
+                            folders=np.array(['|'.join(cam.folder_names()) for cam in self.cameras], dtype=str),
+                            resolution=np.array([[cam.x_cam, cam.y_cam] for cam in self.cameras], dtype=np.int32),
+                            fov=np.array([cam.fov for cam in self.cameras], dtype=np.float32),
+                            corners=self.corners.astype(np.float32), **columns)
+        os.replace(path + '.tmp.npz', path)
+        return path
+
+
+def load_boxes(cycle_folder):
+    """ loads the boxes of a cycle
+
+    Returns:
+        boxes (dict): columns tick, camera, sign, box, distance, truncation and occluded, and the names of signs and
+            cameras the indices refer to. None if the cycle has no ground truth
+    """
+    path = os.path.join(cycle_folder, GROUND_TRUTH_FILE)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        boxes = {name: data[name] for name in data.files}
+    boxes['folders'] = [folders.split('|') for folders in boxes['folders']]
+    return boxes
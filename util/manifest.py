@@ -0,0 +1,130 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Run manifest that records the completed test cycles of a result folder, so an interrupted test can be resumed.
+Several test processes can share one result folder and manifest.
+"""
+
+import hashlib
+import json
+import os
+from time import strftime, localtime, sleep, monotonic
+
+MANIFEST_FILE = 'manifest.json'
+# maximum time in seconds to wait for another process that is writing the manifest
+LOCK_TIMEOUT = 30.0
+
+
+def settings_hash(settings):
+    """returns a short hash of a json serializable settings dictionary"""
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+class ManifestLock:
+    """simple lock file, so only one process at a time changes the manifest"""
+
+    def __init__(self, path):
+        self.path = path + '.lock'
+
+    def __enter__(self):
+        deadline = monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                if monotonic() > deadline:
+                    # lock file of a crashed process
+                    os.remove(self.path)
+                else:
+                    sleep(0.05)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class RunManifest:
+    """manifest.json in the result folder. For every cycle and settings hash it stores the texture and the recorded
+    ticks of all camera folders. A cycle only counts as completed if it was recorded with the same settings as the
+    current test, so different camera groups can share a cycle folder."""
+
+    def __init__(self, result_folder, settings):
+        """
+        Args:
+            result_folder (str): folder of the test
+            settings (dict): settings of the test that influence the results
+        """
+        self.path = os.path.join(result_folder, MANIFEST_FILE)
+        self.data = {'settings': {}, 'cycles': {}}
+        self.set_settings(settings)
+
+    def set_settings(self, settings):
+        """changes the settings of the following cycles, e.g. after the weather was changed"""
+        self.settings = settings
+        self.settings_hash = settings_hash(settings)
+        self.update(lambda data: data['settings'].__setitem__(self.settings_hash, settings))
+
+    def read(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            data.setdefault('settings', {})
+            data.setdefault('cycles', {})
+            return data
+        return {'settings': {}, 'cycles': {}}
+
+    def update(self, change):
+        """reads the current manifest, applies a change and writes it back while holding the lock. A temporary file is
+        used, so an interruption never leaves a broken manifest
+
+        Args:
+            change (callable): function that changes the manifest data in place
+        """
+        with ManifestLock(self.path):
+            data = self.read()
+            change(data)
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=1, default=str)
+            os.replace(tmp_path, self.path)
+        self.data = data
+
+    def entry(self, cycle):
+        """returns the entry of a cycle recorded with the current settings"""
+        return self.data['cycles'].get(cycle, {}).get(self.settings_hash)
+
+    def is_complete(self, cycle):
+        """checks if a cycle was completed with the current settings"""
+        self.data = self.read()
+        return self._complete(cycle)
+
+    def _complete(self, cycle):
+        entry = self.entry(cycle)
+        return bool(entry) and entry.get('status') == 'complete'
+
+    def start_cycle(self, cycle, texture=None):
+        """marks a cycle as started"""
+        entry = {'texture': texture, 'status': 'started', 'started': strftime('%Y-%m-%d %H:%M:%S', localtime())}
+        self.update(lambda data: data['cycles'].setdefault(cycle, {}).__setitem__(self.settings_hash, entry))
+
+    def complete_cycle(self, cycle, cameras, ticks):
+        """marks a cycle as completed
+
+        Args:
+            cycle (str): name of the cycle
+            cameras ([str]): names of the camera folders of the cycle
+            ticks (int): number of recorded ticks of every camera
+        """
+        def change(data):
+            entry = data['cycles'].setdefault(cycle, {}).setdefault(self.settings_hash, {})
+            entry['status'] = 'complete'
+            entry['cameras'] = {camera: ticks for camera in cameras}
+            entry['completed'] = strftime('%Y-%m-%d %H:%M:%S', localtime())
+        self.update(change)
+
+    def completed_cycles(self):
+        """returns the names of all cycles completed with the current settings"""
+        self.data = self.read()
+        return [cycle for cycle in self.data['cycles'] if self._complete(cycle)]
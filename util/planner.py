@@ -0,0 +1,324 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Planner for sweeps over many camera settings. Every combination of camera test and resolution is a camera variant.
+The variants are packed into the fewest drives whose cameras can still be stored in time, because every drive costs the
+same simulated time. A plan can be run directly with run_plan or used as camera groups of the ShardScheduler.
+"""
+
+from argparse import ArgumentParser
+from functools import partial
+import json
+import logging
+import os
+import re
+
+from util.camera_utils import RGBCamera, camera_tests
+from util.test_class import CarlaTestRun
+
+# images per second a single writer thread stores at the reference resolution (png output). Used for variants without
+# measured throughput and scaled with the number of pixels
+REFERENCE_THROUGHPUT = 12.0
+REFERENCE_PIXELS = 1360 * 800
+# size of a png image per pixel, used for variants without measured image size
+PNG_BYTES_PER_PIXEL = 1.6
+# share of the writer threads and the disk bandwidth that may be used. The rest is headroom for fluctuations
+UTILIZATION = 0.8
+
+
+def variant_name(test, resolution):
+    """returns the name of a camera variant, which is also the name of its camera folder, e.g. 1360x800_30_iso_400"""
+    return f'{resolution[0]}x{resolution[1]}_{test}'
+
+
+def rate_key(camera_folder):
+    """ returns the key of a camera folder in the measured rates: the variant name if the folder name starts with a
+    resolution like the cameras of a plan (1360x800_30_iso_400), otherwise the camera test (front_30_iso_400 gives
+    30_iso_400). None for folders without a known camera test, e.g. derived effects
+    """
+    test = next((t for t in sorted(camera_tests, key=len, reverse=True)
+                 if camera_folder == t or camera_folder.endswith('_' + t)), None)
+    if test is None:
+        return None
+    resolution = re.match(r'^(\d+)x(\d+)_', camera_folder)
+    if resolution:
+        return variant_name(test, (int(resolution.group(1)), int(resolution.group(2))))
+    return test
+
+
+def measured_rates(profile_file):
+    """ reads the measured throughput and image sizes per camera folder from a profile written by CarlaTestRun with
+    profile=True
+
+    Returns:
+        throughput (dict): images per second of a single writer thread by variant name or camera test (see rate_key)
+        image_bytes (dict): average size of an image in bytes by variant name or camera test
+        pixels (dict): number of pixels of the measured images by variant name or camera test. Rates by camera test
+            are only valid at this resolution
+    """
+    with open(profile_file) as f:
+        summary = json.load(f)['summary']
+    throughput = {}
+    image_bytes = {}
+    pixels = {}
+    for row in summary:
+        kind, _, camera = row['metric'].partition('/')
+        key = rate_key(camera)
+        if key is None:
+            continue
+        if kind == 'write' and row['mean'] > 0:
+            throughput[key] = 1.0 / row['mean']
+        elif kind == 'bytes':
+            image_bytes[key] = row['mean']
+        elif kind == 'pixels':
+            pixels[key] = row['mean']
+    return throughput, image_bytes, pixels
+
+
+def lookup_rate(rates, test, resolution, measured_pixels, exponent):
+    """ returns the measured rate of a camera variant or None. Rates by variant name or resolution are used as they
+    are, rates by camera test are scaled from the measured number of pixels to the resolution of the variant and
+    ignored if that number is unknown
+
+    Args:
+        rates (dict): measured rates by variant name, camera test or resolution
+        test (str): camera test of the variant
+        resolution ((int, int)): resolution of the variant
+        measured_pixels (dict): number of pixels of the images the rates by camera test were measured with
+        exponent (int): scaling with the number of pixels, -1 for the throughput and 1 for the image size
+    """
+    name = variant_name(test, resolution)
+    if name in rates:
+        return rates[name]
+    if test in rates and measured_pixels.get(test):
+        return rates[test] * (resolution[0] * resolution[1] / measured_pixels[test]) ** exponent
+    return rates.get(resolution)
+
+
+class CameraVariant:
+    """a single camera test at a resolution with its cost per recorded tick"""
+
+    def __init__(self, test, resolution, sensor_tick, tick_length, tick_rate, throughput=None, image_bytes=None):
+        """
+        Args:
+            test (str): camera test (see camera_utils.camera_tests)
+            resolution ((int, int)): x and y resolution
+            sensor_tick (float): time between images. 0.0 means an image every world tick
+            tick_length (float): length of a world tick in seconds
+            tick_rate (float): world ticks per second of real time the server renders
+            throughput (float): measured images per second of a single writer thread. Default: estimate
+            image_bytes (float): measured size of an image in bytes. Default: estimate
+        """
+        self.test = test
+        self.resolution = tuple(resolution)
+        self.name = variant_name(test, resolution)
+        pixels = resolution[0] * resolution[1]
+        # images per world tick
+        self.frames = min(1.0, tick_length / sensor_tick) if sensor_tick > 0 else 1.0
+        self.throughput = throughput or REFERENCE_THROUGHPUT * REFERENCE_PIXELS / pixels
+        self.image_bytes = image_bytes or pixels * PNG_BYTES_PER_PIXEL
+        # busy writer threads and disk bandwidth in bytes per second while the drive runs at the tick rate
+        self.writer_load = tick_rate * self.frames / self.throughput
+        self.disk_load = tick_rate * self.frames * self.image_bytes
+
+    def to_dict(self):
+        return {'test': self.test, 'resolution': list(self.resolution), 'frames_per_tick': self.frames,
+                'writer_load': self.writer_load, 'disk_load': self.disk_load}
+
+
+class Drive:
+    """group of camera variants recorded in one drive"""
+
+    def __init__(self):
+        self.variants = []
+        self.frames = 0.0
+        self.writer_load = 0.0
+        self.disk_load = 0.0
+
+    def fits(self, variant, frame_budget, writer_budget, disk_budget):
+        return (self.frames + variant.frames <= frame_budget and
+                self.writer_load + variant.writer_load <= writer_budget and
+                self.disk_load + variant.disk_load <= disk_budget)
+
+    def add(self, variant):
+        self.variants.append(variant)
+        self.frames += variant.frames
+        self.writer_load += variant.writer_load
+        self.disk_load += variant.disk_load
+
+    def camera_specs(self):
+        """returns the variants as arguments of RGBCamera: one camera object per resolution with all its tests"""
+        specs = {}
+        for variant in self.variants:
+            specs.setdefault(variant.resolution, []).append(variant.test)
+        return [{'cam_name': f'{x}x{y}', 'x_cam': x, 'y_cam': y, 'test_list': tests}
+                for (x, y), tests in specs.items()]
+
+
+def make_cameras(specs, **camera_args):
+    """creates the RGBCamera objects of a drive. Module level function, so it can be sent to worker processes
+
+    Args:
+        specs ([dict]): camera specs of a drive (see Drive.camera_specs)
+        camera_args: further arguments of RGBCamera, e.g. fov, tick or output
+    """
+    return [RGBCamera(**spec, **camera_args) for spec in specs]
+
+
+class SweepPlan:
+    """drives of a sweep and the cameras of every drive"""
+
+    def __init__(self, drives, camera_args=None, settings=None):
+        """
+        Args:
+            drives ([[dict]]): camera specs of every drive (see Drive.camera_specs)
+            camera_args (dict): arguments of RGBCamera shared by all cameras, e.g. fov, tick or output
+            settings (dict): parameters the plan was created with
+        """
+        self.drives = drives
+        self.camera_args = camera_args or {}
+        self.settings = settings or {}
+
+    def __len__(self):
+        return len(self.drives)
+
+    def cameras(self, drive):
+        """returns new RGBCamera objects for a drive"""
+        return make_cameras(self.drives[drive], **self.camera_args)
+
+    def camera_groups(self):
+        """returns one picklable camera factory per drive, e.g. for the camera_groups of the ShardScheduler"""
+        return [partial(make_cameras, specs, **self.camera_args) for specs in self.drives]
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'drives': self.drives, 'camera_args': self.camera_args, 'settings': self.settings}, f,
+                      indent=1)
+        return path
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            data = json.load(f)
+        return SweepPlan(data['drives'], data.get('camera_args'), data.get('settings'))
+
+
+def plan_sweep(tests, resolutions, sensor_tick=0.0, tick_length=0.05, tick_rate=10.0, writer_workers=4,
+               frame_budget=8, disk_budget=200 * 2 ** 20, throughput=None, image_bytes=None, camera_args=None,
+               measured_pixels=None):
+    """ packs all combinations of camera tests and resolutions into the fewest drives that stay within the budget.
+    Variants are sorted by their largest share of a budget and each one is put into the first drive with enough room
+    (first fit decreasing).
+
+    Args:
+        tests ([str]): camera tests (see camera_utils.camera_tests)
+        resolutions ([(int, int)]): x and y resolutions
+        sensor_tick (float): time between images of all cameras. 0.0 means an image every world tick
+        tick_length (float): length of a world tick in seconds
+        tick_rate (float): world ticks per second of real time the server renders with a full set of cameras
+        writer_workers (int): number of writer threads of the test
+        frame_budget (float): maximum number of images per world tick the server can render in one drive. A camera
+            whose sensor_tick is twice the tick length counts as half an image
+        disk_budget (float): sustained write rate of the disk in bytes per second
+        throughput (dict): measured images per second of a single writer thread, by variant name, camera test or
+            resolution (see measured_rates)
+        image_bytes (dict): measured image sizes in bytes, by variant name, camera test or resolution
+        camera_args (dict): further arguments of RGBCamera shared by all cameras, e.g. fov or output
+        measured_pixels (dict): number of pixels of the measured images by camera test (see measured_rates). Rates
+            by camera test are scaled to the planned resolution and ignored without this number
+
+    Returns:
+        plan (SweepPlan): cameras of every drive
+    """
+    throughput = throughput or {}
+    image_bytes = image_bytes or {}
+    measured_pixels = measured_pixels or {}
+    writer_budget = writer_workers * UTILIZATION
+    disk_budget = disk_budget * UTILIZATION
+    variants = []
+    matched = 0
+    for resolution in resolutions:
+        resolution = tuple(resolution)
+        for test in tests:
+            measured = lookup_rate(throughput, test, resolution, measured_pixels, -1)
+            size = lookup_rate(image_bytes, test, resolution, measured_pixels, 1)
+            matched += measured is not None or size is not None
+            variants.append(CameraVariant(test, resolution, sensor_tick, tick_length, tick_rate, measured, size))
+    if (throughput or image_bytes) and not matched:
+        logging.getLogger('logger').warning(f'No measured rate matches the planned cameras, using estimates. Measured: '
+                                            f'{sorted(set(throughput) | set(image_bytes), key=str)}')
+
+    def share(variant):
+        return max(variant.frames / frame_budget, variant.writer_load / writer_budget, variant.disk_load / disk_budget)
+
+    drives = []
+    for variant in sorted(variants, key=share, reverse=True):
+        if share(variant) > 1.0:
+            raise ValueError(f'Camera {variant.name} alone exceeds the budget: {variant.to_dict()}')
+        drive = next((d for d in drives if d.fits(variant, frame_budget, writer_budget, disk_budget)), None)
+        if drive is None:
+            drive = Drive()
+            drives.append(drive)
+        drive.add(variant)
+
+    camera_args = dict(camera_args or {})
+    camera_args['tick'] = sensor_tick
+    settings = {'tests': list(tests), 'resolutions': [list(r) for r in resolutions], 'tick_length': tick_length,
+                'tick_rate': tick_rate, 'writer_workers': writer_workers, 'frame_budget': frame_budget,
+                'disk_budget': disk_budget / UTILIZATION,
+                'load': [{'writer': d.writer_load, 'disk': d.disk_load, 'frames': d.frames} for d in drives]}
+    return SweepPlan([d.camera_specs() for d in drives], camera_args, settings)
+
+
+def simulated_time(plan, cycles, ticks, ticks_prep=50, tick_length=0.05):
+    """returns the simulated time in seconds for running every cycle with every drive of a plan"""
+    return len(plan) * cycles * (ticks + ticks_prep) * tick_length
+
+
+def run_plan(plan, textures, objects, result_folder, **test_args):
+    """ runs all drives of a plan one after the other. All drives share the result folder and its manifest, so an
+    interrupted sweep can be continued by running the plan again
+
+    Args:
+        plan (SweepPlan): cameras of every drive
+        textures ([[str, str]]): list of cycle names and texture files
+        objects ([str]): names of the objects that will get the textures
+        result_folder (str): common result folder of all drives
+        test_args: further arguments of CarlaTestRun, e.g. name, spawn_point, ticks or town
+    """
+    os.makedirs(result_folder, exist_ok=True)
+    plan.save(os.path.join(result_folder, 'plan.json'))
+    for drive in range(0, len(plan)):
+        test = CarlaTestRun(plan.cameras(drive), resume_folder=result_folder, log_name=f'log_drive{drive}',
+                            **test_args)
+        try:
+            test.run_texture(textures, objects)
+        finally:
+            test.end()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-tests', type=str, nargs='+', help='Camera tests. Default all', default=camera_tests)
+    parser.add_argument('-resolutions', type=str, nargs='+', help='Resolutions like 1360x800', default=['1360x800'])
+    parser.add_argument('-sensor_tick', type=float, help='Time between images of the cameras', default=0.0)
+    parser.add_argument('-tick_rate', type=float, help='World ticks per second the server renders', default=10.0)
+    parser.add_argument('-workers', type=int, help='Number of writer threads', default=4)
+    parser.add_argument('-frames', type=float, help='Maximum number of images per world tick in a drive', default=8)
+    parser.add_argument('-disk', type=float, help='Write rate of the disk in MiB/s', default=200.0)
+    parser.add_argument('-profile', type=str, help='Profile of an earlier test with measured throughput')
+    parser.add_argument('-output', type=str, help='JSON file for the plan')
+    args = parser.parse_args()
+
+    rates = measured_rates(args.profile) if args.profile else ({}, {}, {})
+    sweep = plan_sweep(args.tests, [tuple(int(v) for v in r.split('x')) for r in args.resolutions],
+                       args.sensor_tick, tick_rate=args.tick_rate, writer_workers=args.workers,
+                       frame_budget=args.frames, disk_budget=args.disk * 2 ** 20, throughput=rates[0],
+                       image_bytes=rates[1], measured_pixels=rates[2])
+    for i, specs in enumerate(sweep.drives):
+        load = sweep.settings['load'][i]
+        print(f'Drive {i}: {load["frames"]:.1f} images/tick, {load["writer"]:.2f} writers, '
+              f'{load["disk"] / 2 ** 20:.1f} MiB/s')
+        for spec in specs:
+            print(f'    {spec["cam_name"]}: {spec["test_list"]}')
+    if args.output:
+        sweep.save(args.output)
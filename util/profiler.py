@@ -0,0 +1,125 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Lightweight instrumentation of a test run. Collects durations, sizes and queue depths of the single phases and writes
+them as JSON and CSV next to the logfile. When profiling is disabled, a NullProfiler with empty methods is used.
+"""
+
+import csv
+import json
+import os
+import threading
+from time import perf_counter
+
+
+class _Timer:
+    """context manager that adds the duration of its block to a metric"""
+    __slots__ = ('profiler', 'metric', 'start')
+
+    def __init__(self, profiler, metric):
+        self.profiler = profiler
+        self.metric = metric
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler.add(self.metric, perf_counter() - self.start)
+
+
+class Profiler:
+    """collects samples of named metrics, e.g. 'tick' (seconds), 'write/01_default_new' (seconds) or
+    'bytes/01_default_new' (bytes)"""
+    enabled = True
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, metric, value):
+        """adds a sample to a metric"""
+        with self._lock:
+            self.samples.setdefault(metric, []).append(value)
+
+    def timer(self, metric):
+        """returns a context manager that measures the duration of its block in seconds"""
+        return _Timer(self, metric)
+
+    def summary(self):
+        """returns count, total, mean, median, 95th percentile and maximum of every metric"""
+        rows = []
+        with self._lock:
+            items = sorted((metric, sorted(values)) for metric, values in self.samples.items())
+        for metric, values in items:
+            n = len(values)
+            total = sum(values)
+            rows.append({'metric': metric, 'count': n, 'total': total, 'mean': total / n,
+                         'p50': values[n // 2], 'p95': values[min(n - 1, int(n * 0.95))], 'max': values[-1]})
+        return rows
+
+    def write(self, folder, name='profile'):
+        """writes the summary as name.csv and the summary plus all samples as name.json into a folder
+
+        Returns:
+            paths ((str, str)): paths of the JSON and the CSV file
+        """
+        rows = self.summary()
+        json_path = os.path.join(folder, name + '.json')
+        with self._lock:
+            samples = {metric: list(values) for metric, values in self.samples.items()}
+        with open(json_path, 'w') as f:
+            json.dump({'summary': rows, 'samples': samples}, f)
+        csv_path = os.path.join(folder, name + '.csv')
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['metric', 'count', 'total', 'mean', 'p50', 'p95', 'max'])
+            writer.writeheader()
+            writer.writerows(rows)
+        return json_path, csv_path
+
+    def log_summary(self, logger):
+        """logs the summary as table"""
+        logger.info(f'{"metric":40} {"count":>7} {"total":>10} {"mean":>10} {"p95":>10} {"max":>10}')
+        for row in self.summary():
+            logger.info(f'{row["metric"]:40} {row["count"]:7d} {row["total"]:10.3f} {row["mean"]:10.4f} '
+                        f'{row["p95"]:10.4f} {row["max"]:10.4f}')
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullProfiler:
+    """profiler that records nothing. Used when profiling is disabled"""
+    enabled = False
+
+    def add(self, metric, value):
+        pass
+
+    def timer(self, metric):
+        return _NULL_TIMER
+
+    def summary(self):
+        return []
+
+    def write(self, folder, name='profile'):
+        return None
+
+    def log_summary(self, logger):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+def make_profiler(enabled):
+    """returns a Profiler if profiling is enabled, otherwise a NullProfiler"""
+    return Profiler() if enabled else NULL_PROFILER
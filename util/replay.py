@@ -0,0 +1,258 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Offline replay of a finished test. Reads the camera folders of a result folder (png, jpg or webp images, npy files or
+raw arrays) and yields the frames together with cycle, texture, camera and tick, so post-processing can be repeated
+without running the simulation again. The frames are decoded ahead in a pool of threads.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+
+from cv2 import imread, imwrite, IMREAD_COLOR
+import numpy as np
+
+from util.frame_sinks import load_raw, make_sink, OUTPUT_PNG, RAW_FRAMES_FILE
+from util.frame_writer import FrameWriter
+from util.manifest import MANIFEST_FILE
+from util.weather_data import load_weather
+
+# number of threads decoding frames
+READ_WORKERS = 4
+# maximum number of decoded frames waiting to be consumed
+PREFETCH = 16
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.webp', '.npy')
+
+# frame orders of the replay
+ORDER_TICK = 'tick'  # like a live capture: all cameras of a tick before the next tick
+ORDER_CAMERA = 'camera'  # all ticks of a camera folder before the next folder
+
+
+class Frame:
+    """decoded frame of a finished test. Offers width, height, frame, raw_data and save_to_disk like a carla image, so
+    it can be handed to the sinks of a live test"""
+
+    def __init__(self, image, cycle, texture, camera, tick, folder, frame=None, weather=None):
+        """
+        Args:
+            image (ndarray): (height, width, 3) BGR image
+            cycle (str): name of the test cycle
+            texture (str): texture file of the cycle according to the manifest, None if unknown
+            camera (str): name of the camera folder
+            tick (int): tick number of the frame
+            folder (str): camera folder
+            frame (int): world frame of the image if it was recorded, otherwise the tick
+            weather (dict): weather parameters of the tick if the cycle had a weather schedule
+        """
+        self.image = image
+        self.cycle = cycle
+        self.texture = texture
+        self.camera = camera
+        self.tick = tick
+        self.folder = folder
+        self.frame = tick if frame is None else frame
+        self.weather = weather
+
+    @property
+    def width(self):
+        return self.image.shape[1]
+
+    @property
+    def height(self):
+        return self.image.shape[0]
+
+    @property
+    def raw_data(self):
+        """BGRA bytes like carla.Image.raw_data"""
+        bgra = np.empty((self.height, self.width, 4), dtype=np.uint8)
+        bgra[:, :, :3] = self.image
+        bgra[:, :, 3] = 255
+        return bgra.tobytes()
+
+    def save_to_disk(self, path):
+        imwrite(path, self.image)
+
+    def meta(self):
+        """returns the description of the frame without the image"""
+        return {'cycle': self.cycle, 'texture': self.texture, 'camera': self.camera, 'tick': self.tick,
+                'frame': self.frame, 'weather': self.weather}
+
+
+def read_textures(result_folder):
+    """returns the texture of every cycle recorded in the manifest of a result folder"""
+    path = os.path.join(result_folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        cycles = json.load(f).get('cycles', {})
+    textures = {}
+    for cycle, entries in cycles.items():
+        for entry in entries.values():
+            if entry.get('texture'):
+                textures[cycle] = entry['texture']
+                break
+    return textures
+
+
+def find_cameras(result_folder, cycles=None, cameras=None):
+    """ lists all camera folders of a test in the layout result_folder/cycle/camera
+
+    Args:
+        result_folder (str): folder of the test
+        cycles ([str]): only these cycles. Default all
+        cameras ([str]): only these camera folder names. Default all
+
+    Returns:
+        folders ([dict]): cycle, texture, camera, folder, the ticks with their files or raw indices and the weather
+            of every tick
+    """
+    textures = read_textures(result_folder)
+    folders = []
+    for cycle in sorted(os.listdir(result_folder)):
+        cycle_folder = os.path.join(result_folder, cycle)
+        if not os.path.isdir(cycle_folder) or (cycles is not None and cycle not in cycles):
+            continue
+        weather = load_weather(cycle_folder)
+        for camera in sorted(os.listdir(cycle_folder)):
+            folder = os.path.join(cycle_folder, camera)
+            if not os.path.isdir(folder) or (cameras is not None and camera not in cameras):
+                continue
+            ticks = list_ticks(folder)
+            if ticks:
+                folders.append({'cycle': cycle, 'texture': textures.get(cycle), 'camera': camera, 'folder': folder,
+                                'ticks': ticks, 'weather': weather})
+    return folders
+
+
+def list_ticks(folder):
+    """ returns the recorded ticks of a camera folder in tick order
+
+    Returns:
+        ticks ([(int, str)]): tick number and image file. The file is None for frames in a raw array
+    """
+    if os.path.exists(os.path.join(folder, RAW_FRAMES_FILE)):
+        frames, meta = load_raw(folder)
+        return [(tick, None) for tick in meta['written']]
+    ticks = []
+    for file in os.listdir(folder):
+        stem, ext = os.path.splitext(file)
+        if stem.isdigit() and ext.lower() in IMAGE_EXTENSIONS:
+            ticks.append((int(stem), os.path.join(folder, file)))
+    return sorted(ticks)
+
+
+def decode_file(file):
+    """decodes an image or npy file into a BGR array"""
+    if file.endswith('.npy'):
+        return np.load(file)
+    return imread(file, IMREAD_COLOR)
+
+
+class ReplaySource:
+    """Iterable over the frames of a finished test.
+
+    Example:
+        for frame in ReplaySource('D:/Results/20240101_1200_T7_all', cameras=['01_default_new']):
+            process(frame.image, frame.meta())
+    """
+
+    def __init__(self, result_folder, cycles=None, cameras=None, order=ORDER_TICK, workers=READ_WORKERS,
+                 prefetch=PREFETCH):
+        """
+        Args:
+            result_folder (str): folder of the test
+            cycles ([str]): only these cycles. Default all
+            cameras ([str]): only these camera folder names. Default all
+            order (str): ORDER_TICK yields all cameras of a tick like a live capture, ORDER_CAMERA yields one camera
+                folder after the other
+            workers (int): number of decoding threads
+            prefetch (int): maximum number of frames that are decoded ahead
+        """
+        self.result_folder = result_folder
+        self.order = order
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self.folders = find_cameras(result_folder, cycles, cameras)
+        self._raw = {}
+
+    def __len__(self):
+        return sum(len(folder['ticks']) for folder in self.folders)
+
+    def items(self):
+        """returns (camera folder, tick, file) of all frames in replay order"""
+        items = []
+        if self.order == ORDER_CAMERA:
+            for folder in self.folders:
+                items.extend((folder, tick, file) for tick, file in folder['ticks'])
+            return items
+        for cycle in sorted({folder['cycle'] for folder in self.folders}):
+            cycle_items = [(folder, tick, file) for folder in self.folders if folder['cycle'] == cycle
+                           for tick, file in folder['ticks']]
+            # stable sort keeps the camera order within a tick
+            items.extend(sorted(cycle_items, key=lambda item: item[1]))
+        return items
+
+    def raw_frames(self, folder):
+        """returns the memory mapped frames of a raw camera folder and the world frame of every tick. Each folder is
+        only opened once"""
+        if folder not in self._raw:
+            frames, meta = load_raw(folder)
+            self._raw[folder] = frames, dict(zip(meta['written'], meta.get('frames', [])))
+        return self._raw[folder]
+
+    def load(self, item):
+        """decodes a single frame"""
+        folder, tick, file = item
+        frame = None
+        if file is None:
+            frames, world_frames = self.raw_frames(folder['folder'])
+            image = np.array(frames[tick, :, :, :3])
+            frame = world_frames.get(tick)
+        else:
+            image = decode_file(file)
+        weather = folder['weather'][tick] if tick < len(folder['weather']) else None
+        return Frame(image, folder['cycle'], folder['texture'], folder['camera'], tick, folder['folder'], frame,
+                     weather)
+
+    def __iter__(self):
+        items = self.items()
+        # open the raw arrays before the threads start
+        for folder in {item[0]['folder'] for item in items if item[2] is None}:
+            self.raw_frames(folder)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for item in items:
+                pending.append(pool.submit(self.load, item))
+                if len(pending) >= self.prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+def export(source, target_folder, output=OUTPUT_PNG):
+    """ stores the frames of a replay in a new result folder with the same sinks and writer threads as a live test,
+    e.g. to convert the png images of a test into jpg images or videos
+
+    Args:
+        source (ReplaySource): frames of a finished test
+        target_folder (str): new result folder. Gets the same cycle and camera folders
+        output: output format of the sinks (see frame_sinks.make_sink)
+    """
+    # number of ticks of every camera folder for the preallocated raw output
+    ticks = {folder['folder']: folder['ticks'][-1][0] + 1 for folder in source.folders}
+    writer = FrameWriter()
+    sinks = {}
+    try:
+        for frame in source:
+            key = (frame.cycle, frame.camera)
+            if key not in sinks:
+                folder = os.path.join(target_folder, frame.cycle, frame.camera)
+                os.makedirs(folder, exist_ok=True)
+                sinks[key] = make_sink(output, folder, ticks[frame.folder], frame.width, frame.height,
+                                       {'camera': frame.camera})
+            writer.submit(sinks[key], frame, frame.tick)
+    finally:
+        writer.close()
+        for sink in sinks.values():
+            sink.close()
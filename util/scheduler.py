@@ -0,0 +1,232 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Scheduler that spreads the independent cycles of a test over several carla servers. Every server gets its own worker
+process that takes the next shard as soon as it is free, so faster servers automatically run more shards. All shards
+write into the same result folder.
+Attention! On Windows, scripts using the scheduler need an if __name__ == '__main__': guard.
+"""
+
+import glob
+import logging
+import multiprocessing
+import os
+from queue import Empty
+from time import strftime, localtime, perf_counter
+
+from util.test_class import CarlaTestRun
+
+# number of additional attempts of a failed shard
+SHARD_RETRIES = 2
+# number of failed shards in a row after which a server is no longer used
+MAX_ENDPOINT_FAILURES = 3
+
+
+def parse_endpoint(endpoint):
+    """converts 'host:port' or 'host:port:tm_port' into a (host, port, tm_port) tuple. The traffic manager port
+    defaults to port + 6000, like 2000 and 8000 for the default server"""
+    parts = endpoint.split(':')
+    host = parts[0]
+    port = int(parts[1]) if len(parts) > 1 else 2000
+    tm_port = int(parts[2]) if len(parts) > 2 else port + 6000
+    return host, port, tm_port
+
+
+def plan_shards(textures, weathers=None, camera_groups=1):
+    """ creates one shard for every combination of texture, weather and camera group
+
+    Args:
+        textures ([[str, str]]): list of cycle names and texture files
+        weathers ([str]): names of the weathers in the test configuration. None keeps the current weather
+        camera_groups (int): number of camera groups in the test configuration
+
+    Returns:
+        shards ([dict]): independent units of work
+    """
+    shards = []
+    for weather in weathers or [None]:
+        for group in range(0, camera_groups):
+            for tex in textures:
+                cycle = tex[0] if weather is None else f'{weather}_{tex[0]}'
+                shards.append({'name': f'{cycle}/group{group}', 'cycle': cycle, 'texture': tex[1],
+                               'weather': weather, 'camera_group': group})
+    return shards
+
+
+def run_shard(endpoint, shard, config):
+    """ runs a single shard on a carla server. This is the default function of the workers
+
+    Args:
+        endpoint ((str, int, int)): host, port and traffic manager port of the server
+        shard (dict): shard created by plan_shards
+        config (dict): test configuration with the keys
+            name (str): test name
+            result_folder (str): common result folder of all shards
+            objects ([str]): names of the objects that get the textures
+            camera_groups ([callable]): functions that return the list of RGBCamera objects of each group
+            weathers (dict): functions that return the WeatherParameters for each weather name
+            test_args (dict): additional arguments for CarlaTestRun, e.g. spawn_point, ticks or town
+    """
+    host, port, tm_port = endpoint
+    cameras = config['camera_groups'][shard['camera_group']]()
+    test = CarlaTestRun(cameras, name=config['name'], resume_folder=config['result_folder'], host=host, port=port,
+                        tm_port=tm_port, log_name=f'log_{host}_{port}', **config.get('test_args', {}))
+    try:
+        if shard['weather'] is not None:
+            test.set_weather(config['weathers'][shard['weather']]())
+        test.run_texture([[shard['cycle'], shard['texture']]], config['objects'])
+    finally:
+        test.end()
+
+
+def _worker(endpoint, tasks, results, run, config):
+    """worker process of a single server. Takes shards until there are no more shards or the server failed too
+    often"""
+    failures = 0
+    while True:
+        item = tasks.get()
+        if item is None:
+            break
+        shard, attempt = item
+        # lets the scheduler requeue the shard if this process dies while running it
+        results.put(('started', endpoint, shard, attempt, 0.0, None))
+        start = perf_counter()
+        try:
+            run(endpoint, shard, config)
+            failures = 0
+            results.put(('done', endpoint, shard, attempt, perf_counter() - start, None))
+        except Exception as e:
+            failures += 1
+            results.put(('failed', endpoint, shard, attempt, perf_counter() - start, repr(e)))
+            if failures >= MAX_ENDPOINT_FAILURES:
+                results.put(('endpoint_down', endpoint, None, 0, 0.0, f'{failures} failures in a row'))
+                break
+
+
+class ShardScheduler:
+    """Runs shards on a pool of carla servers with dynamic load balancing and retries"""
+
+    def __init__(self, endpoints, run=run_shard, retries=SHARD_RETRIES, logger=None):
+        """
+        Args:
+            endpoints ([str or tuple]): servers as 'host:port[:tm_port]' or (host, port, tm_port)
+            run (callable): function run(endpoint, shard, config) that runs a shard. Has to be picklable. Can be
+                replaced by a stand-in for testing without carla servers
+            retries (int): number of additional attempts of a failed shard
+            logger (Logger): Logger object for showing and recording the progress
+        """
+        self.endpoints = [parse_endpoint(e) if isinstance(e, str) else tuple(e) for e in endpoints]
+        self.run_shard = run
+        self.retries = retries
+        self.logger = logger or logging.getLogger('scheduler')
+
+    def run(self, shards, config):
+        """ runs all shards and waits until they are done
+
+        Args:
+            shards ([dict]): shards created by plan_shards
+            config (dict): test configuration (see run_shard)
+
+        Returns:
+            results ([dict]): final result of every shard
+        """
+        if not os.path.exists(config['result_folder']):
+            os.makedirs(config['result_folder'])
+        ctx = multiprocessing.get_context('spawn')
+        tasks = ctx.Queue()
+        results = ctx.Queue()
+        for shard in shards:
+            tasks.put((shard, 0))
+        workers = []
+        for endpoint in self.endpoints:
+            process = ctx.Process(target=_worker, args=(endpoint, tasks, results, self.run_shard, config),
+                                  name=f'shard_worker_{endpoint[0]}_{endpoint[1]}')
+            process.start()
+            workers.append(process)
+
+        down = set()  # endpoints that are no longer used
+        running = {}  # shard and attempt that each endpoint is working on
+        open_shards = len(shards)
+        final = {}
+        while open_shards and len(down) < len(workers):
+            # checked before waiting, so a dead process has delivered all its results when the queue is empty
+            dead = [(process, endpoint) for process, endpoint in zip(workers, self.endpoints)
+                    if not process.is_alive() and endpoint not in down]
+            try:
+                status, endpoint, shard, attempt, seconds, error = results.get(timeout=5.0)
+            except Empty:
+                for process, endpoint in dead:
+                    down.add(endpoint)
+                    server = f'{endpoint[0]}:{endpoint[1]}'
+                    self.logger.error(f'Server {server} is no longer used: worker exited with code {process.exitcode}')
+                    if endpoint in running:
+                        shard, attempt = running.pop(endpoint)
+                        if self.shard_failed(tasks, final, shard, attempt, server, 0.0, 'worker process died'):
+                            open_shards -= 1
+                continue
+            server = f'{endpoint[0]}:{endpoint[1]}'
+            if status == 'started':
+                running[endpoint] = (shard, attempt)
+                continue
+            running.pop(endpoint, None)
+            if status == 'endpoint_down':
+                down.add(endpoint)
+                self.logger.error(f'Server {server} is no longer used: {error}')
+            elif status == 'done':
+                open_shards -= 1
+                final[shard['name']] = {'shard': shard, 'status': 'done', 'server': server, 'attempts': attempt + 1,
+                                        'seconds': seconds}
+                self.logger.info(f'Shard {shard["name"]} done on {server} in {seconds:.1f} s')
+            elif self.shard_failed(tasks, final, shard, attempt, server, seconds, error):
+                open_shards -= 1
+
+        for _ in workers:
+            tasks.put(None)
+        for process in workers:
+            process.join()
+        for shard in shards:
+            if shard['name'] not in final:
+                final[shard['name']] = {'shard': shard, 'status': 'not run', 'error': 'no server available'}
+                self.logger.error(f'Shard {shard["name"]} was not run: no server available')
+        merge_logs(config['result_folder'])
+        return [final[shard['name']] for shard in shards]
+
+    def shard_failed(self, tasks, final, shard, attempt, server, seconds, error):
+        """ requeues a failed shard or gives it up after all retries
+
+        Returns:
+            given_up (bool): True if the shard is finally failed
+        """
+        if attempt < self.retries:
+            self.logger.warning(f'Shard {shard["name"]} failed on {server}: {error}. Retrying')
+            tasks.put((shard, attempt + 1))
+            return False
+        final[shard['name']] = {'shard': shard, 'status': 'failed', 'server': server, 'attempts': attempt + 1,
+                                'seconds': seconds, 'error': error}
+        self.logger.error(f'Shard {shard["name"]} failed on {server}: {error}. Giving up')
+        return True
+
+
+def merge_logs(result_folder, merged_name='log_merged.log'):
+    """merges the logfiles of all servers in a result folder into one logfile sorted by time. Lines without timestamp
+    stay with the line before"""
+    entries = []
+    for logfile in sorted(glob.glob(os.path.join(result_folder, 'log*.log'))):
+        if os.path.basename(logfile) == merged_name:
+            continue
+        source = os.path.splitext(os.path.basename(logfile))[0]
+        with open(logfile) as f:
+            for line in f:
+                if line[:4].isdigit() or not entries:
+                    entries.append((line[:23], source, line.rstrip('\n')))
+                else:
+                    timestamp, src, text = entries[-1]
+                    entries[-1] = (timestamp, src, text + '\n' + line.rstrip('\n'))
+    entries.sort(key=lambda entry: entry[0])
+    with open(os.path.join(result_folder, merged_name), 'w') as f:
+        for timestamp, source, text in entries:
+            f.write(f'[{source}] {text}\n')
+
+
+def campaign_folder(folder, name):
+    """returns a new timestamped result folder like CarlaTestRun.init_result_folder"""
+    return os.path.join(folder, strftime('%Y%m%d_%H%M', localtime()) + '_' + name)
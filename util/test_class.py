@@ -8,8 +8,18 @@ import os
 import sys
 import carla
 import logging
-from time import strftime, localtime, sleep
-from util.update_texture import update_texture
+from time import strftime, localtime, sleep, monotonic
+from util.encoders import shutdown_pool
+from util.frame_sync import TickBarrier, CAPTURE_TIMEOUT
+from util.frame_writer import FrameWriter, WRITER_WORKERS, WRITER_QUEUE_SIZE
+from util.ground_truth import BoxRecorder
+from util.manifest import RunManifest
+from util.profiler import make_profiler
+from util.texture_store import default_store
+from util.trajectory import Trajectory, TRAJECTORY_FILE
+from util.update_texture import update_textures, ROUND_TRAFFIC_SIGNS_TOWN7, TEXTURE_WORKERS, TEXTURE_RETRIES
+from util.weather import WeatherSchedule
+from util.weather_data import weather_to_dict, WeatherRecorder
 
 try:
     sys.path.append(glob.glob('../carla/dist/carla-*%d.%d-%s.egg' % (
@@ -19,41 +29,58 @@ try:
 except IndexError:
     pass
 
-current_tick = 0
+# speed of the vehicle set in the traffic manager in km/h
+DESIRED_SPEED = 36.0
+# fraction of the desired speed the vehicle has to reach before a fast preparation ends
+PREP_SPEED_FRACTION = 0.95
 
 
 # logger = logging.getLogger(__name__)
 
 
-def cam_lambda(image, img_path, t, logger):
-    """in order to avoid that all cameras try to save their pictures at once.
-    Needs to be in test definition for global variable.Is used by camera lambda
+def cam_lambda(image, sink, writer, barrier=None, frame0=None, ticks=None):
+    """hands the image over to the writer threads, so the sensor thread is not blocked by the disk.
+    The tick number is always derived from image.frame: in synchronous mode world.tick() returns before the images
+    arrive, so a late image would otherwise be stored under the number of the next tick.
 
     Args:
         image (Image): image that was created by a camera
-        img_path (str): path to store the resulting image
-        t: (float) sleep time in seconds
-        logger (Logger): Logger object for showing and recording the progress
+        sink: sink that stores the images of the camera folder (see frame_sinks)
+        writer (FrameWriter): writer threads that store the image on the hard disk
+        barrier (TickBarrier): if set, the barrier converts the frame and counts the image for its tick
+        frame0 (int): world frame of the first recorded tick. Used without barrier
+        ticks (int): number of recorded ticks. Images after the last tick are dropped
         """
 
-    global current_tick
-    img_name = f'{img_path}/{current_tick:04d}.png'
-    # sleep time to give the background processes enough time to store the image of the other images of the same tick
-    # on the hard disk
-    sleep(t)
-    image.save_to_disk(img_name)
-    logger.info(f'Saved {img_name}')
+    if barrier:
+        tick = barrier.arrive(sink.folder, image.frame)
+    elif frame0 is None or image.frame < frame0:
+        tick = None
+    else:
+        tick = image.frame - frame0
+    if tick is None or (ticks is not None and tick >= ticks):
+        # image was rendered before the recording started or after it ended
+        return
+    writer.submit(sink, image, tick)
 
 
-def carla_init(tick, logger, town=None):
+def carla_init(tick, logger, town=None, host='127.0.0.1', port=2000, tm_port=8000):
     """for connecting to a client and initiating the map
 
     Args:
         tick (float): tick time of the world in seconds
         logger (Logger): Logger object for showing and recording the progress
         town (str): Name of the test town to make sure the correct map is loaded before starting the test
+        host (str): IP address or host name of the carla server
+        port (int): RPC port of the carla server
+        tm_port (int): port of the traffic manager
+
+    Returns:
+        world (World): The currently loaded map in synchronous mode
+        tm (TrafficManager): traffic manager in synchronous mode
+        client (Client): connection to the server, e.g. for batches of commands
     """
-    client = carla.Client('127.0.0.1', 2000)
+    client = carla.Client(host, port)
     # long timeout of 15 seconds is needed for loading a different world. (Might be even longer for slower computers)
     client.set_timeout(15.0)
     if town:
@@ -71,17 +98,21 @@ def carla_init(tick, logger, town=None):
     settings.fixed_delta_seconds = tick
     world.apply_settings(settings)
     # connect to the traffic manager
-    tm = client.get_trafficmanager(8000)
+    tm = client.get_trafficmanager(tm_port)
     tm.set_synchronous_mode(True)
 
-    return world, tm
+    return world, tm, client
 
 
 class CarlaTestRun:
     """This is the main class for performing a test with carla. The result is folder with subfolders full of images"""
 
     def __init__(self, cameras, name='generic_test', folder='D:/Results/', spawn_point=79, ticks_prep=50, ticks=200,
-                 tick_length=0.05, town=None):
+                 tick_length=0.05, town=None, writer_workers=WRITER_WORKERS, writer_queue_size=WRITER_QUEUE_SIZE,
+                 settle_time=1.0, sync_capture=False, capture_timeout=CAPTURE_TIMEOUT, resume_folder=None,
+                 cycle_retries=3, reconnect_timeout=600.0, host='127.0.0.1', port=2000, tm_port=8000, log_name=None,
+                 persistent_rig=False, replay=False, trajectory=None, fast_prep=False, prep_tick_length=None,
+                 profile=False, weather_schedule=None, ground_truth=False):
         """ Initiates and configures a Testrun
 
         Args:
@@ -93,6 +124,35 @@ class CarlaTestRun:
             ticks (int): Amount of world ticks when the recording is happening
             tick_length (float): Length of a world tick in seconds
             town (str): Name of the test town to make sure the correct map is loaded before starting the test
+            writer_workers (int): Number of threads that store the images
+            writer_queue_size (int): Maximum number of images waiting to be stored before the test waits for the disk
+            settle_time (float): Time in seconds without new images after the last tick before a cycle is finished
+            sync_capture (bool): Each tick waits until all cameras have delivered their image of that tick
+            capture_timeout (float): Maximum time in seconds to wait for the images of a tick in sync_capture mode
+            resume_folder (str): Result folder of an interrupted test. Cycles that are already completed with the same
+                settings are skipped
+            cycle_retries (int): Number of additional attempts of a cycle after the connection to the server was lost
+            reconnect_timeout (float): Maximum time in seconds to wait for a restarted server
+            host (str): IP address or host name of the carla server
+            port (int): RPC port of the carla server
+            tm_port (int): port of the traffic manager
+            log_name (str): Name of the logfile. Default is log + timestamp
+            persistent_rig (bool): Keep the vehicle and the cameras for all cycles. Between the cycles the vehicle is
+                moved back to the spawn point instead of being destroyed and spawned again
+            replay (bool): Record the trajectory of the vehicle once in a drive without cameras and replay it in all
+                cycles. The preparation phase only runs once and all cycles get identical frames apart from the
+                textures
+            trajectory (str): trajectory.json file or result folder of an earlier test whose trajectory is replayed
+                in all cycles. Implies replay
+            fast_prep (bool): Accelerate the vehicle with rendering disabled until it reaches the desired speed
+                instead of running ticks_prep rendered ticks with sleeps
+            prep_tick_length (float): Optional longer tick length in seconds during the fast preparation
+            profile (bool): Record the duration of ticks, waits and image writes, the sizes of the images and the
+                queue depths. The profile is written next to the logfile at the end of the test
+            weather_schedule (WeatherSchedule): weather that changes from tick to tick within every cycle. The weather
+                of every tick is stored as weather.json in the cycle folder
+            ground_truth (bool): Store the 2D boxes of the textured objects (default ROUND_TRAFFIC_SIGNS_TOWN7) in
+                every camera and tick as ground_truth.npz in the cycle folder (see util/ground_truth.py)
         """
         self.cameras = cameras
         self.name = name
@@ -100,12 +160,94 @@ class CarlaTestRun:
         self.ticks_prep = ticks_prep
         self.ticks = ticks
         self.tick_length = tick_length
-        self.result_folder = self.init_result_folder(folder)
+        self.town = town
+        self.host = host
+        self.port = port
+        self.tm_port = tm_port
+        self.log_name = log_name
+        self.profiler = make_profiler(profile)
+        self.ground_truth = ground_truth
+        if resume_folder:
+            self.result_folder = resume_folder
+            os.makedirs(self.result_folder, exist_ok=True)
+        else:
+            self.result_folder = self.init_result_folder(folder)
         self.spawn_point = spawn_point
+        self.weather_schedule = weather_schedule
+        self.weather = None
+        self.replay = replay or trajectory is not None
         self.logger = self.start_logging()
-        self.world, self.tm = carla_init(tick_length, self.logger, town)
+        self.manifest = RunManifest(self.result_folder, self.settings())
+        if resume_folder:
+            self.logger.info(f'Resuming test. Completed cycles: {self.manifest.completed_cycles()}')
+        self.cycle_retries = cycle_retries
+        self.reconnect_timeout = reconnect_timeout
+        self.vehicle = None
+        self.persistent_rig = persistent_rig
+        self.fast_prep = fast_prep
+        self.prep_tick_length = prep_tick_length
+        self.trajectory = None
+        if trajectory is not None:
+            self.trajectory = Trajectory.load(trajectory)
+        elif self.replay and os.path.exists(os.path.join(self.result_folder, TRAJECTORY_FILE)):
+            # resumed test. Replay the trajectory recorded before the interruption
+            self.trajectory = Trajectory.load(self.result_folder)
+        if self.trajectory is not None:
+            self.logger.info(f'Replaying trajectory with {len(self.trajectory)} ticks')
+            recorded_tick = self.trajectory.settings.get('tick_length', tick_length)
+            if recorded_tick != tick_length:
+                self.logger.warning(f'Trajectory was recorded with ticks of {recorded_tick} seconds')
+        self.connect()
+        self.settle_time = settle_time
+        self.sync_capture = sync_capture
+        self.capture_timeout = capture_timeout
+        self.writer = FrameWriter(writer_workers, writer_queue_size, self.logger, self.profiler)
+
+    def settings(self):
+        """returns all settings of the test that influence the resulting images"""
+        settings = {'name': self.name, 'spawn_point': self.spawn_point, 'ticks_prep': self.ticks_prep,
+                    'ticks': self.ticks, 'tick_length': self.tick_length, 'town': self.town,
+                    'cameras': [cam.settings() for cam in self.cameras]}
+        if self.weather is not None:
+            settings['weather'] = weather_to_dict(self.weather)
+        if self.weather_schedule is not None:
+            settings['weather_schedule'] = self.weather_schedule.to_dict()
+        if self.replay:
+            settings['replay'] = True
+        return settings
+
+    def connect(self):
+        """connects to the server and prepares the world for the test"""
+        self.world, self.tm, self.client = carla_init(self.tick_length, self.logger, self.town, self.host, self.port,
+                                                      self.tm_port)
+        self.blueprint_library = self.world.get_blueprint_library()
         self.spawn_location = self.spawn_transform()
         self.bp_vehicle = self.gen_vehicle_bp()
+        if self.weather is not None:
+            self.world.set_weather(self.weather)
+
+    def reconnect(self):
+        """waits for a restarted server and connects to it again"""
+        deadline = monotonic() + self.reconnect_timeout
+        while True:
+            try:
+                self.connect()
+                self.logger.info('Reconnected to server')
+                return
+            except RuntimeError as e:
+                if monotonic() > deadline:
+                    raise
+                self.logger.warning(f'Server not available ({e}). Trying again in 10 seconds')
+                with self.profiler.timer('sleep'):
+                    sleep(10)
+
+    def abort_cycle(self):
+        """cleans up after a cycle was interrupted by a lost connection"""
+        self.writer.flush()
+        try:
+            self.release_rig()
+        except RuntimeError:
+            self.vehicle = None
 
     def start_logging(self):
         """creates a logger that will log to both screen and logfile
@@ -117,8 +259,13 @@ class CarlaTestRun:
         # Setting up the logger
         logger = logging.getLogger('logger')
         logger.setLevel(logging.INFO)
+        # handlers of an earlier test in the same process, e.g. a shard worker, that was not ended properly
+        self.stop_logging(logger)
         formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
-        logfile = os.path.join(self.result_folder, 'log' + strftime('%Y%m%d_%H%M', localtime()) + '.log')
+        log_name = self.log_name or 'log' + strftime('%Y%m%d_%H%M', localtime())
+        # the profile is named after the logfile, e.g. log20240101_1200.log and profile20240101_1200.json
+        self.profile_name = 'profile' + log_name[3:] if log_name.startswith('log') else log_name + '_profile'
+        logfile = os.path.join(self.result_folder, log_name + '.log')
         file_handler = logging.FileHandler(logfile)
         file_handler.setLevel(logging.INFO)
         file_handler.setFormatter(formatter)
@@ -127,10 +274,13 @@ class CarlaTestRun:
         console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(formatter)
         logger.addHandler(console_handler)
+        for handler in (file_handler, console_handler):
+            handler.carla_test_run = True
 
         # Logging the Specification of the current test
         logger.info(self.name)
         logger.info(self.result_folder)
+        logger.info(f'Server: {self.host}:{self.port}')
         logger.info(f'Spawn Point: {self.spawn_point}')
         logger.info(f'Preparation Ticks: {self.ticks_prep}')
         logger.info(f'Recording Ticks: {self.ticks}')
@@ -139,6 +289,15 @@ class CarlaTestRun:
             cam.log_basic_info(logger)
         return logger
 
+    @staticmethod
+    def stop_logging(logger=None):
+        """removes and closes the handlers added by start_logging, so the next test in the same process doesn't write
+        into this logfile and log every line twice"""
+        logger = logger or logging.getLogger('logger')
+        for handler in [h for h in logger.handlers if getattr(h, 'carla_test_run', False)]:
+            logger.removeHandler(handler)
+            handler.close()
+
     def spawn_transform(self):
         """returns the transform of the spawn location and also moves the spectator there"""
         spawn_location = self.world.get_map().get_spawn_points()[self.spawn_point]
@@ -172,62 +331,349 @@ class CarlaTestRun:
         Args:
             weather: Weather object that defines the detailed weather conditions
         """
+        self.weather = weather
         self.world.set_weather(weather)
+        # cycles recorded with another weather don't count as completed
+        self.manifest.set_settings(self.settings())
         self.logger.info('Weather changed')
 
-    def single_test_cycle(self, test_cycle_name='Default'):
-        """ create subfolder for results
-
-        Args:
-            test_cycle_name: String for labeling the result folder
-        """
-        test_folder = os.path.join(self.result_folder, test_cycle_name)
-        if not os.path.exists(test_folder):
-            os.makedirs(test_folder)
-
-        # Spawning new vehicle at spawn point
+    def spawn_vehicle(self):
+        """spawns the vehicle at the spawn point and lets the traffic manager drive it"""
         self.logger.info('Spawning new vehicle at spawn point')
         vehicle = self.world.spawn_actor(self.bp_vehicle, self.spawn_location)
+        self.vehicle = vehicle
+        self.start_autopilot(vehicle)
+        return vehicle
+
+    def start_autopilot(self, vehicle):
         # car starts accelerating to 1 m/s
         vehicle.set_autopilot(True, self.tm.get_port())
-        self.tm.set_desired_speed(vehicle, 36.0)
+        self.tm.set_desired_speed(vehicle, DESIRED_SPEED)
         self.tm.ignore_signs_percentage(vehicle, 100.0)
+
+    def reset_rig(self):
+        """moves the vehicle with its attached cameras back to the spawn point and brings it to a standstill, so the
+        next cycle starts in the same state as with a newly spawned vehicle"""
+        self.logger.info('Moving vehicle back to spawn point')
+        vehicle = self.vehicle
+        vehicle.set_autopilot(False, self.tm.get_port())
+        vehicle.apply_control(carla.VehicleControl(hand_brake=True))
+        vehicle.set_transform(self.spawn_location)
+        vehicle.set_target_velocity(carla.Vector3D())
+        vehicle.set_target_angular_velocity(carla.Vector3D())
+        with self.profiler.timer('prep_tick'):
+            self.world.tick()
+        vehicle.apply_control(carla.VehicleControl())
+        self.start_autopilot(vehicle)
+        return vehicle
+
+    def prepare_vehicle(self, vehicle):
+        """accelerates the vehicle before the recording starts"""
+        if self.fast_prep:
+            self.fast_forward(vehicle)
+            return
         # Some ticks to accelerate the vehicle
         self.logger.info(f'Accelerating vehicle for {self.ticks_prep} ticks')
         for i in range(0, self.ticks_prep):
-            self.world.tick()
-            sleep(self.tick_length)
-        sleep(1)
+            with self.profiler.timer('prep_tick'):
+                self.world.tick()
+            with self.profiler.timer('sleep'):
+                sleep(self.tick_length)
+        with self.profiler.timer('sleep'):
+            sleep(1)
+
+    def fast_forward(self, vehicle):
+        """accelerates the vehicle with rendering disabled and optionally longer ticks until it reaches the desired
+        speed. Afterwards the recording settings are restored"""
+        settings = self.world.get_settings()
+        no_rendering_mode = settings.no_rendering_mode
+        fixed_delta_seconds = settings.fixed_delta_seconds
+        settings.no_rendering_mode = True
+        if self.prep_tick_length:
+            settings.fixed_delta_seconds = self.prep_tick_length
+        self.world.apply_settings(settings)
+
+        target_speed = DESIRED_SPEED / 3.6 * PREP_SPEED_FRACTION
+        max_ticks = max(self.ticks_prep, 1) * 10
+        ticks = 0
+        try:
+            while vehicle.get_velocity().length() < target_speed and ticks < max_ticks:
+                with self.profiler.timer('prep_tick'):
+                    self.world.tick()
+                ticks += 1
+        finally:
+            settings.no_rendering_mode = no_rendering_mode
+            settings.fixed_delta_seconds = fixed_delta_seconds
+            self.world.apply_settings(settings)
+        speed = vehicle.get_velocity().length()
+        if speed < target_speed:
+            self.logger.warning(f'Vehicle only reached {speed:.2f} m/s after {ticks} preparation ticks')
+        else:
+            self.logger.info(f'Vehicle reached {speed:.2f} m/s after {ticks} preparation ticks')
+
+    def replay_vehicle(self):
+        """prepares the vehicle for replaying the trajectory. Physics and autopilot are disabled, the vehicle is only
+        moved by setting the recorded transforms"""
+        vehicle = self.vehicle
+        if vehicle is None:
+            # spawned above the ground like for a live cycle, the recorded pose could collide with the road
+            self.logger.info('Spawning new vehicle for replay')
+            vehicle = self.world.spawn_actor(self.bp_vehicle, self.spawn_location)
+            self.vehicle = vehicle
+        else:
+            vehicle.set_autopilot(False, self.tm.get_port())
+        vehicle.set_simulate_physics(False)
+        vehicle.set_transform(self.trajectory.transform(0))
+        return vehicle
+
+    def record_trajectory(self):
+        """ drives the vehicle once without cameras and with rendering disabled and records its trajectory. All cycles,
+        including the first one, replay this trajectory, so every texture sees exactly the same frames
+
+        Returns:
+            trajectory (Trajectory): transform and speed of the vehicle for every recorded tick
+        """
+        if self.persistent_rig and self.vehicle is not None:
+            vehicle = self.reset_rig()
+        else:
+            vehicle = self.spawn_vehicle()
+        self.prepare_vehicle(vehicle)
+        self.logger.info(f'Recording trajectory for {self.ticks} ticks')
+        trajectory = Trajectory(settings=self.settings())
+        settings = self.world.get_settings()
+        no_rendering_mode = settings.no_rendering_mode
+        settings.no_rendering_mode = True
+        self.world.apply_settings(settings)
+        try:
+            for tick in range(0, self.ticks):
+                with self.profiler.timer('prep_tick'):
+                    self.world.tick()
+                trajectory.record(vehicle)
+        finally:
+            settings.no_rendering_mode = no_rendering_mode
+            self.world.apply_settings(settings)
+        self.trajectory = trajectory
+        self.logger.info(f'Trajectory recorded: {trajectory.save(self.result_folder)}')
+        return trajectory
+
+    def spawn_cameras(self, vehicle, rigs):
+        """ spawns all cameras of several camera objects with a single batch of commands and starts their listeners
+        afterwards, so the setup of all sensors only needs one round trip to the server
+
+        Args:
+            vehicle (Actor): The spawned vehicle where the cameras are attached
+            rigs ([RGBCamera]): camera objects without spawned cameras
+        """
+        commands = []
+        for cam in rigs:
+            for i in range(0, len(cam.test_list)):
+                commands.append(carla.command.SpawnActor(cam.setup_rgb_camera(self.blueprint_library, i),
+                                                         cam.transform, vehicle.id))
+        if not commands:
+            return
+        responses = self.client.apply_batch_sync(commands, False)
+        errors = [response.error for response in responses if response.error]
+        actor_ids = [response.actor_id for response in responses if not response.error]
+        if errors:
+            self.client.apply_batch_sync([carla.command.DestroyActor(actor_id) for actor_id in actor_ids], False)
+            raise RuntimeError(f'Spawning cameras failed: {errors[0]}')
+        actors = {actor.id: actor for actor in self.world.get_actors(actor_ids)}
+        start = 0
+        for cam in rigs:
+            count = len(cam.test_list)
+            cam.add_cameras([actors[actor_id] for actor_id in actor_ids[start:start + count]])
+            start += count
+        self.logger.info(f'Spawned {len(actor_ids)} cameras in one batch')
+
+    def release_rig(self):
+        """destroys the cameras and the vehicle"""
+        for cam in self.cameras:
+            cam.destroy_all()
+        if self.vehicle is not None:
+            self.logger.info('destroy vehicle')
+            self.vehicle.destroy()
+            self.vehicle = None
+
+    def single_test_cycle(self, test_cycle_name='Default', objects=None):
+        """ create subfolder for results
+
+        Args:
+            test_cycle_name: String for labeling the result folder
+            objects ([str]): names of the textured objects, used for the ground truth
+        """
+        test_folder = os.path.join(self.result_folder, test_cycle_name)
+        if not os.path.exists(test_folder):
+            os.makedirs(test_folder)
 
+        schedule = self.weather_schedule
+        weather_recorder = None
+        if schedule is not None:
+            weather_recorder = WeatherRecorder(schedule)
+            self.world.set_weather(schedule.weather(0))
+
+        if self.replay and self.trajectory is None:
+            self.record_trajectory()
+        trajectory = self.trajectory
+        if trajectory is not None:
+            # no preparation needed, the vehicle follows the recorded trajectory
+            if len(trajectory) < self.ticks:
+                raise ValueError(f'Trajectory has only {len(trajectory)} ticks, {self.ticks} needed')
+            vehicle = self.replay_vehicle()
+        else:
+            if self.persistent_rig and self.vehicle is not None:
+                # vehicle and cameras of the last cycle are reused
+                vehicle = self.reset_rig()
+            else:
+                # Spawning new vehicle at spawn point
+                vehicle = self.spawn_vehicle()
+            self.prepare_vehicle(vehicle)
+
+        barrier = TickBarrier(self.tick_length, self.capture_timeout, self.logger) if self.sync_capture else None
+        # cameras of a persistent rig are still attached from the last cycle
+        self.spawn_cameras(vehicle, [cam for cam in self.cameras if not cam.cameras])
+        for cam in self.cameras:
+            cam.set_output(test_folder, self.writer, barrier, self.ticks)
+        frames_per_tick = sum(len(cam.test_list) for cam in self.cameras)
+        boxes = BoxRecorder(self.world, objects or ROUND_TRAFFIC_SIGNS_TOWN7, self.cameras) if self.ground_truth \
+            else None
+        # in synchronous mode every tick advances the frame counter by one
+        frame0 = self.world.get_snapshot().frame + 1
         for cam in self.cameras:
-            cam.attach_cameras(self.world, vehicle, test_folder)
+            cam.start_recording(frame0)
+        if barrier:
+            barrier.start(frame0)
 
         # testcycle
-        global current_tick
+        profiler = self.profiler
+        weather_params = None
         for current_tick in range(0, self.ticks):
-            self.logger.info(f'Tick {current_tick} Speed {vehicle.get_velocity().length()} m/s')
-            self.world.tick()
-            # camera threads need time to save images
-            self.cameras[0].tick_sleep()
+            if schedule is not None:
+                params = schedule.params(current_tick)
+                if params != weather_params:
+                    self.world.set_weather(carla.WeatherParameters(**params))
+                    weather_params = params
+                weather_recorder.record(params)
+            if trajectory is not None:
+                vehicle.set_transform(trajectory.transform(current_tick))
+                self.logger.info(f'Tick {current_tick} Speed {trajectory.speed(current_tick)} m/s (replay)')
+            else:
+                self.logger.info(f'Tick {current_tick} Speed {vehicle.get_velocity().length()} m/s')
+            with profiler.timer('tick'):
+                self.world.tick()
+            if boxes is not None:
+                with profiler.timer('ground_truth'):
+                    boxes.record(current_tick, vehicle.get_transform())
+            if barrier:
+                # wait until all cameras have delivered the image of this tick
+                with profiler.timer('barrier_wait'):
+                    barrier.wait(current_tick)
+            # wait until the writer threads have space for the images of the next tick
+            self.writer.throttle(frames_per_tick)
+
+        # wait until all images are stored
+        self.writer.flush(0.0 if barrier else self.settle_time)
+        if barrier:
+            barrier.log_stats()
+        if weather_recorder is not None:
+            weather_recorder.save(test_folder)
+        if boxes is not None:
+            boxes.save(test_folder)
+
+        if self.persistent_rig:
+            for cam in self.cameras:
+                cam.close_output()
+        else:
+            self.release_rig()
+
+    def update_object_textures(self, image_path, objects, workers=TEXTURE_WORKERS, retries=TEXTURE_RETRIES):
+        """ paints the texture on all objects (e.g. traffic signs) at once
 
-        # give the camera threads enough time to save the images
-        sleep(10)
+        Args:
+            image_path (str): path of the texture image
+            objects ([str]): names of the objects that will get the new texture
+            workers (int): maximum number of parallel RPC calls
+            retries (int): number of additional attempts per object
 
-        for cam in self.cameras:
-            cam.destroy_all()
-        self.logger.info('destroy vehicle')
-        vehicle.destroy()
+        Returns:
+            results ([dict]): timing and result per object
 
-    def update_object_textures(self, image_path, objects):
-        # paint traffic sign on sign.
+        Raises:
+            RuntimeError: if the texture could not be applied to all objects. run_cycle repeats the cycle then
+        """
         self.logger.info(f'Applying Texture {image_path} to objects')
-        for o in objects:
-            update_texture(self.world, o, image_path, self.logger)
+        with self.profiler.timer('texture_update'):
+            return update_textures(self.world, objects, image_path, self.logger, workers, retries)
 
     def run_texture(self, textures, objects):
+        """ runs a test cycle for every texture. Cycles that are already completed according to the manifest of the
+        result folder are skipped. If the connection to the server is lost, the cycle is repeated after reconnecting.
+
+        Args:
+            textures ([[str, str]]): list of cycle names and texture files
+            objects ([str]): names of the objects that will get the textures
+        """
+        textures = [tex for tex in textures if not self.skip_cycle(tex[0])]
+        # compile all textures of the campaign before the first cycle, so no cycle has to wait for decoding images
+        for tex in textures:
+            default_store().load(tex[1])
         for tex in textures:
-            self.update_object_textures(tex[1], objects)
-            self.single_test_cycle(tex[0])
+            self.run_cycle(tex[0], tex[1], objects)
+
+    def run_weather_passes(self, textures, objects, weathers):
+        """ runs every texture once per weather. The cycles are named weather_texture like the shards of the
+        ShardScheduler. With replay=True, the trajectory of the first cycle is replayed in all passes, so the passes
+        only differ in the weather.
+
+        Args:
+            textures ([[str, str]]): list of cycle names and texture files
+            objects ([str]): names of the objects that will get the textures
+            weathers (dict): WeatherParameters or WeatherSchedule for every weather name
+        """
+        schedule = self.weather_schedule
+        try:
+            for weather_name, weather in weathers.items():
+                self.logger.info(f'Weather pass {weather_name}')
+                if isinstance(weather, WeatherSchedule):
+                    self.weather_schedule = weather
+                    self.manifest.set_settings(self.settings())
+                else:
+                    self.weather_schedule = None
+                    self.set_weather(weather)
+                self.run_texture([[f'{weather_name}_{tex[0]}', tex[1]] for tex in textures], objects)
+        finally:
+            self.weather_schedule = schedule
+            self.manifest.set_settings(self.settings())
+
+    def skip_cycle(self, test_cycle_name):
+        """checks if a cycle was already completed in an earlier run of the test"""
+        if self.manifest.is_complete(test_cycle_name):
+            self.logger.info(f'Skipping completed cycle {test_cycle_name}')
+            return True
+        return False
+
+    def run_cycle(self, test_cycle_name, texture=None, objects=None):
+        """ runs a single test cycle, records it in the manifest and repeats it after a lost connection
+
+        Args:
+            test_cycle_name (str): String for labeling the result folder
+            texture (str): texture file that is applied to the objects before the cycle
+            objects ([str]): names of the objects that will get the texture
+        """
+        self.manifest.start_cycle(test_cycle_name, texture)
+        for attempt in range(0, self.cycle_retries + 1):
+            try:
+                if texture:
+                    self.update_object_textures(texture, objects)
+                self.single_test_cycle(test_cycle_name, objects)
+                break
+            except RuntimeError as e:
+                self.logger.error(f'Cycle {test_cycle_name} interrupted: {e}')
+                self.abort_cycle()
+                if attempt == self.cycle_retries:
+                    raise
+                self.reconnect()
+        cameras = [folder for cam in self.cameras for folder in cam.folder_names()]
+        self.manifest.complete_cycle(test_cycle_name, cameras, self.ticks)
 
     def gen_vehicle_bp(self):
         # setting up vehicle
@@ -239,9 +685,18 @@ class CarlaTestRun:
         return bp_vehicle
 
     def end(self):
+        if self.persistent_rig:
+            self.release_rig()
+        self.writer.close()
+        shutdown_pool()
+        if self.profiler.enabled:
+            self.profiler.log_summary(self.logger)
+            json_path, csv_path = self.profiler.write(self.result_folder, self.profile_name)
+            self.logger.info(f'Profile written: {json_path}, {csv_path}')
         self.logger.info('switch back to real time mode')
         settings = self.world.get_settings()
         settings.synchronous_mode = False
         self.world.apply_settings(settings)
         self.logger.info('Test finished')
+        self.stop_logging(self.logger)
         print('Test finished')
@@ -0,0 +1,92 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Lists of camera tests, textures and sign objects. Kept free of carla, so the offline tools (dataset export, planner
+reports) can use them without the simulator.
+"""
+
+# list of all camera tests
+camera_tests = ['00_default_carla',
+                '01_default_new',
+                '02_auto_exposure',
+                '10_mblur_low',
+                '11_mblur_high',
+                '20_low_shutter_speed',
+                '21_high_shutter_speed',
+                '22_low_shutter_speed_iso',
+                '23_high_shutter_speed_iso',
+                '30_iso_400',
+                '31_iso_25',
+                '40_high_gamma',
+                '41_gamma_1.0',
+                '50_high_lensflare_intensity',
+                '60_small_f_stop',
+                '61_large_fstop',
+                '62_small_f_stop_iso',
+                '63_large_fstop_iso',
+                '70_npp'
+                ]
+
+# camera tests that are known to camera_utils.set_camera_test, but not part of the standard sweep
+EXTRA_CAMERA_TESTS = ['32_npp_iso1600',
+                      '70_distort_lens_circle_falloff_1',
+                      '71_distort_lens_circle_falloff_9',
+                      '72_lens_circle_multiplier_5',
+                      '73_lens_k_-10',
+                      '74_lens_k_10',
+                      '75_lens_kcube_-10',
+                      '76_lens_kcube_10',
+                      '80_lens_circle_multiplier_1',
+                      '81_lens_circle_multiplier_2',
+                      '82_lens_circle_multiplier_10'
+                      ]
+
+# the texture files you can apply to round texture_objects. The names have to be the same as in the classifier labels
+# of the tsr-collection repository
+TS_TEXTURE_CIRCLE = [
+    ['Speed_30', 'images\\textures_traffic_sign\\tempo30_512.png'],
+    ['Speed_40', 'images\\textures_traffic_sign\\tempo40_512.png'],
+    ['Speed_50', 'images\\textures_traffic_sign\\tempo50_512.png'],
+    ['Speed_60', 'images\\textures_traffic_sign\\tempo60_512.png'],
+    ['Speed_80', 'images\\textures_traffic_sign\\tempo80_512.png'],
+    ['Speed_100', 'images\\textures_traffic_sign\\tempo100_512.png'],
+    ['Speed_120', 'images\\textures_traffic_sign\\tempo120_512.png'],
+    ['No_Entry', 'images\\textures_traffic_sign\\Verbot_Einf_512.png'],
+    ['No_Vehicles', 'images\\textures_traffic_sign\\Verbot_alle_512.png'],
+    ['No_Over', 'images\\textures_traffic_sign\\Uehvb_alle_512.png'],
+    ['No_Over_Heavy', 'images\\textures_traffic_sign\\Uehvb_u2,8_512.png'],
+    ['No_Parking', 'images\\textures_traffic_sign\\Eg_Hvb.png'],
+    ['Ahead_Only', 'images\\textures_traffic_sign\\straight_ahead_512.png'],
+    ['Speed_80_End', 'images\\textures_traffic_sign\\ende80_512.png'],
+    ['Speed_60#Speed_50', 'images\\textures_traffic_sign\\morg_60_50.png'],
+    ['Speed_50#Speed_30', 'images\\textures_traffic_sign\\morg_50_30.png'],
+    ['Speed_80#Speed_60', 'images\\textures_traffic_sign\\morg_80_60.png'],
+    ['Speed_100#Speed_120', 'images\\textures_traffic_sign\\morg_100_120.png'],
+    ['Speed_30#Yield', 'images\\textures_traffic_sign\\sita_30_yield.png'],
+    ['Speed_120#Speed_30', 'images\\textures_traffic_sign\\sita_120-30.png'],
+    ['Speed_60#Speed_120', 'images\\textures_traffic_sign\\woit_60_120.png'],
+    ['KFC#Stop', 'images\\textures_traffic_sign\\sita_kfc_stop.png'],
+    ['Texaco#No_Over', 'images\\textures_traffic_sign\\sita_texaco_uebvb.png'],
+    ['Speed_100#Speed_30', 'images\\textures_traffic_sign\\tempo100#30-wei_512.png'],
+    ['Speed_40#Speed_60', 'images\\textures_traffic_sign\\jia_40_60.png']
+]
+
+# In a later version there can also be a test for stop signs and other octagonal texture objects.
+TS_TEXTURE_OCTO = [[]]
+
+# map specific street signs. Only usable for tests in World Town7_attacked
+ROUND_TRAFFIC_SIGNS_TOWN7 = [
+    'BP_Tempo64_2',
+    'BP_Tempo65_5',
+    'BP_Tempo66_8',
+    'BP_Tempo67_11',
+    'BP_Tempo68_14',
+    'BP_Tempo69_17',
+    'BP_Tempo70_2',
+    'BP_Tempo71_5',
+    'BP_Tempo72_2',
+    'BP_Tempo73_5',
+    'BP_Tempo74_8',
+    'BP_Tempo75_11',
+    'BP_Tempo76_14',
+    'BP_Tempo77_17'
+]
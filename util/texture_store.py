@@ -0,0 +1,165 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+persistent store of compiled textures. Images are decoded only once into RGBA arrays and kept on disk as .npy files
+that can be memory mapped by every test process.
+"""
+
+from argparse import ArgumentParser
+import hashlib
+import os
+
+import numpy as np
+from PIL import Image
+
+# default folder for compiled textures. Can be changed with the environment variable CARLA_TEXTURE_STORE
+STORE_FOLDER = os.environ.get('CARLA_TEXTURE_STORE', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'images', '_compiled'))
+
+# channel policies for the alpha channel
+ALPHA_OPAQUE = 'opaque'  # alpha channel of the image is ignored and replaced by max opacity (carla default)
+ALPHA_KEEP = 'keep'  # alpha channel of the image is kept
+
+TEXTURE_FOLDERS = ['images/textures_traffic_sign', 'images/textures_road']
+IMAGE_EXTENSIONS = ('.png', '.bmp', '.jpg', '.jpeg')
+
+
+def file_hash(imgfile):
+    """returns the sha1 hash of the content of a file"""
+    sha = hashlib.sha1()
+    with open(imgfile, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def decode_texture(imgfile, size=None, alpha=ALPHA_OPAQUE):
+    """ decodes an image file into a (height, width, 4) RGBA array of uint8.
+
+    Args:
+        imgfile (str): path of the texture image
+        size ((int, int)): optional (width, height) the image is resized to
+        alpha (str): channel policy for the alpha channel (ALPHA_OPAQUE or ALPHA_KEEP)
+
+    Returns:
+        rgba (ndarray): pixel data of the image
+    """
+    image = Image.open(imgfile).convert('RGBA')
+    if size and tuple(size) != image.size:
+        image = image.resize(tuple(size), Image.BILINEAR)
+    rgba = np.array(image, dtype=np.uint8)
+    if alpha == ALPHA_OPAQUE:
+        rgba[:, :, 3] = 255
+    return rgba
+
+
+class TextureStore:
+    """Folder of compiled textures. Entries are keyed by the hash of the source file, the size and the alpha policy,
+    so a changed image automatically leads to a new entry. Outdated entries of the same image are removed."""
+
+    def __init__(self, folder=STORE_FOLDER):
+        """
+        Args:
+            folder (str): folder for the compiled .npy files
+        """
+        self.folder = folder
+
+    @staticmethod
+    def entry_name(imgfile):
+        """returns the part of the entry name that identifies the source file independent of its content"""
+        name = os.path.splitext(os.path.basename(imgfile))[0].replace('_', '-')
+        path_hash = hashlib.sha1(os.path.abspath(imgfile).encode('utf-8')).hexdigest()[:8]
+        return f'{name}-{path_hash}'
+
+    def entry_path(self, imgfile, size=None, alpha=ALPHA_OPAQUE):
+        """returns the path of the compiled entry of an image for the current content of the file"""
+        size_key = f'{size[0]}x{size[1]}' if size else 'native'
+        file_key = file_hash(imgfile)[:16]
+        return os.path.join(self.folder, f'{self.entry_name(imgfile)}_{file_key}_{size_key}_{alpha}.npy')
+
+    def compile(self, imgfile, size=None, alpha=ALPHA_OPAQUE):
+        """ decodes an image and stores it in the store. Stale entries of the same image are deleted.
+
+        Returns:
+            path (str): path of the compiled entry
+        """
+        path = self.entry_path(imgfile, size, alpha)
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        rgba = decode_texture(imgfile, size, alpha)
+        # write to a temporary file first, so other processes never see half written entries
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, rgba)
+        os.replace(tmp_path, path)
+        self.remove_stale(path)
+        return path
+
+    def remove_stale(self, path):
+        """deletes all entries of the same image, size and alpha policy that were compiled from an older file version"""
+        name, file_key, size_key, alpha = os.path.basename(path)[:-4].split('_')
+        for entry in os.listdir(self.folder):
+            if not entry.endswith('.npy') or entry.count('_') != 3:
+                continue
+            e_name, e_file_key, e_size_key, e_alpha = entry[:-4].split('_')
+            if (e_name, e_size_key, e_alpha) == (name, size_key, alpha) and e_file_key != file_key:
+                try:
+                    os.remove(os.path.join(self.folder, entry))
+                except OSError:
+                    # might be in use or already removed by another process
+                    pass
+
+    def load(self, imgfile, size=None, alpha=ALPHA_OPAQUE):
+        """ returns the compiled texture of an image as read only memory mapped array. Missing, stale or broken
+        entries are rebuilt automatically.
+
+        Args:
+            imgfile (str): path of the texture image
+            size ((int, int)): optional (width, height) the image is resized to
+            alpha (str): channel policy for the alpha channel (ALPHA_OPAQUE or ALPHA_KEEP)
+
+        Returns:
+            rgba (ndarray): (height, width, 4) array of uint8
+        """
+        path = self.entry_path(imgfile, size, alpha)
+        if os.path.exists(path):
+            try:
+                return np.load(path, mmap_mode='r')
+            except (ValueError, OSError):
+                # broken entry, e.g. from an interrupted process
+                pass
+        return np.load(self.compile(imgfile, size, alpha), mmap_mode='r')
+
+
+_default_store = None
+
+
+def default_store():
+    """returns the texture store in the default folder"""
+    global _default_store
+    if _default_store is None:
+        _default_store = TextureStore()
+    return _default_store
+
+
+def compile_folders(folders=None, store=None):
+    """ compiles all images in the texture folders
+
+    Args:
+        folders ([str]): folders with texture images
+        store (TextureStore): target store. Default store if not set
+    """
+    store = store or default_store()
+    for folder in folders or TEXTURE_FOLDERS:
+        for file in sorted(os.listdir(folder)):
+            imgfile = os.path.join(folder, file)
+            if os.path.isfile(imgfile) and file.lower().endswith(IMAGE_EXTENSIONS):
+                print(f'compiling {imgfile}')
+                store.load(imgfile)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('folders', type=str, nargs='*', help='Folders with texture images', default=TEXTURE_FOLDERS)
+    parser.add_argument('-store', type=str, help='Folder of the compiled textures', default=STORE_FOLDER)
+    args = parser.parse_args()
+    compile_folders(args.folders, TextureStore(args.store))
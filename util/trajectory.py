@@ -0,0 +1,61 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Recording and replay of the vehicle trajectory. The trajectory of the first cycle is recorded tick by tick, all later
+cycles set the recorded transforms directly. This way the preparation phase only runs once and all cycles see exactly
+the same frames.
+"""
+
+import json
+import os
+
+import carla
+
+TRAJECTORY_FILE = 'trajectory.json'
+
+
+class Trajectory:
+    """transform and speed of the vehicle for every recorded tick"""
+
+    def __init__(self, poses=None, settings=None):
+        """
+        Args:
+            poses ([[float]]): x, y, z, pitch, yaw, roll and speed for every tick
+            settings (dict): settings of the test the trajectory was recorded with
+        """
+        self.poses = poses or []
+        self.settings = settings or {}
+
+    def __len__(self):
+        return len(self.poses)
+
+    def record(self, vehicle):
+        """adds the current transform and speed of the vehicle as next tick"""
+        t = vehicle.get_transform()
+        self.poses.append([t.location.x, t.location.y, t.location.z,
+                           t.rotation.pitch, t.rotation.yaw, t.rotation.roll,
+                           vehicle.get_velocity().length()])
+
+    def transform(self, tick):
+        """returns the recorded transform of a tick"""
+        x, y, z, pitch, yaw, roll = self.poses[tick][:6]
+        return carla.Transform(carla.Location(x=x, y=y, z=z), carla.Rotation(pitch=pitch, yaw=yaw, roll=roll))
+
+    def speed(self, tick):
+        """returns the recorded speed of a tick in m/s"""
+        return self.poses[tick][6]
+
+    def save(self, folder):
+        """stores the trajectory as trajectory.json in a folder"""
+        path = os.path.join(folder, TRAJECTORY_FILE)
+        with open(path, 'w') as f:
+            json.dump({'settings': self.settings, 'poses': self.poses}, f)
+        return path
+
+    @staticmethod
+    def load(path):
+        """loads a trajectory from a trajectory.json file or a folder containing one"""
+        if os.path.isdir(path):
+            path = os.path.join(path, TRAJECTORY_FILE)
+        with open(path) as f:
+            data = json.load(f)
+        return Trajectory(data['poses'], data.get('settings'))
@@ -3,59 +3,92 @@ Copyright (c) 2024 Friedrich Zimmer
 scripts and lists for texture management of traffic signs
 """
 
-from PIL import Image
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
 import carla
 
-# the texture files you can apply to round texture_objects. The names have to be the same as in the classifier labels
-# of the tsr-collection repository
-TS_TEXTURE_CIRCLE = [
-    ['Speed_30', 'images\\textures_traffic_sign\\tempo30_512.png'],
-    ['Speed_40', 'images\\textures_traffic_sign\\tempo40_512.png'],
-    ['Speed_50', 'images\\textures_traffic_sign\\tempo50_512.png'],
-    ['Speed_60', 'images\\textures_traffic_sign\\tempo60_512.png'],
-    ['Speed_80', 'images\\textures_traffic_sign\\tempo80_512.png'],
-    ['Speed_100', 'images\\textures_traffic_sign\\tempo100_512.png'],
-    ['Speed_120', 'images\\textures_traffic_sign\\tempo120_512.png'],
-    ['No_Entry', 'images\\textures_traffic_sign\\Verbot_Einf_512.png'],
-    ['No_Vehicles', 'images\\textures_traffic_sign\\Verbot_alle_512.png'],
-    ['No_Over', 'images\\textures_traffic_sign\\Uehvb_alle_512.png'],
-    ['No_Over_Heavy', 'images\\textures_traffic_sign\\Uehvb_u2,8_512.png'],
-    ['No_Parking', 'images\\textures_traffic_sign\\Eg_Hvb.png'],
-    ['Ahead_Only', 'images\\textures_traffic_sign\\straight_ahead_512.png'],
-    ['Speed_80_End', 'images\\textures_traffic_sign\\ende80_512.png'],
-    ['Speed_60#Speed_50', 'images\\textures_traffic_sign\\morg_60_50.png'],
-    ['Speed_50#Speed_30', 'images\\textures_traffic_sign\\morg_50_30.png'],
-    ['Speed_80#Speed_60', 'images\\textures_traffic_sign\\morg_80_60.png'],
-    ['Speed_100#Speed_120', 'images\\textures_traffic_sign\\morg_100_120.png'],
-    ['Speed_30#Yield', 'images\\textures_traffic_sign\\sita_30_yield.png'],
-    ['Speed_120#Speed_30', 'images\\textures_traffic_sign\\sita_120-30.png'],
-    ['Speed_60#Speed_120', 'images\\textures_traffic_sign\\woit_60_120.png'],
-    ['KFC#Stop', 'images\\textures_traffic_sign\\sita_kfc_stop.png'],
-    ['Texaco#No_Over', 'images\\textures_traffic_sign\\sita_texaco_uebvb.png'],
-    ['Speed_100#Speed_30', 'images\\textures_traffic_sign\\tempo100#30-wei_512.png'],
-    ['Speed_40#Speed_60', 'images\\textures_traffic_sign\\jia_40_60.png']
-]
-
-# In a later version there can also be a test for stop signs and other octagonal texture objects.
-TS_TEXTURE_OCTO = [[]]
-
-# map specific street signs. Only usable for tests in World Town7_attacked
-ROUND_TRAFFIC_SIGNS_TOWN7 = [
-    'BP_Tempo64_2',
-    'BP_Tempo65_5',
-    'BP_Tempo66_8',
-    'BP_Tempo67_11',
-    'BP_Tempo68_14',
-    'BP_Tempo69_17',
-    'BP_Tempo70_2',
-    'BP_Tempo71_5',
-    'BP_Tempo72_2',
-    'BP_Tempo73_5',
-    'BP_Tempo74_8',
-    'BP_Tempo75_11',
-    'BP_Tempo76_14',
-    'BP_Tempo77_17'
-]
+from util.test_lists import TS_TEXTURE_CIRCLE, TS_TEXTURE_OCTO, ROUND_TRAFFIC_SIGNS_TOWN7  # noqa: F401
+from util.texture_store import default_store
+
+# maximum number of converted textures that are kept in memory. A TextureColor of a 512x512 image needs about 1 MB
+TEXTURE_CACHE_SIZE = 8
+
+# number of parallel RPC calls when a texture is applied to several objects
+TEXTURE_WORKERS = 8
+# number of additional attempts for objects where applying the texture failed
+TEXTURE_RETRIES = 2
+# waiting time in seconds before the first retry. It doubles with every further attempt, so a busy server gets time to
+# recover
+TEXTURE_RETRY_DELAY = 0.2
+
+# converted textures, ordered from least to most recently used
+_texture_cache = OrderedDict()
+
+
+def load_texture_array(imgfile):
+    """ returns an image file as (height, width, 4) RGBA array of uint8. The array is memory mapped from the compiled
+    texture store, so the image only gets decoded again after it has been changed.
+
+    Args:
+        imgfile (str): path of the texture image
+
+    Returns:
+        rgba (ndarray): pixel data of the image
+    """
+    # alpha channel from original image is ignored. Instead, max opacity is applied (default policy of the store)
+    return default_store().load(imgfile)
+
+
+def build_texture(rgba):
+    """ creates a carla TextureColor out of an RGBA array
+
+    Args:
+        rgba (ndarray): (height, width, 4) array of uint8
+
+    Returns:
+        texture (TextureColor): texture that can be applied to objects
+    """
+    h, w = rgba.shape[:2]
+    texture = carla.TextureColor(w, h)
+    # the Python API only offers setting single pixels. Converting the whole array to nested lists at once and
+    # binding the methods locally keeps the per pixel overhead as low as possible.
+    tex_set = texture.set
+    color = carla.Color
+    for y, row in enumerate(rgba.tolist()):
+        for x, (r, g, b, a) in enumerate(row):
+            tex_set(x, y, color(r, g, b, a))
+    return texture
+
+
+def get_texture(imgfile, logger=None):
+    """ returns the converted texture of an image file. Each file is only converted once as long as it stays in the
+    cache.
+
+    Args:
+        imgfile (str): path of the texture image
+        logger (Logger): Logger object for showing and recording the progress
+
+    Returns:
+        texture (TextureColor): texture that can be applied to objects
+    """
+    if imgfile in _texture_cache:
+        _texture_cache.move_to_end(imgfile)
+        return _texture_cache[imgfile]
+
+    if logger:
+        logger.info('Converting texture ' + imgfile)
+    texture = build_texture(load_texture_array(imgfile))
+    _texture_cache[imgfile] = texture
+    while len(_texture_cache) > TEXTURE_CACHE_SIZE:
+        _texture_cache.popitem(last=False)
+    return texture
+
+
+def clear_texture_cache():
+    """ removes all converted textures from memory """
+    _texture_cache.clear()
 
 
 def update_texture(world, obj, imgfile, logger):
@@ -63,24 +96,97 @@ def update_texture(world, obj, imgfile, logger):
     Material of that object needs to be a Material instance of M_Materialmaster """
 
     logger.info('Texture applying ' + imgfile + ' to ' + obj)
-    image = Image.open(imgfile)
-    h = image.size[1]
-    w = image.size[0]
-
-    texture = carla.TextureColor(w, h)
-
-    for x in range(0, w):
-        for y in range(0, h):
-            color = image.getpixel((x, y))
-            # color = image[x, y]
-            r = int(color[0])
-            g = int(color[1])
-            b = int(color[2])
-            # alpha channel from original image is ignored. Instead, max opacity is applied
-            a = 255
-            texture.set(x, y, carla.Color(r, g, b, a))
+    texture = get_texture(imgfile, logger)
 
     world.apply_color_texture_to_object(obj, carla.MaterialParameter.Diffuse, texture)
     # the following could be used if also a texture for other effect needs to be applied
     # world.apply_color_texture_to_object(obj, carla.MaterialParameter.Normal, texture)
     # world.apply_color_texture_to_object(obj, carla.MaterialParameter.AO_Roughness_Metallic_Emissive, texture)
+
+
+def apply_texture(world, obj, texture, retries=TEXTURE_RETRIES, retry_delay=TEXTURE_RETRY_DELAY):
+    """ applies a converted texture to a single object and retries with exponential backoff in case the RPC call fails
+
+    Args:
+        world (World): The currently loaded map
+        obj (str): name of the object
+        texture (TextureColor): converted texture
+        retries (int): number of additional attempts
+        retry_delay (float): waiting time in seconds before the first retry, doubled for every further retry
+
+    Returns:
+        result (dict): duration in seconds, number of attempts and the error message if all attempts failed
+    """
+    start = perf_counter()
+    error = None
+    for attempt in range(1, retries + 2):
+        if attempt > 1:
+            sleep(retry_delay * 2 ** (attempt - 2))
+        try:
+            world.apply_color_texture_to_object(obj, carla.MaterialParameter.Diffuse, texture)
+            error = None
+            break
+        except RuntimeError as e:
+            # e.g. timeout of the connection to the server
+            error = str(e)
+    return {'object': obj, 'seconds': perf_counter() - start, 'attempts': attempt, 'error': error}
+
+
+def apply_texture_to_objects(world, objects, texture, logger, workers=TEXTURE_WORKERS, retries=TEXTURE_RETRIES):
+    """ applies one converted texture to many objects at once. The RPC calls are sent by a bounded pool of threads,
+    so the latency is about one round trip instead of one per object.
+
+    Args:
+        world (World): The currently loaded map
+        objects ([str]): names of the objects that will get the new texture
+        texture (TextureColor): converted texture
+        logger (Logger): Logger object for showing and recording the progress
+        workers (int): maximum number of parallel RPC calls
+        retries (int): number of additional attempts per object
+
+    Returns:
+        results ([dict]): timing and result per object in the order of objects
+
+    Raises:
+        RuntimeError: if the texture could not be applied to an object after all retries. Otherwise the cycle would
+            record the previous texture under the name of the new one
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(objects)))) as pool:
+        results = list(pool.map(lambda obj: apply_texture(world, obj, texture, retries), objects))
+    failed = []
+    for result in results:
+        if result['error']:
+            logger.error(f'Texture could not be applied to {result["object"]} after {result["attempts"]} attempts: '
+                         f'{result["error"]}')
+            failed.append(result['object'])
+        else:
+            logger.info(f'Texture applied to {result["object"]} in {result["seconds"]:.3f} s '
+                        f'({result["attempts"]} attempts)')
+    if failed:
+        raise RuntimeError(f'Texture could not be applied to {len(failed)} of {len(objects)} objects: {failed}')
+    return results
+
+
+def update_textures(world, objects, imgfile, logger, workers=TEXTURE_WORKERS, retries=TEXTURE_RETRIES):
+    """ converts an image once and applies the resulting texture to several objects in parallel
+
+    Args:
+        world (World): The currently loaded map
+        objects ([str]): names of the objects that will get the new texture
+        imgfile (str): path of the texture image
+        logger (Logger): Logger object for showing and recording the progress
+        workers (int): maximum number of parallel RPC calls
+        retries (int): number of additional attempts per object
+
+    Returns:
+        results ([dict]): timing and result per object
+
+    Raises:
+        RuntimeError: if the texture could not be applied to all objects
+    """
+    texture = get_texture(imgfile, logger)
+    logger.info(f'Texture applying {imgfile} to {len(objects)} objects')
+    start = perf_counter()
+    results = apply_texture_to_objects(world, objects, texture, logger, workers, retries)
+    logger.info(f'Texture applied to {len(objects)} objects in {perf_counter() - start:.3f} s')
+    return results
@@ -1,10 +1,19 @@
 """
 Copyright (c) 2024 Friedrich Zimmer
-defines several weather conditions that can be used in various tests
+defines several weather conditions that can be used in various tests and schedules that change the weather from tick
+to tick within one test cycle
 """
 
 import carla
 
+from util.weather_data import load_weather, weather_to_dict, WeatherRecorder, WEATHER_FIELDS, WEATHER_FILE  # noqa: F401
+
+# modes of a schedule
+MODE_INTERPOLATE = 'interpolate'  # parameters change linearly between the keyframes
+MODE_STEP = 'step'  # parameters of a keyframe are kept until the next keyframe
+# parameters in degrees that wrap around at 360 and are interpolated along the shorter arc
+ANGLE_FIELDS = ['sun_azimuth_angle']
+
 
 def heavy_rain():
     return carla.WeatherParameters(
@@ -78,6 +87,70 @@ def town7_default():
     )
 
 
+def interpolate(field, start, end, share):
+    """returns the value of a weather parameter at a share between two keyframes"""
+    if field in ANGLE_FIELDS:
+        return (start + share * ((end - start + 180.0) % 360.0 - 180.0)) % 360.0
+    return start + share * (end - start)
+
+
+class WeatherSchedule:
+    """weather for every tick of a test cycle, defined by keyframes.
+
+    Example:
+        # fog rises from the default weather to dense fog within the 500 recorded ticks
+        schedule = WeatherSchedule([(0, town7_default()), (499, foggy())])
+        # four weathers, each for a quarter of the cycle
+        schedule = WeatherSchedule.steps([town7_default(), foggy(), heavy_rain(), sunset(0)], 500)
+    """
+
+    def __init__(self, keyframes, mode=MODE_INTERPOLATE, name=None):
+        """
+        Args:
+            keyframes ([(int, WeatherParameters or dict)]): ticks and the weather at these ticks. Every tick may
+                only have one keyframe
+            mode (str): MODE_INTERPOLATE or MODE_STEP
+            name (str): optional name of the schedule
+        """
+        self.keyframes = sorted(((int(tick), weather_to_dict(weather)) for tick, weather in keyframes),
+                                key=lambda keyframe: keyframe[0])
+        if not self.keyframes:
+            raise ValueError('A weather schedule needs at least one keyframe')
+        ticks = [keyframe[0] for keyframe in self.keyframes]
+        if len(set(ticks)) < len(ticks):
+            raise ValueError(f'A weather schedule can only have one keyframe per tick: {ticks}')
+        self.mode = mode
+        self.name = name
+
+    @staticmethod
+    def steps(weathers, ticks, name=None):
+        """creates a schedule that splits the ticks of a cycle evenly between several weathers"""
+        if len(weathers) > ticks:
+            raise ValueError(f'{len(weathers)} weathers can not be split between {ticks} ticks')
+        length = ticks / len(weathers)
+        return WeatherSchedule([(round(i * length), weather) for i, weather in enumerate(weathers)], MODE_STEP, name)
+
+    def params(self, tick):
+        """returns the weather parameters of a tick as dictionary"""
+        before = self.keyframes[0]
+        for keyframe in self.keyframes:
+            if keyframe[0] > tick:
+                if self.mode == MODE_STEP or keyframe[0] == before[0] or tick < before[0]:
+                    break
+                share = (tick - before[0]) / (keyframe[0] - before[0])
+                return {field: interpolate(field, before[1][field], keyframe[1][field], share)
+                        for field in WEATHER_FIELDS}
+            before = keyframe
+        return dict(before[1])
+
+    def weather(self, tick):
+        """returns the weather of a tick as WeatherParameters"""
+        return carla.WeatherParameters(**self.params(tick))
+
+    def to_dict(self):
+        return {'name': self.name, 'mode': self.mode, 'keyframes': self.keyframes}
+
+
 if __name__ == '__main__':
     # manually changing weather
     client = carla.Client('127.0.0.1', 2000)
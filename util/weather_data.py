@@ -0,0 +1,57 @@
+"""
+Copyright (c) 2024 Friedrich Zimmer
+Weather parameters as plain dictionaries and the weather.json file of the cycle folders. Doesn't need carla, so the
+offline tools (replay, effects, distortion, dataset export) can read the recorded weather without the simulator.
+"""
+
+import json
+import os
+
+# parameters of carla.WeatherParameters that are changed by the schedules
+WEATHER_FIELDS = ['cloudiness', 'precipitation', 'precipitation_deposits', 'wind_intensity', 'sun_azimuth_angle',
+                  'sun_altitude_angle', 'fog_density', 'fog_distance', 'fog_falloff', 'wetness',
+                  'scattering_intensity', 'mie_scattering_scale', 'rayleigh_scattering_scale', 'dust_storm']
+# values of parameters that older carla versions and weather dictionaries don't have
+WEATHER_DEFAULTS = {'dust_storm': 0.0}
+# file in the cycle folder with the weather of every recorded tick
+WEATHER_FILE = 'weather.json'
+
+
+def weather_to_dict(weather):
+    """returns the parameters of a WeatherParameters object or a dictionary of parameters as dictionary with all
+    WEATHER_FIELDS. Missing parameters get their value from WEATHER_DEFAULTS"""
+    if not isinstance(weather, dict):
+        weather = {field: getattr(weather, field) for field in WEATHER_FIELDS if hasattr(weather, field)}
+    return {field: float(weather[field] if field in weather else WEATHER_DEFAULTS[field]) for field in WEATHER_FIELDS}
+
+
+class WeatherRecorder:
+    """collects the weather of every recorded tick of a cycle and stores it as weather.json in the cycle folder"""
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.ticks = {field: [] for field in WEATHER_FIELDS}
+
+    def record(self, params):
+        for field in WEATHER_FIELDS:
+            self.ticks[field].append(params[field])
+
+    def save(self, folder):
+        path = os.path.join(folder, WEATHER_FILE)
+        with open(path, 'w') as f:
+            json.dump({'schedule': self.schedule.to_dict(), 'ticks': self.ticks}, f)
+        return path
+
+
+def load_weather(cycle_folder):
+    """ returns the recorded weather parameters of every tick of a cycle folder
+
+    Returns:
+        ticks ([dict]): weather parameters per tick. Empty if the cycle had no weather schedule
+    """
+    path = os.path.join(cycle_folder, WEATHER_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        columns = json.load(f)['ticks']
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]